@@ -1,56 +1,302 @@
 import pdfplumber
-import os 
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import argparse
+import glob
+import hashlib
+import json
+import os
+import time
+
+# Page time limits, the memory probe and the PDFium fast path are shared with the server's
+# extractor (toby/pdfBackends.py, toby/pdfExtract.py); install them with `pip install -e toby`
+from pdfBackends import PdfiumExtractor, pdfium, release_page
+from pdfExtract import PageTimeout, current_rss_mb, time_limit
+
+# "auto": pages without ruled tables are read with PDFium, the rest with pdfplumber;
+# "pdfplumber": every page through pdfplumber
+PDF_BACKEND = os.getenv("PDF_BACKEND", "auto")
+
+# Extraction budgets, overridable per call or through the environment (0 disables a limit)
+PAGE_TIMEOUT = float(os.getenv("PDF_PAGE_TIMEOUT", "10"))
+DOC_TIMEOUT = float(os.getenv("PDF_DOC_TIMEOUT", "120"))
+MAX_RSS_MB = float(os.getenv("PDF_MAX_RSS_MB", "2048"))
+
+
+def _center_in_bboxes(obj, bboxes):
+    """True if the centre of a layout object falls inside any of the bboxes."""
+    x = (obj["x0"] + obj["x1"]) / 2
+    y = (obj["top"] + obj["bottom"]) / 2
+    for x0, top, x1, bottom in bboxes:
+        if x0 <= x <= x1 and top <= y <= bottom:
+            return True
+    return False
+
+
+def _extract_page(page):
+    found = page.find_tables()
+    tables = []
+    for table in found:
+        rows = table.extract()
+        tables.append([[cell if cell is not None else "" for cell in row] for row in rows])
+
+    bboxes = [table.bbox for table in found]
+    text_page = page.filter(lambda obj: not _center_in_bboxes(obj, bboxes)) if bboxes else page
+    text = text_page.extract_text(layout=True) or ""
+    return tables, text
+
+
+def iter_pages(pdf_path, page_timeout=PAGE_TIMEOUT, doc_timeout=DOC_TIMEOUT, max_rss_mb=MAX_RSS_MB,
+               backend=PDF_BACKEND):
+    """
+    Yields one structured record per page of the PDF.
+
+    Tables and free text are kept apart: words that sit inside a detected
+    table's bounding box are removed from the page text, so table content is
+    only reported once (in "tables").
+
+    Each page's layout cache is released after it is processed, so memory stays
+    flat in the page count. A page that exceeds page_timeout is skipped; when the
+    document exceeds doc_timeout or the process exceeds max_rss_mb, extraction
+    stops. In both cases a record carrying a "warning" is yielded so callers get
+    partial output instead of a blocked worker. Pass 0/None to disable a limit.
+
+    With backend "auto" (and pypdfium2 installed), pages without ruled tables skip
+    pdfplumber's layout analysis and are read with PDFium; their text is plain
+    reading-order text rather than layout-padded.
+
+    Args:
+        pdf_path: Path to the PDF file.
+        page_timeout: Seconds allowed per page.
+        doc_timeout: Seconds allowed for the whole document.
+        max_rss_mb: Resident memory ceiling in MB.
+        backend: "auto" or "pdfplumber" (default PDF_BACKEND).
+
+    Yields:
+        dict: {"page": 1-based page number,
+               "tables": list of tables, each a list of rows of cell strings,
+               "text": layout text of the page outside the tables,
+               "backend": "pdfium" or "pdfplumber",
+               "warning": present only if the page was skipped or extraction stopped}
+    """
+    started = time.monotonic()
+    fast = PdfiumExtractor(pdf_path) if backend == "auto" and pdfium is not None else None
+
+    try:
+        with pdfplumber.open(pdf_path) as pdf:
+
+            total_pages = len(pdf.pages)
+            for page_number, page in enumerate(pdf.pages, start=1):
+
+                if doc_timeout and time.monotonic() - started > doc_timeout:
+                    yield {"page": page_number, "tables": [], "text": "",
+                           "warning": f"Stopped at page {page_number} of {total_pages}: document time budget of {doc_timeout}s exceeded"}
+                    return
+                if max_rss_mb and current_rss_mb() > max_rss_mb:
+                    yield {"page": page_number, "tables": [], "text": "",
+                           "warning": f"Stopped at page {page_number} of {total_pages}: memory ceiling of {max_rss_mb} MB exceeded"}
+                    return
+
+                try:
+                    with time_limit(page_timeout):
+                        if fast is not None and not fast.has_table(page_number - 1):
+                            used, tables, text = "pdfium", [], fast.page_text(page_number - 1)
+                        else:
+                            used, (tables, text) = "pdfplumber", _extract_page(page)
+                except PageTimeout:
+                    yield {"page": page_number, "tables": [], "text": "",
+                           "warning": f"Page {page_number} skipped: page time budget of {page_timeout}s exceeded"}
+                    continue
+                finally:
+                    release_page(page)
+
+                yield {"page": page_number, "tables": tables, "text": text, "backend": used}
+    finally:
+        if fast is not None:
+            fast.close()
+
+
+def format_page(record):
+    """Render a page record as the plain-text block used for AI prompts."""
+    parts = []
+    if record.get("warning"):
+        parts.append(f"\n--- Extraction Warning ---\n{record['warning']}\n")
+    for i, table in enumerate(record["tables"]):
+        parts.append(f"\n--- Table {i+1} ---\n")
+        for row in table:
+            parts.append(" | ".join(row) + "\n")
+
+    if record["text"].strip():
+        parts.append(f"\n--- Page Text ---\n{record['text']}\n")
+
+    return "".join(parts)
+
+
+def write_jsonl(records, out, source=None):
+    """
+    Streams page records to an open text file as JSON Lines.
+
+    Args:
+        records: Iterable of page records (e.g. from iter_pages).
+        out: Writable text file object.
+        source: Optional source file name added to every record.
+
+    Returns:
+        int: Number of records written.
+    """
+    count = 0
+    for record in records:
+        if source is not None:
+            record = {"source": source, **record}
+        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        count += 1
+    return count
+
 
 def process_pdf(pdf_path):
-    extracted_data = ''
-
-    with pdfplumber.open(pdf_path) as pdf:
-
-        for page in pdf.pages:
-
-            tables = page.extract_tables()
-
-            if tables: 
-                for i, table in enumerate(tables):
-                    extracted_data += f"\n--- Table {i+1} ---\n"
-                    for row in table:
-            
-                        clean_row = [cell if cell is not None else "" for cell in row]
-                        extracted_data += " | ".join(clean_row) + "\n"
-            
-            # Extract text
-            text = page.extract_text(layout=True)
-            if text:
-                extracted_data += f"\n--- Page Text ---\n{text}\n"
-            
-    return extracted_data
-
-# Testing
-def main(): 
-
-    files_to_test = [
-        "Altavita Safety Design Sheet(Product 1).pdf"
-    ]
-    
-    # Store all combined results for the AI
-    final_output = ""
-
-    for file_name in files_to_test:
-        if os.path.exists(file_name):
-    
-            # Run your extraction function
-            content = process_pdf(file_name)
-            
-            # Format the output for the AI
-            header = f"SOURCE FILE: {file_name} \n"
-            final_output += header + content
+    """Extracts a PDF into a single prompt-ready string (tables, then text, per page)."""
+    return "".join(format_page(record) for record in iter_pages(pdf_path))
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    """Content hash of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def extract_document(pdf_path, sha256):
+    """
+    Process-pool worker: extracts one PDF into a single JSONL-ready record.
 
+    Returns:
+        dict: {"source", "sha256", "pages" (pages extracted, not counting warning
+              records), "seconds", "records"} on success, or {"source", "sha256",
+              "error", "seconds"} if extraction failed.
+    """
+    started = time.perf_counter()
+    try:
+        records = list(iter_pages(pdf_path))
+    except Exception as e:
+        return {"source": pdf_path, "sha256": sha256, "error": str(e),
+                "seconds": round(time.perf_counter() - started, 3)}
+    result = {
+        "source": pdf_path,
+        "sha256": sha256,
+        "pages": sum("warning" not in record for record in records),
+        "seconds": round(time.perf_counter() - started, 3),
+        "records": records,
+    }
+    warnings = [record["warning"] for record in records if "warning" in record]
+    if warnings:
+        result["warnings"] = warnings
+    return result
+
+
+def collect_pdfs(inputs):
+    """Expands directories (recursively) and glob patterns into a sorted list of PDF paths."""
+    paths = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            matches = glob.glob(os.path.join(item, "**", "*.pdf"), recursive=True)
+            matches += glob.glob(os.path.join(item, "**", "*.PDF"), recursive=True)
         else:
-            print(f"Error: {file_name} not found in the current directory.")
-    
-    with open("ai_input_debug.txt", "w", encoding="utf-8") as f:
-        f.write(final_output)
+            matches = glob.glob(item, recursive=True) or ([item] if os.path.exists(item) else [])
+        paths.update(m for m in matches if os.path.isfile(m))
+    return sorted(paths)
+
+
+def load_manifest(manifest_path):
+    """
+    Reads the content hashes already extracted successfully from a JSONL manifest.
+    Hashes whose latest entry is an error are left out, so those files are retried.
+    """
+    status = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    status[entry["sha256"]] = entry.get("status", "ok")
+                except (ValueError, KeyError):
+                    continue  # Partial last line from an interrupted run
+    return {sha256 for sha256, latest in status.items() if latest == "ok"}
+
+
+def extract_batch(inputs, out_path, manifest_path, workers=None):
+    """
+    Extracts every PDF under the given directories/globs in parallel.
+
+    One JSONL record per document is appended to out_path. A document's hash is
+    added to the manifest only after its record has been flushed, so an
+    interrupted run can be restarted and will skip finished files (including
+    renamed copies with the same content); files that failed are retried.
+
+    Args:
+        inputs: Directories, glob patterns or file paths.
+        out_path: JSONL output file (appended to).
+        manifest_path: JSONL manifest of processed content hashes (appended to).
+        workers: Process count. Defaults to the number of CPUs.
+
+    Returns:
+        dict: {"processed", "skipped", "failed", "pages", "seconds"}
+    """
+    started = time.perf_counter()
+    done = load_manifest(manifest_path)
+    stats = {"processed": 0, "skipped": 0, "failed": 0, "pages": 0}
+
+    pending = {}
+    for path in collect_pdfs(inputs):
+        sha256 = file_sha256(path)
+        if sha256 in done or sha256 in pending:
+            stats["skipped"] += 1
+        else:
+            pending[sha256] = path
+
+    with open(out_path, "a", encoding="utf-8") as out, \
+            open(manifest_path, "a", encoding="utf-8") as manifest, \
+            ProcessPoolExecutor(max_workers=workers) as pool:
+
+        futures = [pool.submit(extract_document, path, sha256) for sha256, path in pending.items()]
+        try:
+            for future in as_completed(futures):
+                result = future.result()
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                out.flush()
+                manifest.write(json.dumps({"sha256": result["sha256"], "source": result["source"],
+                                           "status": "error" if "error" in result else "ok"}) + "\n")
+                manifest.flush()
+
+                if "error" in result:
+                    stats["failed"] += 1
+                    print(f"Error: {result['source']}: {result['error']}")
+                else:
+                    stats["processed"] += 1
+                    stats["pages"] += result["pages"]
+        except KeyboardInterrupt:
+            print("Interrupted - finished documents are recorded in the manifest; rerun to resume.")
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    stats["seconds"] = round(time.perf_counter() - started, 3)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract PDFs (e.g. a supplier SDS archive) to JSONL")
+    parser.add_argument("inputs", nargs="*", default=["Altavita Safety Design Sheet(Product 1).pdf"],
+                        help="PDF files, directories or glob patterns")
+    parser.add_argument("--out", default="extracted.jsonl", help="JSONL output, one record per document")
+    parser.add_argument("--manifest", default="extracted.manifest.jsonl",
+                        help="Content-hash manifest used to skip finished files")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    args = parser.parse_args()
+
+    stats = extract_batch(args.inputs, args.out, args.manifest, workers=args.workers)
+    print(f"Processed {stats['processed']} documents ({stats['pages']} pages), "
+          f"skipped {stats['skipped']}, failed {stats['failed']} in {stats['seconds']}s")
 
 
 if __name__ == '__main__':
-    main() 
\ No newline at end of file
+    main()
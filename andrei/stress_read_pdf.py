@@ -0,0 +1,106 @@
+"""
+Stress test for read_pdf.iter_pages: generates a large synthetic PDF (text plus a ruled
+table on every page) and samples RSS while streaming it, to show memory stays flat in
+the page count now that each page's layout cache is released.
+
+Usage:
+    python stress_read_pdf.py                      # 1000 pages
+    python stress_read_pdf.py --pages 5000 --max-growth-mb 64
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from read_pdf import current_rss_mb, iter_pages
+
+
+def _page_content(page_number):
+    """PDF content stream for one page: a few text lines and a 3x4 ruled table."""
+    ops = ["BT /F1 11 Tf 50 780 Td 14 TL"]
+    ops.append(f"(SAFETY DATA SHEET - page {page_number}) Tj T*")
+    for line in range(20):
+        ops.append(f"(Line {line}: Ethanol 64-17-5 H225 Highly flammable liquid and vapour.) Tj T*")
+    ops.append("ET")
+
+    # Ruled table: 4 rows x 3 columns starting at y=400
+    left, right, top, row_height = 50, 500, 400, 20
+    columns = [50, 200, 350, 500]
+    for row in range(5):
+        y = top - row * row_height
+        ops.append(f"{left} {y} m {right} {y} l S")
+    for x in columns:
+        ops.append(f"{x} {top} m {x} {top - 4 * row_height} l S")
+    for row in range(4):
+        y = top - row * row_height - 14
+        for col, cell in enumerate(("Ingredient", "64-17-5", f"{row * 10}%")):
+            ops.append(f"BT /F1 10 Tf {columns[col] + 5} {y} Td ({cell}) Tj ET")
+    return "\n".join(ops).encode("latin-1")
+
+
+def write_synthetic_pdf(path, pages):
+    """Writes a valid multi-page PDF without any third-party dependency."""
+    offsets = []
+    with open(path, "wb") as f:
+        def obj(number, body):
+            offsets.append((number, f.tell()))
+            f.write(f"{number} 0 obj\n".encode() + body + b"\nendobj\n")
+
+        f.write(b"%PDF-1.4\n")
+        page_ids = [4 + 2 * i for i in range(pages)]
+        obj(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        kids = " ".join(f"{pid} 0 R" for pid in page_ids)
+        obj(2, f"<< /Type /Pages /Kids [{kids}] /Count {pages} >>".encode())
+        obj(3, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+        for i, pid in enumerate(page_ids):
+            content = _page_content(i + 1)
+            obj(pid, f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                     f"/Resources << /Font << /F1 3 0 R >> >> /Contents {pid + 1} 0 R >>".encode())
+            obj(pid + 1, f"<< /Length {len(content)} >>\nstream\n".encode() + content + b"\nendstream")
+
+        xref_at = f.tell()
+        total = 2 * pages + 4
+        f.write(f"xref\n0 {total}\n0000000000 65535 f \n".encode())
+        for _, offset in sorted(offsets):
+            f.write(f"{offset:010d} 00000 n \n".encode())
+        f.write(f"trailer\n<< /Size {total} /Root 1 0 R >>\nstartxref\n{xref_at}\n%%EOF\n".encode())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory stress test for read_pdf.iter_pages")
+    parser.add_argument("--pages", type=int, default=1000)
+    parser.add_argument("--max-growth-mb", type=float, default=64.0,
+                        help="Fail if RSS grows by more than this between the first and last sample")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, f"stress_{args.pages}.pdf")
+        write_synthetic_pdf(path, args.pages)
+        print(f"Generated {args.pages}-page PDF ({os.path.getsize(path) / 1e6:.1f} MB)")
+
+        started = time.perf_counter()
+        samples = []
+        tables = 0
+        step = max(args.pages // 10, 1)
+        for record in iter_pages(path, page_timeout=0, doc_timeout=0, max_rss_mb=0):
+            tables += len(record["tables"])
+            if record["page"] % step == 0:
+                samples.append((record["page"], current_rss_mb()))
+                print(f"  page {record['page']:>6}: RSS {samples[-1][1]:8.1f} MB")
+        elapsed = time.perf_counter() - started
+
+    # Ignore the first sample's warm-up (fonts, parser state) and compare the rest
+    baseline = samples[0][1]
+    growth = max(rss for _, rss in samples) - baseline
+    print(f"{args.pages} pages, {tables} tables in {elapsed:.1f}s ({args.pages / elapsed:.1f} pages/s)")
+    print(f"RSS growth after page {samples[0][0]}: {growth:.1f} MB (limit {args.max_growth_mb} MB)")
+    if growth > args.max_growth_mb:
+        print("FAIL: memory is not flat in the page count")
+        sys.exit(1)
+    print("OK: memory is flat in the page count")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+TARIC Bulk Import Script
+
+Streams an official EU nomenclature export (TARIC3 XML or CSV) into Supabase or a
+local SQLite store. The XML is read with an incremental parser that discards each
+element once it has been turned into a record, and CSV rows are read one at a time,
+so a multi-hundred-megabyte export is never held in memory. Records are normalised
+through parse_taric_code / format_taric_code and written in batches.
+
+Only declarable lines are kept (product-line suffix 80), plus, with --current-only,
+only lines whose validity has not ended.
+
+Usage:
+    python import_taric.py nomenclature.xml                     # -> Supabase taric_codes
+    python import_taric.py nomenclature.csv --sink sqlite --db taric.db
+    python import_taric.py export.xml --sink sqlite --snapshot ../toby/taric_snapshot.bin
+"""
+
+import argparse
+import csv
+import os
+import re
+import sqlite3
+import sys
+import time
+import xml.etree.ElementTree as ET
+from datetime import date, datetime
+from typing import Dict, Iterator, List, Optional
+
+from seed_taric import TARIC_BASE_URL, format_taric_code, invalidate_lookup_caches, parse_taric_code, upsert_codes
+
+BATCH_SIZE = 500
+DECLARABLE_SUFFIX = "80"
+
+# Element / column names used by the different export flavours (matched without namespace, case-insensitive)
+RECORD_TAGS = {"goods.nomenclature", "goodsnomenclature", "nomenclature", "record"}
+CODE_FIELDS = ("goods.nomenclature.item.id", "goodsnomenclatureitemid", "goods code", "goods_code", "cn code", "cn_code", "code")
+SUFFIX_FIELDS = ("producline.suffix", "productline.suffix", "productlinesuffix", "product line suffix", "suffix")
+DESCRIPTION_FIELDS = ("description", "goods.nomenclature.description", "goodsnomenclaturedescription", "text")
+START_FIELDS = ("validity.start.date", "validitystartdate", "start date", "start_date", "valid_from")
+END_FIELDS = ("validity.end.date", "validityenddate", "end date", "end_date", "valid_to")
+
+_DESCRIPTION_INDENT = re.compile(r"^[\s\-–]+")
+DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%d.%m.%Y", "%d-%m-%Y", "%Y%m%d")
+
+
+def _local(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1].lower()
+
+
+def _first(fields: Dict[str, str], names) -> str:
+    for name in names:
+        value = fields.get(name)
+        if value and value.strip():
+            return value.strip()
+    return ""
+
+
+def parse_date(value: str) -> Optional[str]:
+    """ISO date for an export date (2024-01-31, 31/01/2024, 31.01.2024, 20240131; time ignored), or None."""
+    value = value.strip().split(" ")[0].split("T")[0]
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+
+def normalize_record(fields: Dict[str, str], current_only: bool = False) -> Optional[Dict]:
+    """
+    Turns one export row (lower-cased field name -> text) into a taric_codes record.
+
+    Returns None for non-declarable lines, codes that are not 8/10 digits, and (with
+    current_only) lines whose validity has ended.
+    """
+    digits = re.sub(r"\D", "", _first(fields, CODE_FIELDS))
+    suffix = _first(fields, SUFFIX_FIELDS)
+    if len(digits) == 12 and not suffix:  # "0101 21 00 00 80": code followed by the suffix
+        digits, suffix = digits[:10], digits[10:]
+    if len(digits) == 8:  # CN code without the TARIC subdivision
+        digits += "00"
+    if len(digits) != 10 or (suffix and suffix != DECLARABLE_SUFFIX):
+        return None
+
+    valid_to = parse_date(_first(fields, END_FIELDS))
+    if current_only and valid_to and valid_to < date.today().isoformat():
+        return None
+
+    description = " ".join(_DESCRIPTION_INDENT.sub("", _first(fields, DESCRIPTION_FIELDS)).split())
+    if not description:
+        return None
+    return {
+        **parse_taric_code(format_taric_code(digits)),
+        "description": description,
+        "description_short": description[:255],
+        "valid_from": parse_date(_first(fields, START_FIELDS)),
+        "valid_to": valid_to,
+        "source_url": f"{TARIC_BASE_URL}/",
+    }
+
+
+def iter_xml_rows(path: str) -> Iterator[Dict[str, str]]:
+    """
+    Field dicts for each record element, parsed incrementally and freed as it goes.
+
+    Only innermost record elements are yielded: a record tag that wraps another one
+    (TARIC3 <oub:record> around <oub:goods.nomenclature>) is an envelope, not a row.
+    """
+    parents = []
+    records = []  # Per open record element: whether it contains another record
+    for event, elem in ET.iterparse(path, events=("start", "end")):
+        is_record = _local(elem.tag) in RECORD_TAGS
+        if event == "start":
+            parents.append(elem)
+            if is_record:
+                records.append(False)
+            continue
+        parents.pop()
+        if is_record:
+            wrapper = records.pop()
+            if records:
+                records[-1] = True
+            if not wrapper:
+                fields = {}
+                for child in elem.iter():
+                    if child is not elem and child.text and child.text.strip():
+                        fields.setdefault(_local(child.tag), child.text)
+                fields.update({_local(k): v for k, v in elem.attrib.items()})
+                yield fields
+        # Outside any record, a finished element (record or wrapper) is never read
+        # again: detach it so nothing parsed so far stays referenced from the root
+        if not records:
+            elem.clear()
+            if parents:
+                parents[-1].remove(elem)
+
+
+def iter_csv_rows(path: str) -> Iterator[Dict[str, str]]:
+    """Field dicts for each CSV row (header names lower-cased); delimiter sniffed."""
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        sample = f.read(64 * 1024)
+        f.seek(0)
+        dialect = csv.Sniffer().sniff(sample, delimiters=",;\t|")
+        for row in csv.DictReader(f, dialect=dialect):
+            yield {(key or "").strip().lower(): value for key, value in row.items() if isinstance(value, str)}
+
+
+def iter_records(path: str, current_only: bool = False, stats: Optional[Dict] = None) -> Iterator[Dict]:
+    """Normalised records from an XML or CSV export (format chosen by extension)."""
+    rows = iter_xml_rows(path) if path.lower().endswith(".xml") else iter_csv_rows(path)
+    for fields in rows:
+        record = normalize_record(fields, current_only)
+        if stats is not None:
+            stats["rows"] += 1
+            stats["skipped"] += record is None
+        if record is not None:
+            yield record
+
+
+class SupabaseSink:
+    """Upserts batches into taric_codes through the seed_taric loader."""
+
+    def write(self, batch: List[Dict]) -> int:
+        return upsert_codes(batch, batch_size=len(batch), verbose=False)
+
+    def close(self):
+        invalidate_lookup_caches()
+
+
+class SQLiteSink:
+    """Local store with the taric_codes columns (upsert on code)."""
+
+    COLUMNS = ("code", "code_numeric", "chapter", "heading", "subheading", "description",
+               "description_short", "valid_from", "valid_to", "source_url")
+
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS taric_codes ({', '.join(self.COLUMNS)}, PRIMARY KEY (code))")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_taric_codes_heading ON taric_codes(heading)")
+
+    def write(self, batch: List[Dict]) -> int:
+        with self.conn:
+            self.conn.executemany(
+                f"INSERT OR REPLACE INTO taric_codes ({', '.join(self.COLUMNS)}) VALUES ({', '.join('?' * len(self.COLUMNS))})",
+                [tuple(record.get(column) for column in self.COLUMNS) for record in batch],
+            )
+        return len(batch)
+
+    def iter_records(self) -> Iterator[Dict]:
+        cursor = self.conn.execute(f"SELECT {', '.join(self.COLUMNS)} FROM taric_codes ORDER BY code")
+        for row in cursor:
+            yield dict(zip(self.COLUMNS, row))
+
+    def close(self):
+        self.conn.close()
+
+
+def import_export(path: str, sink, batch_size: int = BATCH_SIZE, current_only: bool = False) -> Dict:
+    """Streams an export into a sink in batches. Returns row / skipped / written counts."""
+    stats = {"rows": 0, "skipped": 0, "written": 0}
+    batch = []
+    for record in iter_records(path, current_only, stats):
+        batch.append(record)
+        if len(batch) >= batch_size:
+            stats["written"] += sink.write(batch)
+            batch = []
+            if stats["written"] % (batch_size * 20) == 0:
+                print(f"  {stats['written']} codes written ({stats['rows']} rows read)")
+    if batch:
+        stats["written"] += sink.write(batch)
+    return stats
+
+
+def _peak_rss_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream an official TARIC export into the database")
+    parser.add_argument("export", help="TARIC3 XML or CSV export")
+    parser.add_argument("--sink", choices=["supabase", "sqlite"], default="supabase")
+    parser.add_argument("--db", default="taric.db", help="SQLite file for --sink sqlite")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--current-only", action="store_true", help="Skip lines whose validity has ended")
+    parser.add_argument("--snapshot", help="Also write a toby taricSnapshot file (sqlite sink only)")
+    args = parser.parse_args()
+
+    sink = SQLiteSink(args.db) if args.sink == "sqlite" else SupabaseSink()
+    print(f"Importing {args.export} ({os.path.getsize(args.export) / 1e6:.1f} MB) into {args.sink}...")
+    start = time.time()
+    try:
+        stats = import_export(args.export, sink, args.batch_size, args.current_only)
+        if args.snapshot and isinstance(sink, SQLiteSink):
+            sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "toby"))
+            from taricSnapshot import write_snapshot
+            print(f"Wrote {write_snapshot(sink.iter_records(), args.snapshot)} codes to {args.snapshot}")
+    finally:
+        sink.close()
+
+    elapsed = time.time() - start
+    peak = _peak_rss_mb()
+    print(f"Read {stats['rows']} rows, skipped {stats['skipped']}, wrote {stats['written']} codes in {elapsed:.1f}s "
+          f"({stats['rows'] / max(elapsed, 1e-6):,.0f} rows/s)" + (f"; peak RSS {peak:.0f} MB" if peak else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -8,14 +8,19 @@ Usage:
     python seed_taric.py --chapter 30          # Seed only Chapter 30 (pharma)
     python seed_taric.py --all                  # Seed all chapters
     python seed_taric.py --update              # Check for updates only
+    python seed_taric.py --verify codes.txt    # Bulk-verify a file of codes
 """
 
 import os
 import json
+import hashlib
 import requests
 import argparse
+import csv
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Tuple
 from supabase import create_client, Client
 from dotenv import load_dotenv
 import time
@@ -27,10 +32,17 @@ load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL") or os.getenv("VITE_SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_KEY")  # Use service key for write access
 
-if not SUPABASE_URL or not SUPABASE_KEY:
-    raise ValueError("SUPABASE_URL and SUPABASE_SERVICE_KEY are required. Set them in .env")
+_supabase: Optional[Client] = None
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+def get_supabase() -> Client:
+    """Supabase client, created on first use so offline helpers (fetching, parsing) work without credentials."""
+    global _supabase
+    if _supabase is None:
+        if not SUPABASE_URL or not SUPABASE_KEY:
+            raise ValueError("SUPABASE_URL and SUPABASE_SERVICE_KEY are required. Set them in .env")
+        _supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+    return _supabase
 
 # EU TARIC API endpoints
 TARIC_BASE_URL = "https://ec.europa.eu/taxation_customs/dds2/taric"
@@ -138,6 +150,21 @@ CHAPTER_30_CODES = [
 ]
 
 
+def upsert_codes(records: List[Dict], batch_size: int = 50, verbose: bool = True) -> int:
+    """Upsert code records into taric_codes in batches; returns the number of rows sent successfully."""
+    written = 0
+    for i in range(0, len(records), batch_size):
+        batch = records[i:i+batch_size]
+        try:
+            get_supabase().table("taric_codes").upsert(batch, on_conflict="code").execute()
+            written += len(batch)
+            if verbose:
+                print(f"  Inserted batch {i//batch_size + 1}: {len(batch)} codes")
+        except Exception as e:
+            print(f"  Error inserting batch: {e}")
+    return written
+
+
 def seed_chapter_30():
     """Seed Chapter 30 pharmaceutical codes"""
     print("Seeding Chapter 30 (Pharmaceutical Products)...")
@@ -153,99 +180,449 @@ def seed_chapter_30():
         })
     
     # Insert in batches
-    batch_size = 50
-    for i in range(0, len(codes_to_insert), batch_size):
-        batch = codes_to_insert[i:i+batch_size]
-        try:
-            result = supabase.table("taric_codes").upsert(batch, on_conflict="code").execute()
-            print(f"  Inserted batch {i//batch_size + 1}: {len(batch)} codes")
-        except Exception as e:
-            print(f"  Error inserting batch: {e}")
+    upsert_codes(codes_to_insert)
     
+    invalidate_lookup_caches()
     print(f"Completed: {len(codes_to_insert)} Chapter 30 codes seeded")
 
 
-def fetch_eu_taric_updates(since_date: Optional[str] = None) -> List[Dict]:
+# EU sources checked by --update (same as the tariff-scraper edge function). Override with
+# --sources or TARIC_UPDATE_SOURCES pointing at a JSON list of {"name", "url", "format"}.
+# Only structured formats yield change sets: "json" = list of change dicts, "xml" / "csv"
+# = a nomenclature export (as read by import_taric.py). Any other format ("html", "rss")
+# is a notice: recorded in taric_news for review, never applied to taric_codes.
+TARIC_UPDATE_SOURCES = [
+    {"name": "EU Official Journal", "url": "https://eur-lex.europa.eu/oj/direct-access.html", "format": "html"},
+    {"name": "DG TAXUD News", "url": "https://taxation-customs.ec.europa.eu/news_en", "format": "html"},
+    {"name": "EU Trade Updates", "url": "https://policy.trade.ec.europa.eu/news_en", "format": "html"},
+]
+
+TARIC_CACHE_DIR = os.getenv("TARIC_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".taric_cache"))
+
+STRUCTURED_FORMATS = ("json", "xml", "csv")
+REGULATION_PATTERN = re.compile(r"(?:Implementing\s+)?Regulation\s+\((?:EU|EC)\)\s+(?:No\s+)?\d{2,4}/\d+", re.IGNORECASE)
+
+
+def load_update_sources(path: Optional[str] = None) -> List[Dict]:
+    """Update sources from a JSON file (argument or TARIC_UPDATE_SOURCES env var), else the defaults."""
+    path = path or os.getenv("TARIC_UPDATE_SOURCES")
+    if not path:
+        return TARIC_UPDATE_SOURCES
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _cache_paths(url: str, cache_dir: str):
+    key = hashlib.sha1(url.encode()).hexdigest()
+    return os.path.join(cache_dir, f"{key}.body"), os.path.join(cache_dir, f"{key}.meta.json")
+
+
+def _write_atomic(path: str, data: bytes):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def fetch_source(source: Dict, cache_dir: str = TARIC_CACHE_DIR, timeout: int = 30) -> Dict:
     """
-    Fetch TARIC updates from EU sources.
-    
-    Note: The EU TARIC consultation system is complex. For MVP, we'll:
-    1. Check the EU Official Journal for updates
-    2. Parse regulation PDFs for changes
-    
-    For production, consider using:
-    - TARIC3 database exports (available to member states)
-    - Commercial TARIC data providers
+    Conditionally fetches one source, caching the raw response on disk.
+
+    Sends If-None-Match / If-Modified-Since from the previous fetch. A 304, or a 200
+    whose body hashes the same as the cached copy, counts as unchanged. Nothing is
+    written here: save_fetch() stores the body and validators once the document's
+    changes have been applied, so a failed parse or apply is retried next run.
+
+    Returns:
+        dict: {"source", "status": "changed" | "unchanged" | "error", "body"?: bytes,
+               "meta"?: validators to save, "error"?: str}
     """
-    # This is a placeholder - actual implementation would need to:
-    # 1. Scrape/parse EU Official Journal
-    # 2. Monitor DG TAXUD updates
-    # 3. Use TARIC3 consultation service
-    
-    print("Checking for TARIC updates from EU...")
-    # For MVP, return empty - implement actual scraping later
+    body_path, meta_path = _cache_paths(source["url"], cache_dir)
+    meta = {}
+    if os.path.exists(meta_path):
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+
+    headers = {"User-Agent": "EasyShipAI-TARIC-Updater/1.0"}
+    if meta.get("etag"):
+        headers["If-None-Match"] = meta["etag"]
+    if meta.get("last_modified"):
+        headers["If-Modified-Since"] = meta["last_modified"]
+
+    try:
+        response = requests.get(source["url"], headers=headers, timeout=timeout)
+    except requests.RequestException as e:
+        return {"source": source, "status": "error", "error": str(e)}
+
+    if response.status_code == 304:
+        return {"source": source, "status": "unchanged"}
+    if response.status_code != 200:
+        return {"source": source, "status": "error", "error": f"HTTP {response.status_code}"}
+
+    body = response.content
+    content_sha256 = hashlib.sha256(body).hexdigest()
+    new_meta = {
+        "url": source["url"],
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "sha256": content_sha256,
+        "fetched_at": datetime.utcnow().isoformat(),
+    }
+    unchanged = content_sha256 == meta.get("sha256") and os.path.exists(body_path)
+    return {"source": source, "status": "unchanged" if unchanged else "changed", "body": body, "meta": new_meta}
+
+
+def save_fetch(result: Dict, cache_dir: str = TARIC_CACHE_DIR):
+    """Stores a fetch_source result's body and validators, making it the baseline for the next run."""
+    if not result.get("meta"):
+        return
+    os.makedirs(cache_dir, exist_ok=True)
+    body_path, meta_path = _cache_paths(result["source"]["url"], cache_dir)
+    if result["status"] == "changed":
+        _write_atomic(body_path, result["body"])
+    _write_atomic(meta_path, json.dumps(result["meta"]).encode())
+
+
+def _export_changes(source: Dict, body: bytes) -> List[Dict]:
+    """Current declarable lines of an XML / CSV nomenclature export as new_code changes (upserts)."""
+    import tempfile
+    from import_taric import iter_records
+
+    fd, path = tempfile.mkstemp(suffix=f".{source['format']}")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(body)
+        return [
+            {
+                "code": record["code"],
+                "change_type": "new_code",
+                "old_value": None,
+                "new_value": {key: record[key] for key in ("description", "description_short", "valid_from", "valid_to")},
+                "regulation": None,
+                "effective_date": record["valid_from"],
+                "source_url": source["url"],
+            }
+            for record in iter_records(path, current_only=True)
+        ]
+    finally:
+        os.unlink(path)
+
+
+def parse_source_document(source: Dict, body: bytes) -> List[Dict]:
+    """
+    Turns a changed structured source document into change records.
+
+    "json" sources carry change dicts directly ({"code", "change_type", "new_value", ...},
+    optionally wrapped as {"changes": [...]}); "xml" / "csv" sources are nomenclature
+    exports whose lines become new_code changes. Other formats carry no changes (see
+    parse_notice).
+    """
+    fmt = source.get("format", "html")
+    if fmt == "json":
+        data = json.loads(body)
+        changes = data.get("changes", []) if isinstance(data, dict) else data
+        return [
+            {**change, "code": format_taric_code(change["code"]), "source_url": change.get("source_url", source["url"])}
+            for change in changes if change.get("code") and change.get("change_type")
+        ]
+    if fmt in ("xml", "csv"):
+        return _export_changes(source, body)
     return []
 
 
-def check_for_updates():
-    """Check for updates in TARIC codes and update database"""
-    updates = fetch_eu_taric_updates()
+def parse_notice(source: Dict, body: bytes) -> Dict:
+    """
+    A taric_news row for a changed unstructured source (news page, feed). Free text is
+    not scanned for codes: numbers laid out like a code there are as often phone
+    numbers, document ids or dates, so notices are left for review, never applied.
+    """
+    text = body.decode("utf-8", errors="replace")
+    text = re.sub(r"(?is)<(script|style)\b.*?</\1>", " ", text)
+    title = re.search(r"(?is)<title[^>]*>(.*?)</title>", text)
+    text = re.sub(r"\s+", " ", re.sub(r"<[^>]+>", " ", text))
+    regulations = list(dict.fromkeys(match.group(0) for match in REGULATION_PATTERN.finditer(text)))
+    name = source.get("name", source["url"])
+    return {
+        "title": " ".join(title.group(1).split()) if title else name,
+        "summary": "Regulations mentioned: " + "; ".join(regulations[:20]) if regulations else None,
+        "source_url": source["url"],
+        "source_name": name[:100],
+        "change_type": "notice",
+    }
+
+
+def fetch_eu_taric_updates(since_date: Optional[str] = None, sources: Optional[List[Dict]] = None,
+                           cache_dir: str = TARIC_CACHE_DIR) -> Tuple[List[Dict], List[Dict], List[Dict]]:
+    """
+    Fetch TARIC updates from EU sources.
+
+    All sources are fetched concurrently with conditional requests (ETag /
+    If-Modified-Since); raw responses are cached on disk and only documents that
+    changed since the last run are parsed, so this is cheap to run frequently.
+    Structured sources yield changes; other changed sources yield a notice only.
+
+    Args:
+        since_date: Optional ISO date; changes with an earlier effective_date are dropped.
+        sources: Source list (defaults to load_update_sources()).
+        cache_dir: Directory for cached responses and validators.
+
+    Returns:
+        (updates, notices, fetched): change dicts {"code", "change_type", "old_value",
+        "new_value", "regulation", "effective_date", "source_url"}, taric_news rows
+        from parse_notice, and the fetch_source results to pass to save_fetch() once
+        both are stored (documents that failed to parse are left out, so they are
+        fetched again).
+    """
+    sources = sources if sources is not None else load_update_sources()
+    print(f"Checking {len(sources)} EU sources for TARIC updates...")
+    if not sources:
+        return [], [], []
+
+    with ThreadPoolExecutor(max_workers=min(len(sources), 8)) as pool:
+        results = list(pool.map(lambda source: fetch_source(source, cache_dir), sources))
+
+    updates = []
+    notices = []
+    fetched = []
+    for result in results:
+        name = result["source"].get("name", result["source"]["url"])
+        if result["status"] == "error":
+            print(f"  {name}: error ({result['error']})")
+            continue
+        if result["status"] == "unchanged":
+            print(f"  {name}: not modified")
+            fetched.append(result)
+            continue
+        if result["source"].get("format", "html") not in STRUCTURED_FORMATS:
+            print(f"  {name}: changed, notice recorded for review (not applied)")
+            notices.append(parse_notice(result["source"], result["body"]))
+            fetched.append(result)
+            continue
+        try:
+            parsed = parse_source_document(result["source"], result["body"])
+        except (ValueError, KeyError, ET.ParseError, csv.Error) as e:
+            print(f"  {name}: could not parse ({e})")
+            continue
+        print(f"  {name}: changed, {len(parsed)} changes")
+        updates.extend(parsed)
+        fetched.append(result)
+
+    if since_date:
+        updates = [u for u in updates if not u.get("effective_date") or u["effective_date"] >= since_date]
+    return updates, notices, fetched
+
+
+def change_set_payload(updates: List[Dict]) -> List[Dict]:
+    """Maps fetched updates onto the apply_taric_change_set JSON shape (taric_changes columns)."""
+    return [
+        {
+            "code": format_taric_code(update["code"]),
+            "change_type": update["change_type"],
+            "old_value": update.get("old_value"),
+            "new_value": update.get("new_value"),
+            "regulation_reference": update.get("regulation"),
+            "effective_date": update.get("effective_date"),
+            "source_url": update.get("source_url"),
+        }
+        for update in updates
+    ]
+
+
+def apply_change_set(updates: List[Dict], source: str = "seed_taric --update") -> Dict:
+    """
+    Applies a change set in one transaction via the apply_taric_change_set RPC
+    (migration 002): one upsert of the new and changed taric_codes, one bulk insert
+    into taric_changes and a rules-version bump. Only structured changes are applied,
+    and a code is only created by a new_code change that carries a description;
+    notices and changes for unknown codes go to taric_pending_changes for review.
+    Any error rolls back the whole set.
+
+    Returns:
+        dict: {"version", "changes_applied", "codes_updated", "codes_created", "changes_pending"}
+    """
+    result = get_supabase().rpc("apply_taric_change_set", {
+        "changes": change_set_payload(updates),
+        "change_source": source,
+    }).execute()
+    return result.data[0]
+
+
+def get_rules_version() -> int:
+    """Latest TARIC rules version; bumped by every applied change set."""
+    return int(get_supabase().rpc("current_taric_rules_version", {}).execute().data or 0)
+
+
+def check_for_updates(sources: Optional[List[Dict]] = None):
+    """
+    Check for updates in TARIC codes and apply them as a single change set; notices
+    from unstructured sources go to taric_news. Cached bodies and validators are
+    saved only after both are stored.
+    """
+    updates, notices, fetched = fetch_eu_taric_updates(sources=sources)
+    if notices:
+        get_supabase().table("taric_news").insert(notices).execute()
     
     if not updates:
         print("No updates found")
+        for result in fetched:
+            save_fetch(result)
         return
     
-    for update in updates:
-        try:
-            # Record the change
-            supabase.table("taric_changes").insert({
-                "code": update["code"],
-                "change_type": update["change_type"],
-                "old_value": update.get("old_value"),
-                "new_value": update.get("new_value"),
-                "regulation_reference": update.get("regulation"),
-                "effective_date": update.get("effective_date"),
-                "source_url": update.get("source_url"),
-            }).execute()
-            
-            # Update the code if needed
-            if update["change_type"] in ["rate_change", "description_update"]:
-                supabase.table("taric_codes").update(
-                    update["new_value"]
-                ).eq("code", update["code"]).execute()
-            
-            print(f"  Processed update for {update['code']}: {update['change_type']}")
-        except Exception as e:
-            print(f"  Error processing update: {e}")
+    start = time.time()
+    try:
+        summary = apply_change_set(updates)
+    except Exception as e:
+        print(f"  Change set of {len(updates)} updates rolled back: {e}")
+        raise
+    
+    print(f"  Applied {summary['changes_applied']} changes ({summary['codes_created']} codes created, "
+          f"{summary['codes_updated']} updated, {summary['changes_pending']} queued for review) "
+          f"in {time.time() - start:.2f}s")
+    print(f"  TARIC rules version is now {summary['version']}")
+    for result in fetched:
+        save_fetch(result)
+    invalidate_lookup_caches()
+
+
+# Lookup memoization: entries expire after TARIC_LOOKUP_TTL seconds and are dropped when
+# this process applies changes or the rules version (migration 002) moves on.
+LOOKUP_CACHE_TTL = float(os.getenv("TARIC_LOOKUP_TTL", "300"))
+RULES_VERSION_CHECK_INTERVAL = 30.0
+VERIFY_CHUNK_SIZE = 200  # Codes per `in` filter; keeps the REST query string well under URL limits
+
+
+class TTLCache:
+    """Small dict-backed memo with per-entry expiry."""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._entries: Dict = {}
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or entry[1] < time.monotonic():
+            self._entries.pop(key, None)
+            return None
+        return entry[0]
+
+    def set(self, key, value):
+        self._entries[key] = (value, time.monotonic() + self.ttl)
+
+    def clear(self):
+        self._entries.clear()
+
+
+_code_cache = TTLCache(LOOKUP_CACHE_TTL)
+_search_cache = TTLCache(LOOKUP_CACHE_TTL)
+_cache_state = {"rules_version": None, "checked_at": 0.0}
+
+
+def invalidate_lookup_caches():
+    """Drops memoized lookups and searches (called after seeding or applying changes)."""
+    _code_cache.clear()
+    _search_cache.clear()
+    _cache_state["checked_at"] = 0.0
+
+
+def _check_rules_version():
+    """Clears the caches if another process bumped the rules version since we last looked."""
+    now = time.monotonic()
+    if now - _cache_state["checked_at"] < RULES_VERSION_CHECK_INTERVAL:
+        return
+    _cache_state["checked_at"] = now
+    try:
+        version = get_rules_version()
+    except Exception:
+        return  # Migration 002 not applied yet; rely on the TTL alone
+    if _cache_state["rules_version"] is not None and version != _cache_state["rules_version"]:
+        _code_cache.clear()
+        _search_cache.clear()
+    _cache_state["rules_version"] = version
+
+
+def verify_codes(codes: List[str], chunk_size: int = VERIFY_CHUNK_SIZE) -> Dict[str, bool]:
+    """
+    Checks which TARIC codes exist, using one `in` query per chunk of uncached codes.
+
+    Args:
+        codes: Codes in any format (dots / spaces optional).
+        chunk_size: Codes per query.
+
+    Returns:
+        dict: {formatted code: exists}
+    """
+    _check_rules_version()
+    results = {}
+    missing = []
+    for code in dict.fromkeys(format_taric_code(c) for c in codes):
+        cached = _code_cache.get(code)
+        if cached is None:
+            missing.append(code)
+        else:
+            results[code] = cached
+
+    for i in range(0, len(missing), chunk_size):
+        chunk = missing[i:i + chunk_size]
+        found = {row["code"] for row in get_supabase().table("taric_codes").select("code").in_("code", chunk).execute().data}
+        for code in chunk:
+            results[code] = code in found
+            _code_cache.set(code, results[code])
+    return results
 
 
 def verify_code_exists(code: str) -> bool:
     """Check if a TARIC code exists in the database"""
-    formatted = format_taric_code(code)
-    result = supabase.table("taric_codes").select("code").eq("code", formatted).execute()
-    return len(result.data) > 0
+    return verify_codes([code])[format_taric_code(code)]
 
 
 def search_codes(query: str, limit: int = 10) -> List[Dict]:
-    """Search for TARIC codes by description"""
-    result = supabase.rpc("search_taric_codes", {
+    """Search for TARIC codes by description (memoized)"""
+    _check_rules_version()
+    key = (" ".join(query.lower().split()), limit)
+    cached = _search_cache.get(key)
+    if cached is not None:
+        return cached
+    result = get_supabase().rpc("search_taric_codes", {
         "search_query": query,
         "limit_count": limit
     }).execute()
+    _search_cache.set(key, result.data)
     return result.data
 
 
+def read_codes_file(path: str) -> List[str]:
+    """Codes from a text/CSV file: first column of each non-empty, non-comment line."""
+    codes = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            value = line.split(",")[0].strip().strip('"')
+            if value and not value.startswith("#") and any(ch.isdigit() for ch in value):
+                codes.append(value)
+    return codes
+
+
 def main():
     parser = argparse.ArgumentParser(description="Seed and manage TARIC database")
     parser.add_argument("--chapter", type=str, help="Seed specific chapter (e.g., 30)")
     parser.add_argument("--all", action="store_true", help="Seed all chapters")
     parser.add_argument("--update", action="store_true", help="Check for updates only")
-    parser.add_argument("--verify", type=str, help="Verify a specific code exists")
+    parser.add_argument("--verify", type=str, help="Verify a code exists, or every code in a file (one per line)")
     parser.add_argument("--search", type=str, help="Search for codes by description")
+    parser.add_argument("--sources", type=str, help="JSON file of update sources for --update")
     
     args = parser.parse_args()
     
-    if args.verify:
+    if args.verify and os.path.isfile(args.verify):
+        codes = read_codes_file(args.verify)
+        start = time.time()
+        results = verify_codes(codes)
+        elapsed = time.time() - start
+        missing = [code for code, exists in results.items() if not exists]
+        print(f"Verified {len(results)} unique codes in {elapsed:.2f}s ({len(results) / max(elapsed, 1e-6):.0f} codes/s)")
+        print(f"  {len(results) - len(missing)} exist, {len(missing)} not found")
+        for code in missing:
+            print(f"  NOT FOUND: {code}")
+    elif args.verify:
         exists = verify_code_exists(args.verify)
         print(f"Code {args.verify}: {'EXISTS' if exists else 'NOT FOUND'}")
     elif args.search:
@@ -254,7 +631,7 @@ def main():
         for r in results:
             print(f"  {r['code']}: {r['description'][:80]}...")
     elif args.update:
-        check_for_updates()
+        check_for_updates(load_update_sources(args.sources))
     elif args.chapter == "30":
         seed_chapter_30()
     elif args.all:
@@ -0,0 +1,257 @@
+-- Bulk, transactional application of TARIC change sets
+-- One RPC call applies the structured changes (creating new codes that come with a
+-- description, updating existing ones), records them and bumps the rules version;
+-- everything else (scraped notices, changes for codes we do not hold) is queued in
+-- taric_pending_changes for review, never applied. Any error rolls the whole set back.
+-- Rules version history: downstream caches compare the latest version to invalidate
+CREATE TABLE IF NOT EXISTS taric_rules_versions (
+    version BIGSERIAL PRIMARY KEY,
+    changes_applied INT NOT NULL DEFAULT 0,
+    codes_updated INT NOT NULL DEFAULT 0,
+    codes_created INT NOT NULL DEFAULT 0,
+    source TEXT,
+    -- e.g. 'seed_taric --update'
+    applied_at TIMESTAMPTZ DEFAULT NOW()
+);
+-- Changes that were not applied, for manual review
+CREATE TABLE IF NOT EXISTS taric_pending_changes (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    code VARCHAR(15) NOT NULL,
+    -- No FK: the code may not exist
+    change_type VARCHAR(20) NOT NULL,
+    old_value JSONB,
+    new_value JSONB,
+    regulation_reference TEXT,
+    effective_date DATE,
+    source_url TEXT,
+    reason TEXT NOT NULL,
+    -- 'notice' (unstructured text) or 'unknown_code' (no such code, and no new_code with a description)
+    status TEXT NOT NULL DEFAULT 'pending',
+    -- 'pending', 'applied', 'rejected'
+    change_source TEXT,
+    detected_at TIMESTAMPTZ DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS idx_taric_pending_changes_status ON taric_pending_changes(status);
+-- Apply a change set: [{"code", "change_type", "old_value", "new_value",
+--   "regulation_reference", "effective_date", "source_url"}, ...]
+-- (The return type gained codes_created / changes_pending; CREATE OR REPLACE cannot change it)
+DROP FUNCTION IF EXISTS apply_taric_change_set(JSONB, TEXT);
+CREATE OR REPLACE FUNCTION apply_taric_change_set(
+        changes JSONB,
+        change_source TEXT DEFAULT NULL
+    ) RETURNS TABLE (
+        version BIGINT,
+        changes_applied INT,
+        codes_updated INT,
+        codes_created INT,
+        changes_pending INT
+    ) AS $$ #variable_conflict use_column
+DECLARE v_version BIGINT;
+v_applied INT;
+v_updated INT;
+v_created INT;
+v_total INT;
+BEGIN -- Unpack once; ordinality keeps the input order so the last change per code wins
+DROP TABLE IF EXISTS _change_set;
+CREATE TEMP TABLE _change_set ON COMMIT DROP AS
+SELECT c.*,
+    t.ord
+FROM jsonb_array_elements(changes) WITH ORDINALITY AS t(item, ord),
+    jsonb_to_record(t.item) AS c(
+        code VARCHAR(15),
+        change_type VARCHAR(20),
+        old_value JSONB,
+        new_value JSONB,
+        regulation_reference TEXT,
+        effective_date DATE,
+        source_url TEXT
+    );
+SELECT COUNT(*) INTO v_total
+FROM _change_set;
+-- A change is applied only if it is structured (an object of column values, not a
+-- scraped {"notice": ...}) and its code exists or is created in this set by a
+-- new_code change that carries a description
+ALTER TABLE _change_set
+ADD COLUMN structured BOOLEAN,
+    ADD COLUMN applicable BOOLEAN;
+UPDATE _change_set cs
+SET structured = jsonb_typeof(cs.new_value) = 'object'
+    AND NOT cs.new_value ? 'notice'
+    AND cs.change_type IN ('rate_change', 'description_update', 'new_code');
+UPDATE _change_set cs
+SET applicable = cs.structured
+    AND (
+        EXISTS (
+            SELECT 1
+            FROM taric_codes tc
+            WHERE tc.code = cs.code
+        )
+        OR EXISTS (
+            SELECT 1
+            FROM _change_set nc
+            WHERE nc.code = cs.code
+                AND nc.structured
+                AND nc.change_type = 'new_code'
+                AND btrim(COALESCE(nc.new_value->>'description', '')) <> ''
+        )
+    );
+-- Upsert first, so the recorded changes can reference the codes they create
+-- (taric_changes.code is a FK). Each code's latest applicable new_value is overlaid
+-- onto its current row, or for a new code onto an empty row with the hierarchy
+-- derived from the code and the description of its new_code change (identity and
+-- hierarchy columns are never taken from new_value).
+WITH latest AS (
+    SELECT DISTINCT ON (cs.code) cs.code,
+        cs.new_value - ARRAY ['id', 'code', 'code_numeric', 'chapter', 'heading', 'subheading', 'created_at', 'updated_at'] AS new_value
+    FROM _change_set cs
+    WHERE cs.applicable
+    ORDER BY cs.code,
+        cs.ord DESC
+),
+new_descriptions AS (
+    SELECT DISTINCT ON (cs.code) cs.code,
+        btrim(cs.new_value->>'description') AS description
+    FROM _change_set cs
+    WHERE cs.applicable
+        AND cs.change_type = 'new_code'
+        AND btrim(COALESCE(cs.new_value->>'description', '')) <> ''
+    ORDER BY cs.code,
+        cs.ord DESC
+),
+upserted AS (
+    INSERT INTO taric_codes (
+            code,
+            code_numeric,
+            chapter,
+            heading,
+            subheading,
+            description,
+            description_short,
+            unit_of_measure,
+            supplementary_unit,
+            duty_rate,
+            chapter_notes,
+            section_notes,
+            source_url,
+            regulation_reference,
+            valid_from,
+            valid_to
+        )
+    SELECT latest.code,
+        replace(latest.code, '.', ''),
+        left(replace(latest.code, '.', ''), 2),
+        left(replace(latest.code, '.', ''), 4),
+        left(replace(latest.code, '.', ''), 6),
+        COALESCE(merged.description, new_descriptions.description),
+        merged.description_short,
+        merged.unit_of_measure,
+        merged.supplementary_unit,
+        COALESCE(merged.duty_rate, '{}'),
+        merged.chapter_notes,
+        merged.section_notes,
+        merged.source_url,
+        merged.regulation_reference,
+        merged.valid_from,
+        merged.valid_to
+    FROM latest
+        LEFT JOIN taric_codes cur ON cur.code = latest.code
+        LEFT JOIN new_descriptions ON new_descriptions.code = latest.code,
+        LATERAL jsonb_populate_record(cur, latest.new_value) AS merged ON CONFLICT (code) DO
+    UPDATE
+    SET description = EXCLUDED.description,
+        description_short = EXCLUDED.description_short,
+        unit_of_measure = EXCLUDED.unit_of_measure,
+        supplementary_unit = EXCLUDED.supplementary_unit,
+        duty_rate = EXCLUDED.duty_rate,
+        chapter_notes = EXCLUDED.chapter_notes,
+        section_notes = EXCLUDED.section_notes,
+        source_url = EXCLUDED.source_url,
+        regulation_reference = EXCLUDED.regulation_reference,
+        valid_from = EXCLUDED.valid_from,
+        valid_to = EXCLUDED.valid_to
+    RETURNING (xmax = 0) AS inserted
+)
+SELECT COUNT(*) FILTER (WHERE NOT inserted),
+    COUNT(*) FILTER (WHERE inserted) INTO v_updated,
+    v_created
+FROM upserted;
+-- Queue everything not applied for review
+INSERT INTO taric_pending_changes (
+        code,
+        change_type,
+        old_value,
+        new_value,
+        regulation_reference,
+        effective_date,
+        source_url,
+        reason,
+        change_source
+    )
+SELECT cs.code,
+    cs.change_type,
+    cs.old_value,
+    cs.new_value,
+    cs.regulation_reference,
+    cs.effective_date,
+    cs.source_url,
+    CASE
+        WHEN cs.structured THEN 'unknown_code'
+        ELSE 'notice'
+    END,
+    change_source
+FROM _change_set cs
+WHERE NOT cs.applicable
+ORDER BY cs.ord;
+-- Record the applied changes
+INSERT INTO taric_changes (
+        code,
+        change_type,
+        old_value,
+        new_value,
+        regulation_reference,
+        effective_date,
+        source_url,
+        processed
+    )
+SELECT cs.code,
+    cs.change_type,
+    cs.old_value,
+    cs.new_value,
+    cs.regulation_reference,
+    cs.effective_date,
+    cs.source_url,
+    TRUE
+FROM _change_set cs
+WHERE cs.applicable
+ORDER BY cs.ord;
+GET DIAGNOSTICS v_applied = ROW_COUNT;
+INSERT INTO taric_rules_versions (changes_applied, codes_updated, codes_created, source)
+VALUES (v_applied, v_updated, v_created, change_source)
+RETURNING taric_rules_versions.version INTO v_version;
+-- Listeners (LISTEN taric_rules_version) can drop cached rules immediately
+PERFORM pg_notify('taric_rules_version', v_version::TEXT);
+RETURN QUERY
+SELECT v_version,
+    v_applied,
+    v_updated,
+    v_created,
+    v_total - v_applied;
+END;
+$$ LANGUAGE plpgsql;
+-- Latest rules version (0 before the first change set)
+CREATE OR REPLACE FUNCTION current_taric_rules_version() RETURNS BIGINT AS $$
+SELECT COALESCE(MAX(version), 0)
+FROM taric_rules_versions;
+$$ LANGUAGE sql STABLE;
+-- Only the service role applies change sets; everyone may read the version
+REVOKE ALL ON taric_pending_changes
+FROM anon,
+    authenticated;
+REVOKE EXECUTE ON FUNCTION apply_taric_change_set(JSONB, TEXT)
+FROM PUBLIC,
+    anon,
+    authenticated;
+GRANT SELECT ON taric_rules_versions TO anon,
+    authenticated;
+GRANT EXECUTE ON FUNCTION current_taric_rules_version() TO anon,
+    authenticated;
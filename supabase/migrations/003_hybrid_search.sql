@@ -0,0 +1,91 @@
+-- Hybrid TARIC search: trigram and vector retrieval in one query, merged with
+-- reciprocal rank fusion (RRF), backed by an HNSW index.
+-- HNSW keeps high recall on small and growing tables, where ivfflat with
+-- lists = 100 leaves most lists near-empty and misses neighbours.
+DROP INDEX IF EXISTS idx_taric_codes_embedding;
+CREATE INDEX IF NOT EXISTS idx_taric_codes_embedding_hnsw ON taric_codes USING hnsw (description_embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64);
+-- Each retriever contributes 1 / (rrf_k + rank) for its top candidate_count rows;
+-- a code found by both ranks above codes found by only one.
+-- An HNSW scan returns at most hnsw.ef_search rows (default 40), which would silently
+-- cap the vector leg below candidate_count: the function raises it for its own scan
+-- (the SET clause restores the caller's value when the function returns).
+CREATE OR REPLACE FUNCTION hybrid_search_taric_codes(
+        search_query TEXT,
+        query_embedding vector(1536) DEFAULT NULL,
+        limit_count INT DEFAULT 10,
+        candidate_count INT DEFAULT 50,
+        rrf_k INT DEFAULT 60
+    ) RETURNS TABLE (
+        code VARCHAR(15),
+        description TEXT,
+        chapter VARCHAR(2),
+        heading VARCHAR(4),
+        similarity FLOAT,
+        match_type TEXT
+    ) AS $$
+SELECT set_config(
+        'hnsw.ef_search',
+        least(greatest(candidate_count, 40), 1000)::TEXT,
+        true
+    );
+WITH fuzzy AS (
+        SELECT f.code,
+            ROW_NUMBER() OVER (
+                ORDER BY f.score DESC
+            ) AS rank
+        FROM (
+                SELECT tc.code,
+                    similarity(tc.description, search_query) AS score
+                FROM taric_codes tc
+                WHERE search_query IS NOT NULL
+                    AND search_query <> ''
+                    AND (
+                        tc.description % search_query
+                        OR tc.description ILIKE '%' || search_query || '%'
+                    )
+                ORDER BY score DESC
+                LIMIT candidate_count
+            ) f
+    ),
+    semantic AS (
+        SELECT s.code,
+            ROW_NUMBER() OVER (
+                ORDER BY s.distance
+            ) AS rank
+        FROM (
+                SELECT tc.code,
+                    tc.description_embedding <=> query_embedding AS distance
+                FROM taric_codes tc
+                WHERE query_embedding IS NOT NULL
+                    AND tc.description_embedding IS NOT NULL
+                ORDER BY tc.description_embedding <=> query_embedding
+                LIMIT candidate_count
+            ) s
+    ),
+    fused AS (
+        SELECT COALESCE(fuzzy.code, semantic.code) AS code,
+            COALESCE(1.0 / (rrf_k + fuzzy.rank), 0) + COALESCE(1.0 / (rrf_k + semantic.rank), 0) AS score,
+            CASE
+                WHEN fuzzy.code IS NOT NULL
+                AND semantic.code IS NOT NULL THEN 'hybrid'
+                WHEN semantic.code IS NOT NULL THEN 'semantic'
+                ELSE 'fuzzy'
+            END AS match_type
+        FROM fuzzy
+            FULL OUTER JOIN semantic ON semantic.code = fuzzy.code
+    )
+SELECT tc.code,
+    tc.description,
+    tc.chapter,
+    tc.heading,
+    fused.score::FLOAT AS similarity,
+    fused.match_type
+FROM fused
+    JOIN taric_codes tc ON tc.code = fused.code
+ORDER BY fused.score DESC,
+    tc.code
+LIMIT limit_count;
+$$ LANGUAGE sql VOLATILE
+SET hnsw.ef_search = 40;
+GRANT EXECUTE ON FUNCTION hybrid_search_taric_codes(TEXT, vector, INT, INT, INT) TO anon,
+    authenticated;
@@ -0,0 +1,134 @@
+"""
+Benchmark for dutyEngine: duties for a synthetic 100k-line invoice, vectorized
+(DutyRateTable.compute) versus a per-line Python loop over the same duty_rate dicts.
+Checks parse_rate and compute on known TARIC rate strings first (RATE_CASES).
+
+Usage:
+    python benchmark_duty.py                   # 100k lines, 20k codes
+    python benchmark_duty.py --lines 1000000 --codes 50000
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from dutyEngine import DutyRateTable, parse_rate
+
+
+ORIGINS = ["CN", "US", "CH", "IN", "GSP", "JP"]
+NAN = float("nan")
+
+# (rate, parse_rate columns, (customs value, net mass kg, quantity), expected duty)
+RATE_CASES = [
+    ("12.8 % + 17.6 EUR/100 kg MAX 22 %", (12.8, 0.176, 0.0, NAN, NAN, NAN, 22.0, 0.0, 0.0), (1000, 100, 0), 145.6),
+    ("12.8 % + 17.6 EUR/100 kg MAX 22 %", (12.8, 0.176, 0.0, NAN, NAN, NAN, 22.0, 0.0, 0.0), (100, 100, 0), 22.0),
+    ("8.3 % MIN 2.5 EUR/100 kg", (8.3, 0.0, 0.0, 0.0, 0.025, 0.0, NAN, NAN, NAN), (10, 100, 0), 2.5),
+    ("8.3 % MIN 2.5 EUR/100 kg", (8.3, 0.0, 0.0, 0.0, 0.025, 0.0, NAN, NAN, NAN), (1000, 100, 0), 83.0),
+    ("2.7 EUR/1000 p/st", (0.0, 0.0, 0.0027, NAN, NAN, NAN, NAN, NAN, NAN), (50, 0, 5000), 13.5),
+    ("Free", (0.0, 0.0, 0.0, NAN, NAN, NAN, NAN, NAN, NAN), (1000, 10, 10), 0.0),
+]
+# Rates with text parse_rate does not understand: priced as unknown, never partially
+UNPARSED_RATES = ["3.2 % + EA", "5 % + 2 EUR/hl", "MAX 5 %"]
+
+
+def check_rate_cases():
+    """Asserts parse_rate and DutyRateTable.compute on RATE_CASES, and that UNPARSED_RATES are rejected."""
+    for rate, columns, (value, mass, quantity), duty in RATE_CASES:
+        parsed = parse_rate(rate)
+        assert parsed is not None and np.allclose(parsed, columns, equal_nan=True), f"parse_rate({rate!r}) = {parsed}"
+        table = DutyRateTable([{"code": "0101.21.00.00", "duty_rate": {"erga_omnes": rate}}])
+        got = table.compute(["0101.21.00.00"], [value], [mass], [quantity])["duty"][0]
+        assert np.isclose(got, duty), f"{rate!r} on {value} EUR, {mass} kg, {quantity} items: {got} != {duty}"
+    for rate in UNPARSED_RATES:
+        assert parse_rate(rate) is None, f"parse_rate({rate!r}) = {parse_rate(rate)}"
+    print(f"{len(RATE_CASES) + len(UNPARSED_RATES)} rate cases OK")
+
+
+def synthetic_rows(count, rng):
+    """duty_rate rows mixing ad valorem, specific and compound rates plus preferences."""
+    rows = []
+    for i in range(count):
+        code = f"{3000000000 + i * 37:010d}"
+        kind = rng.integers(6)
+        if kind == 0:
+            erga = "Free"
+        elif kind == 1:
+            erga = f"{rng.integers(1, 130) / 10:.1f}%"
+        elif kind == 2:
+            erga = f"{rng.integers(1, 80) / 10:.1f}% + {rng.integers(1, 300) / 10:.1f} EUR/100 kg"
+        elif kind == 3:
+            erga = f"{rng.integers(1, 50) / 100:.2f} EUR/p/st"
+        elif kind == 4:
+            erga = f"{rng.integers(1, 130) / 10:.1f} % MIN {rng.integers(1, 300) / 10:.1f} EUR/100 kg"
+        else:
+            erga = f"{rng.integers(1, 80) / 10:.1f} % + {rng.integers(1, 300) / 10:.1f} EUR/100 kg MAX {rng.integers(80, 250) / 10:.1f} %"
+        preferential = {origin: f"{rng.integers(0, 40) / 10:.1f}%" for origin in ("CH", "GSP", "JP") if rng.random() < 0.5}
+        if "JP" in preferential and kind == 3:
+            preferential["JP"] = f"{rng.integers(1, 400) / 10:.1f} EUR/1000 p/st"
+        rows.append({"code": f"{code[:4]}.{code[4:6]}.{code[6:8]}.{code[8:]}", "duty_rate": {"erga_omnes": erga, "preferential": preferential}})
+    return rows
+
+
+def loop_duties(rows, codes, values, masses, quantities, origins):
+    """Reference implementation: one dict lookup and rate parse per line."""
+    by_code = {row["code"]: row["duty_rate"] for row in rows}
+    duties = []
+    for code, value, mass, quantity, origin in zip(codes, values, masses, quantities, origins):
+        rate = by_code.get(code)
+        if rate is None:
+            duties.append(float("nan"))
+            continue
+        candidates = []
+        for text in (rate.get("erga_omnes"), rate.get("preferential", {}).get(origin)):
+            parsed = parse_rate(text)
+            if parsed is not None:
+                duty, floor, cap = (parsed[i] / 100 * value + parsed[i + 1] * mass + parsed[i + 2] * quantity for i in (0, 3, 6))
+                if floor == floor:  # Not NaN: the rate has a MIN clause
+                    duty = max(duty, floor)
+                if cap == cap:
+                    duty = min(duty, cap)
+                candidates.append(duty)
+        duties.append(min(candidates) if candidates else float("nan"))
+    return np.array(duties)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vectorized duty engine benchmark")
+    parser.add_argument("--lines", type=int, default=100_000)
+    parser.add_argument("--codes", type=int, default=20_000)
+    parser.add_argument("--seed", type=int, default=3)
+    args = parser.parse_args()
+
+    check_rate_cases()
+    rng = np.random.default_rng(args.seed)
+    rows = synthetic_rows(args.codes, rng)
+
+    started = time.perf_counter()
+    table = DutyRateTable(rows)
+    print(f"Loaded {len(table)} codes, {len(table.origins)} preferential origins in {time.perf_counter() - started:.2f}s")
+
+    all_codes = np.array([row["code"] for row in rows])
+    codes = all_codes[rng.integers(len(all_codes), size=args.lines)]
+    values = rng.uniform(10, 50_000, size=args.lines).round(2)
+    masses = rng.uniform(0.1, 2_000, size=args.lines).round(3)
+    quantities = rng.integers(1, 500, size=args.lines)
+    origins = np.array(ORIGINS)[rng.integers(len(ORIGINS), size=args.lines)]
+
+    started = time.perf_counter()
+    result = table.compute(codes, values, masses, quantities, origins)
+    vectorized = time.perf_counter() - started
+
+    started = time.perf_counter()
+    expected = loop_duties(rows, codes.tolist(), values.tolist(), masses.tolist(), quantities.tolist(), origins.tolist())
+    looped = time.perf_counter() - started
+
+    mismatches = int(np.sum(~np.isclose(result["duty"], expected, equal_nan=True)))
+    print(f"{args.lines} lines: vectorized {vectorized * 1000:.1f} ms ({args.lines / vectorized:,.0f} lines/s), "
+          f"loop {looped * 1000:.1f} ms ({looped / vectorized:.0f}x slower)")
+    print(f"Total duty EUR {np.nansum(result['duty']):,.2f}; {int(result['preferential'].sum())} lines at preferential rates; "
+          f"{mismatches} mismatches against the loop")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Benchmark for pdfBackends: text-extraction throughput of every backend on the same
+PDFs, and agreement with pdfplumber (words = same content, order = same sequence).
+
+Usage:
+    python benchmark_pdf.py                               # the sample sheets in the repo root
+    python benchmark_pdf.py sheets/*.pdf --repeat 5 --backends pdfplumber auto
+"""
+
+import argparse
+import glob
+import os
+import time
+
+from pdfBackends import BACKENDS, open_extractor, pdfium, verify_backend
+
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def time_backend(paths, backend, repeat):
+    """Best-of-repeat seconds to extract every page of every PDF, and the page count."""
+    best = None
+    for _ in range(repeat):
+        pages = 0
+        started = time.perf_counter()
+        for path in paths:
+            with open_extractor(path, backend) as extractor:
+                for index in range(extractor.page_count):
+                    extractor.page_text(index)
+                pages += extractor.page_count
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, pages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PDF text-extraction backend benchmark")
+    parser.add_argument("pdfs", nargs="*", help="PDF files or glob patterns (default: *.pdf in the repo root)")
+    parser.add_argument("--backends", nargs="+", choices=list(BACKENDS), default=list(BACKENDS))
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    paths = sorted({p for pattern in (args.pdfs or [os.path.join(REPO_ROOT, "*.pdf")]) for p in glob.glob(pattern)})
+    if not paths:
+        parser.error("no PDFs found")
+    if pdfium is None:
+        print("pypdfium2 is not installed: pdfium and auto fall back to pdfplumber")
+
+    baseline = None
+    for backend in args.backends:
+        seconds, pages = time_backend(paths, backend, args.repeat)
+        baseline = baseline or (seconds if backend == "pdfplumber" else None)
+        line = f"{backend:<11} {pages} pages in {seconds * 1000:8.1f} ms ({pages / seconds:7.1f} pages/s"
+        line += f", {baseline / seconds:.1f}x pdfplumber)" if baseline else ")"
+
+        if backend != "pdfplumber":
+            checked = [page for path in paths for page in verify_backend(path, backend)]
+            slow = sum(page["backend"] == "pdfplumber" for page in checked)
+            line += (f"; vs pdfplumber: words min {min(p['words'] for p in checked):.3f} / "
+                     f"mean {sum(p['words'] for p in checked) / len(checked):.3f}, "
+                     f"order mean {sum(p['order'] for p in checked) / len(checked):.3f}")
+            if backend == "auto":
+                line += f"; {slow} table pages via pdfplumber"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
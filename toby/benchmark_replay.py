@@ -0,0 +1,134 @@
+"""
+End-to-end benchmark of the API server on a golden corpus, with Gemini served from
+recorded cassettes (callLLM2 LLM_MODE=replay): deterministic, offline and free, so
+throughput and accuracy can be compared across changes.
+
+The corpus is JSONL, one spec sheet per line:
+
+    {"id": "altavita-sds", "pdf": "sheets/altavita_sds.pdf", "product_description": "...",
+     "expected_hs_code": "3004.90.00.00"}
+    {"id": "aspirin", "product_description": "Acetylsalicylic acid tablets 500 mg",
+     "cas_numbers": ["50-78-2"], "expected_hs_code": "3004.90.00.00"}
+
+Lines with "pdf" (relative to the corpus file) go to POST /classify-with-pdf, the
+others to POST /classify with the remaining fields as the ClassificationRequest.
+
+Usage:
+    python benchmark_replay.py corpus.jsonl --record            # once, live Gemini (needs API_KEY)
+    python benchmark_replay.py corpus.jsonl --concurrency 16    # replay at full speed
+    python benchmark_replay.py corpus.jsonl --latency recorded  # replay with recorded latencies
+"""
+
+import argparse
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+_CORPUS_ONLY_FIELDS = ("id", "pdf", "expected_hs_code")
+
+
+def load_corpus(path):
+    """Corpus entries, with pdf paths resolved against the corpus file's directory."""
+    entries = []
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            entry.setdefault("id", f"line-{number}")
+            if entry.get("pdf"):
+                entry["pdf"] = os.path.join(os.path.dirname(os.path.abspath(path)), entry["pdf"])
+            entries.append(entry)
+    return entries
+
+
+def digits(code):
+    return re.sub(r"\D", "", code or "")
+
+
+def classify_entry(client, entry):
+    """Sends one corpus entry through the server; returns (seconds, status, hs_code)."""
+    started = time.perf_counter()
+    if entry.get("pdf"):
+        with open(entry["pdf"], "rb") as f:
+            response = client.post(
+                "/classify-with-pdf",
+                files={"product_pdf": (os.path.basename(entry["pdf"]), f, "application/pdf")},
+                data={"product_description": entry.get("product_description", "")},
+            )
+    else:
+        body = {key: value for key, value in entry.items() if key not in _CORPUS_ONLY_FIELDS}
+        body.setdefault("extracted_text", "")
+        response = client.post("/classify", json=body)
+    elapsed = time.perf_counter() - started
+    hs_code = response.json().get("hs_code") if response.status_code == 200 else None
+    return elapsed, response.status_code, hs_code
+
+
+def score(entries, results):
+    """Exact / 6-digit / 4-digit agreement with expected_hs_code where one is given."""
+    scored = [(digits(entry["expected_hs_code"]), digits(result[2]))
+              for entry, result in zip(entries, results) if entry.get("expected_hs_code")]
+    if not scored:
+        return None
+    return {
+        "labelled": len(scored),
+        "exact": sum(expected == got for expected, got in scored) / len(scored),
+        "subheading": sum(expected[:6] == got[:6] for expected, got in scored) / len(scored),
+        "heading": sum(expected[:4] == got[:4] for expected, got in scored) / len(scored),
+    }
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a golden corpus through the API server")
+    parser.add_argument("corpus", help="Corpus JSONL")
+    parser.add_argument("--record", action="store_true", help="Call Gemini live and record cassettes")
+    parser.add_argument("--cassettes", help="Cassette directory (default LLM_CASSETTE_DIR or toby/cassettes)")
+    parser.add_argument("--latency", default="0", help='Replay latency: 0, "recorded" or seconds per call')
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=1, help="Passes over the corpus")
+    args = parser.parse_args()
+
+    # Configure callLLM2 / server before they are imported; no index or history side effects
+    os.environ["LLM_MODE"] = "record" if args.record else "replay"
+    os.environ["LLM_REPLAY_LATENCY"] = args.latency
+    if args.cassettes:
+        os.environ["LLM_CASSETTE_DIR"] = args.cassettes
+    os.environ.setdefault("NEAR_DUP", "off")
+    os.environ.setdefault("HISTORY_BACKEND", "none")
+
+    from fastapi.testclient import TestClient
+    from callLLM2 import CASSETTE_DIR, CASSETTE_STATS
+    from server import app
+
+    entries = load_corpus(args.corpus) * args.repeat
+    print(f"{os.environ['LLM_MODE']}: {len(entries)} requests, concurrency {args.concurrency}, cassettes in {CASSETTE_DIR}")
+
+    with TestClient(app) as client:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            results = list(pool.map(lambda entry: classify_entry(client, entry), entries))
+        elapsed = time.perf_counter() - started
+
+    latencies = [result[0] * 1000 for result in results]
+    failed = sum(result[1] != 200 for result in results)
+    print(f"{len(entries)} requests in {elapsed:.2f}s ({len(entries) / elapsed:.1f} req/s); "
+          f"latency p50 {_percentile(latencies, 0.5):.1f} ms, p95 {_percentile(latencies, 0.95):.1f} ms; {failed} failed")
+    print(f"Cassettes: {CASSETTE_STATS['replayed']} replayed, {CASSETTE_STATS['missed']} missing, "
+          f"{CASSETTE_STATS['recorded']} recorded")
+
+    accuracy = score(entries, results)
+    if accuracy:
+        print(f"Accuracy on {accuracy['labelled']} labelled: exact {accuracy['exact']:.1%}, "
+              f"6-digit {accuracy['subheading']:.1%}, 4-digit {accuracy['heading']:.1%}")
+
+
+if __name__ == "__main__":
+    main()
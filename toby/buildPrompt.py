@@ -4,76 +4,20 @@ Calls the LLM to get HS/TARIC code + Explanation + Sources + Legal Justification
 Returns structured JSON output with confidence scores.
 """
 
-from callLLM2 import callLLM
-import pdfplumber
+from callLLM2 import callLLM, callLLMAsync
+from deadline import DeadlineExceeded, budget, check, detached_context, remaining
+from pdfExtract import DOC_TIMEOUT, extract_pdf_text_bounded
+from profiler import span
+from rateLimiter import estimate_tokens
+from singleFlight import SingleFlight, prompt_key
+from rulesRegistry import EMBEDDED_TARIC_RULES, get_chapter_rules, keyword_lookup, render_rules, select_chapters, valid_headings
+from taricData import get_headings, get_heading_subtree
+import asyncio
 import json
 import re
 import os
-
-
-# Embedded EU TARIC Chapter 30 rules (used when PDF not available)
-EMBEDDED_TARIC_RULES = """
-=== EU TARIC CHAPTER 30: PHARMACEUTICAL PRODUCTS ===
-
-CHAPTER NOTES:
-1. This chapter does NOT cover:
-   (a) Foods or beverages (Chapter 21, 22), food supplements (heading 2106)
-   (b) Plasters specially calcined for dentistry (heading 2520)
-   (c) Aqueous distillates of essential oils (heading 3301)
-   (d) Preparations of headings 3303 to 3307
-   (e) Soap containing medicaments (heading 3401)
-   (f) Preparations with basis of plaster for dentistry (heading 3407)
-   (g) Blood albumin not for therapeutic/prophylactic use (heading 3502)
-
-2. For heading 3002:
-   - Includes immunological products (vaccines, toxins, cultures of micro-organisms)
-   - Monoclonal antibodies are classified here
-   - Blood fractions and modified immunological products
-
-3. For headings 3003 and 3004:
-   - 3003: Medicaments not put up in measured doses or retail packing
-   - 3004: Medicaments put up in measured doses or retail packing
-
-HEADING STRUCTURE:
-- 3001: Glands and organs; extracts thereof
-- 3002: Human/animal blood; antisera; vaccines; toxins; cultures
-  - 3002.12: Antisera and blood fractions
-  - 3002.13: Immunological products, unmixed
-  - 3002.14: Immunological products, mixed
-  - 3002.15: Immunological products, put up in measured doses or retail
-  - 3002.41: Vaccines for human medicine
-  - 3002.42: Vaccines for veterinary medicine
-  - 3002.49: Toxins, cultures
-  - 3002.90: Other
-- 3003: Medicaments (not retail)
-- 3004: Medicaments (retail)
-  - 3004.10: Containing penicillins/streptomycins
-  - 3004.20: Containing other antibiotics
-  - 3004.31-39: Containing hormones
-  - 3004.41-49: Containing alkaloids
-  - 3004.50: Containing vitamins
-  - 3004.60: Containing antimalarial active principles
-  - 3004.90: Other
-- 3005: Wadding, bandages, dressings
-- 3006: Pharmaceutical goods (sutures, blood-grouping reagents, etc.)
-
-GENERAL INTERPRETIVE RULES (GIRs):
-GIR 1: Classification determined by terms of headings and Section/Chapter Notes
-GIR 2(a): Incomplete/unfinished articles classified with complete articles
-GIR 2(b): Mixtures classified as if consisting of single material
-GIR 3(a): Most specific description preferred
-GIR 3(b): Mixtures/composite goods - essential character determines classification
-GIR 3(c): Last in numerical order if (a) and (b) fail
-GIR 5: Packing materials classified with contents (packaging doesn't change classification)
-GIR 6: Subheading classification follows same rules
-
-COMMON CLASSIFICATIONS:
-- Monoclonal antibodies (pembrolizumab, nivolumab, etc.): 3002.15.00.00
-- Vaccines for human medicine: 3002.41.00.00
-- Insulin preparations: 3004.31.00.00
-- Antibiotics (retail): 3004.20.00.00
-- General pharmaceuticals (retail, NES): 3004.90.00.00
-"""
+import threading
+import time
 
 
 # System prompt: reasoning process (GIRs, exclusion, essential character, output format) - updated for structured JSON output
@@ -121,6 +65,9 @@ YOU MUST RESPOND WITH VALID JSON ONLY. No markdown, no extra text. Use this exac
 def extract_pdf_text(pdf_path):
     """
     Extracts full text from a PDF file (e.g., EU TARIC rules).
+    Runs within the time/memory budgets of pdfExtract (the document budget shortened
+    to the request's deadline); if the budgets are hit, the text extracted so far is
+    returned and the warnings are printed.
 
     Args:
         pdf_path: Path to the PDF file.
@@ -128,16 +75,17 @@ def extract_pdf_text(pdf_path):
     Returns:
         str: All text from the PDF.
     """
-    text = ""
-    with pdfplumber.open(pdf_path) as pdf:
-        for page in pdf.pages:
-            text += page.extract_text() + "\n\n"
-    return text.strip()
+    result = extract_pdf_text_bounded(pdf_path, doc_timeout=budget(DOC_TIMEOUT))
+    for warning in result["warnings"]:
+        print(f"PDF extraction warning ({pdf_path}): {warning}")
+    return result["text"]
 
 
 def buildPrompt(pdfText, productData, taric_pdf_path="EU TARIC PDF.pdf", systemPrompt=BIO_CLASSIFY_SYSTEM_PROMPT):
     """
     Puts together the full prompt: system instructions + EU TARIC rules (from PDF) + product spec text + product data.
+    Without a TARIC PDF, the rules come from the registry for the chapters picked by
+    the keyword pre-pass (Chapter 30 when nothing else matches).
 
     Args:
         pdfText: Long text from the Product Specification Sheet (PDF converted to text).
@@ -147,18 +95,24 @@ def buildPrompt(pdfText, productData, taric_pdf_path="EU TARIC PDF.pdf", systemP
 
     Returns:
         str: The assembled prompt text sent to the LLM.
+
+    Raises:
+        DeadlineExceeded: If the request's deadline has already passed.
     """
-    # Use EU TARIC PDF if available, otherwise use embedded rules
+    check("build_prompt")
+    # Use EU TARIC PDF if available, otherwise the registry rules for the likely chapters
     if taric_pdf_path and os.path.exists(taric_pdf_path):
+        chapters = ["30"]
         taric_rules = extract_pdf_text(taric_pdf_path)
     else:
-        taric_rules = EMBEDDED_TARIC_RULES
+        chapters = select_chapters(f"{pdfText or ''}\n{productData or ''}")
+        taric_rules = render_rules(chapters)
         
     parts = [
         "--- SYSTEM INSTRUCTIONS ---",
         systemPrompt,
         "",
-        "--- EU TARIC CHAPTER 30 RULES (FOR COMPARISON) ---",
+        f"--- EU TARIC CHAPTER {' / '.join(chapters)} RULES (FOR COMPARISON) ---",
         taric_rules,
         "",
         "--- PRODUCT SPECIFICATION (PDF) ---",
@@ -173,9 +127,106 @@ def buildPrompt(pdfText, productData, taric_pdf_path="EU TARIC PDF.pdf", systemP
     return "\n".join(parts)
 
 
+# JSON Schema for structured-output mode: the model is constrained to this shape, so the
+# response can be decoded in one step. Mirrors the format in BIO_CLASSIFY_SYSTEM_PROMPT.
+CLASSIFICATION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "hs_code": {"type": "string", "pattern": r"^\d{4}\.\d{2}\.\d{2}\.\d{2}$"},
+        "confidence": {"type": "number", "minimum": 0, "maximum": 1},
+        "confidence_reasoning": {"type": "string"},
+        "classification_reasoning": {
+            "type": "object",
+            "properties": {
+                "product_type": {"type": "string"},
+                "active_ingredient": {"type": "string"},
+                "applicable_gir": {"type": "string"},
+                "chapter_notes_applied": {"type": "string"},
+                "exclusions_checked": {"type": "string"},
+            },
+            "required": ["product_type", "active_ingredient", "applicable_gir",
+                         "chapter_notes_applied", "exclusions_checked"],
+        },
+        "sources": {"type": "array", "items": {"type": "string"}},
+        "legal_memo": {"type": "string"},
+    },
+    "required": ["hs_code", "confidence", "confidence_reasoning", "classification_reasoning",
+                 "sources", "legal_memo"],
+}
+
+# Automatic repair attempts after a response fails validation, before falling back
+MAX_REPAIR_ATTEMPTS = 1
+
+# Model routing: answer with the cheap model, escalate to the strong one only when the
+# answer is not trustworthy. ROUTING=off restores callLLM's error-only fallback.
+ROUTING_ENABLED = os.getenv("ROUTING", "on").lower() not in ("off", "0", "false")
+ROUTING_CHEAP_MODEL = os.getenv("ROUTING_CHEAP_MODEL", "gemini-2.5-flash-lite")
+ROUTING_STRONG_MODEL = os.getenv("ROUTING_STRONG_MODEL", "gemini-2.5-flash")
+ROUTING_MIN_CONFIDENCE = float(os.getenv("ROUTING_MIN_CONFIDENCE", "0.7"))
+
+# USD per 1M (input, output) tokens, for the cost-saved estimate
+MODEL_PRICES = {
+    "gemini-2.5-flash-lite": (0.10, 0.40),
+    "gemini-2.5-flash": (0.30, 2.50),
+}
+
+ROUTING_STATS = {
+    "cheap": {"count": 0, "latency_ms": 0.0, "cost_usd": 0.0},
+    "escalated": {"count": 0, "latency_ms": 0.0, "cost_usd": 0.0},
+    "strong_calls": {"count": 0, "latency_ms": 0.0},
+    "reasons": {"low_confidence": 0, "invalid_code": 0, "parse_fallback": 0, "error": 0},
+    "cost_saved_usd": 0.0,
+    "escalation_overhead_usd": 0.0,
+    "escalations_skipped": 0,  # Escalation wanted but the request's deadline had passed
+    "escalations_failed": 0,  # Strong-model call raised; the cheap answer was returned
+}
+_routing_lock = threading.Lock()
+
+# In-flight runPromptAsync classifications, keyed on the prompt hash
+_prompt_flights = SingleFlight()
+
+# Parse outcomes since process start: decoded first time, decoded after a repair retry,
+# or fell back to an unreliable result (the case that made users resubmit)
+PARSE_STATS = {"decoded": 0, "repaired": 0, "fallback": 0}
+_parse_stats_lock = threading.Lock()
+
+
+class ClassificationParseError(ValueError):
+    """The LLM response is not valid JSON or does not match CLASSIFICATION_SCHEMA."""
+
+
+def _count_parse(outcome):
+    with _parse_stats_lock:
+        PARSE_STATS[outcome] += 1
+
+
+def getParseStats():
+    """Snapshot of PARSE_STATS, plus the fallback rate."""
+    with _parse_stats_lock:
+        stats = dict(PARSE_STATS)
+    total = sum(stats.values())
+    stats["fallback_rate"] = stats["fallback"] / total if total else 0.0
+    return stats
+
+
+def buildRepairPrompt(prompt, bad_response, error):
+    """Prompt for a repair retry: the original task plus the invalid output and why it failed."""
+    return "\n".join([
+        prompt,
+        "",
+        "--- PREVIOUS RESPONSE (INVALID) ---",
+        bad_response,
+        "",
+        "--- REPAIR ---",
+        f"The previous response was rejected: {error}",
+        "Return the same classification as a single JSON object that matches the required format exactly.",
+    ])
+
+
 def runPrompt(pdfText, productData, taric_pdf_path="EU TARIC PDF.pdf", systemPrompt=BIO_CLASSIFY_SYSTEM_PROMPT):
     """
-    Builds the prompt (including EU TARIC comparison) and calls the LLM.
+    Builds the prompt (including EU TARIC comparison) and calls the LLM in structured-output mode.
+    A response that fails validation gets up to MAX_REPAIR_ATTEMPTS repair retries.
 
     Args:
         pdfText: Long text from the Product Specification Sheet (PDF).
@@ -185,116 +236,605 @@ def runPrompt(pdfText, productData, taric_pdf_path="EU TARIC PDF.pdf", systemPro
 
     Returns:
         dict: Parsed classification result with hs_code, confidence, reasoning, etc.
-              Falls back to raw string if JSON parsing fails.
+              If every attempt fails validation, a fallback result with a
+              validation_warning and zero confidence.
     """
-    prompt = buildPrompt(pdfText, productData, taric_pdf_path, systemPrompt)
-    raw_response = callLLM(prompt)
-    return parseClassificationResponse(raw_response)
+    with span("build_prompt"):
+        prompt = buildPrompt(pdfText, productData, taric_pdf_path, systemPrompt)
+    return classifyPrompt(prompt)
+
+
+async def runPromptAsync(pdfText, productData, taric_pdf_path="EU TARIC PDF.pdf", systemPrompt=BIO_CLASSIFY_SYSTEM_PROMPT):
+    """
+    Async runPrompt (off the event loop) with single-flight coalescing: concurrent
+    calls that assemble the same prompt (double submits, repeated batch lines) all
+    await one classification and get a copy of its result. Each caller waits at most
+    until its own deadline (DeadlineExceeded), the others keep waiting.
+
+    Args / Returns: as runPrompt.
+    """
+    with span("build_prompt"):
+        prompt = await asyncio.to_thread(buildPrompt, pdfText, productData, taric_pdf_path, systemPrompt)
+    # The shared call runs without any one caller's deadline; each caller bounds only its own wait
+    flight = _prompt_flights.run(prompt_key(prompt), lambda: asyncio.to_thread(classifyPrompt, prompt),
+                                 context=detached_context())
+    try:
+        result = await asyncio.wait_for(flight, timeout=remaining())
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded("llm_call")
+    return dict(result)
+
+
+def getCoalescingStats():
+    """Single-flight counters for runPromptAsync (saved = LLM classifications avoided)."""
+    return _prompt_flights.snapshot()
+
+
+def _classifyWithModel(prompt, valid_prefixes=None, model=None):
+    """Structured-output call plus the repair loop on one model (None = callLLM's own fallback)."""
+    raw_response = callLLM(prompt, response_schema=CLASSIFICATION_SCHEMA, model=model)
+
+    for attempt in range(MAX_REPAIR_ATTEMPTS + 1):
+        try:
+            with span("parse_response"):
+                result = parseClassificationResponse(raw_response, valid_prefixes)
+        except ClassificationParseError as e:
+            print(f"LLM response failed validation (attempt {attempt + 1}): {e}")
+            if attempt == MAX_REPAIR_ATTEMPTS:
+                _count_parse("fallback")
+                return fallbackClassification(raw_response, str(e))
+            raw_response = callLLM(buildRepairPrompt(prompt, raw_response, e), response_schema=CLASSIFICATION_SCHEMA, model=model)
+            continue
+        _count_parse("repaired" if attempt else "decoded")
+        return result
+
+
+def escalationReason(result, min_confidence=None):
+    """Why a cheap-model result should be retried on the strong model, or None to accept it."""
+    min_confidence = ROUTING_MIN_CONFIDENCE if min_confidence is None else min_confidence
+    if result.get("parse_fallback"):
+        return "parse_fallback"
+    if result.get("validation_warning"):
+        return "invalid_code"
+    if result["confidence"] < min_confidence:
+        return "low_confidence"
+    return None
+
+
+def _callCost(model, prompt, result):
+    """Estimated USD cost of one call from the prompt and response sizes."""
+    price_in, price_out = MODEL_PRICES.get(model, (0.0, 0.0))
+    response = (result or {}).get("raw_response") or ""
+    return (estimate_tokens(prompt) * price_in + estimate_tokens(response) * price_out) / 1e6
+
+
+def _recordRoute(route, latency_ms, cost, saved=0.0, reason=None, strong_ms=None):
+    with _routing_lock:
+        stats = ROUTING_STATS[route]
+        stats["count"] += 1
+        stats["latency_ms"] += latency_ms
+        stats["cost_usd"] += cost
+        ROUTING_STATS["cost_saved_usd"] += saved
+        if reason:
+            ROUTING_STATS["reasons"][reason] += 1
+        if strong_ms is not None:
+            ROUTING_STATS["strong_calls"]["count"] += 1
+            ROUTING_STATS["strong_calls"]["latency_ms"] += strong_ms
+
+
+def getRoutingStats():
+    """
+    Per-route counters for model routing: requests answered by the cheap model vs
+    escalated (and why), mean latency per route, estimated cost, and the cost and
+    latency saved against sending every request to the strong model.
+    """
+    with _routing_lock:
+        stats = json.loads(json.dumps(ROUTING_STATS))
+    for route in ("cheap", "escalated", "strong_calls"):
+        count = stats[route]["count"]
+        stats[route]["mean_latency_ms"] = stats[route]["latency_ms"] / count if count else None
+    cheap, strong = stats["cheap"]["mean_latency_ms"], stats["strong_calls"]["mean_latency_ms"]
+    # Time the accepted cheap answers saved versus the measured strong-model latency
+    stats["latency_saved_ms"] = (strong - cheap) * stats["cheap"]["count"] if cheap is not None and strong is not None else None
+    # Escalations paid for a cheap call on top of the strong one
+    stats["net_cost_saved_usd"] = stats["cost_saved_usd"] - stats["escalation_overhead_usd"]
+    stats["models"] = {"cheap": ROUTING_CHEAP_MODEL, "strong": ROUTING_STRONG_MODEL, "min_confidence": ROUTING_MIN_CONFIDENCE}
+    return stats
+
+
+def classifyPrompt(prompt, valid_prefixes=None):
+    """
+    Sends an assembled classification prompt in structured-output mode and validates
+    the answer, with up to MAX_REPAIR_ATTEMPTS repair retries before falling back.
+
+    With routing enabled, the cheap model answers first and the prompt is re-run on
+    the strong model only when escalationReason() objects (low confidence, invalid
+    code, parse fallback) or the cheap call errors. The result carries a "routing" block.
+
+    Args:
+        prompt: Full prompt text (e.g. from buildPrompt).
+        valid_prefixes: Headings accepted by validateHsCode. Defaults to the registry headings.
 
+    Returns:
+        dict: Parsed classification result (see parseClassificationResponse).
+    """
+    if not ROUTING_ENABLED:
+        return _classifyWithModel(prompt, valid_prefixes)
 
-def parseClassificationResponse(content):
+    started = time.perf_counter()
+    try:
+        cheap_result = _classifyWithModel(prompt, valid_prefixes, ROUTING_CHEAP_MODEL)
+        reason = escalationReason(cheap_result)
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        print(f"{ROUTING_CHEAP_MODEL} call failed, escalating: {e}")
+        cheap_result, reason = None, "error"
+    cheap_ms = (time.perf_counter() - started) * 1000
+    cheap_cost = _callCost(ROUTING_CHEAP_MODEL, prompt, cheap_result)
+
+    if reason is None:
+        saved = _callCost(ROUTING_STRONG_MODEL, prompt, cheap_result) - cheap_cost
+        _recordRoute("cheap", cheap_ms, cheap_cost, saved=saved)
+        cheap_result["routing"] = {"model": ROUTING_CHEAP_MODEL, "escalated": False}
+        return cheap_result
+
+    strong_started = time.perf_counter()
+    try:
+        strong_result = _classifyWithModel(prompt, valid_prefixes, ROUTING_STRONG_MODEL)
+    except Exception as e:
+        if cheap_result is None:
+            raise
+        # Strong model out of time or failing (429, network): answer with the cheap one's result
+        _recordRoute("cheap", cheap_ms, cheap_cost)
+        with _routing_lock:
+            ROUTING_STATS["escalations_skipped" if isinstance(e, DeadlineExceeded) else "escalations_failed"] += 1
+        cheap_result["routing"] = {"model": ROUTING_CHEAP_MODEL, "escalated": False, "reason": reason}
+        if isinstance(e, DeadlineExceeded):
+            cheap_result["routing"]["escalation_skipped"] = "deadline"
+        else:
+            print(f"{ROUTING_STRONG_MODEL} escalation failed, keeping {ROUTING_CHEAP_MODEL} answer: {e}")
+            cheap_result["routing"]["escalation_failed"] = str(e)
+        return cheap_result
+    strong_ms = (time.perf_counter() - strong_started) * 1000
+    strong_cost = _callCost(ROUTING_STRONG_MODEL, prompt, strong_result)
+    _recordRoute("escalated", cheap_ms + strong_ms, cheap_cost + strong_cost, reason=reason, strong_ms=strong_ms)
+    with _routing_lock:
+        ROUTING_STATS["escalation_overhead_usd"] += cheap_cost
+
+    # Keep the cheap answer only if the strong model could not even produce valid output
+    use_cheap = cheap_result is not None and strong_result.get("parse_fallback") and not cheap_result.get("parse_fallback")
+    result = cheap_result if use_cheap else strong_result
+    result["routing"] = {
+        "model": ROUTING_CHEAP_MODEL if use_cheap else ROUTING_STRONG_MODEL,
+        "escalated": True,
+        "reason": reason,
+        "cheap_confidence": cheap_result["confidence"] if cheap_result else None,
+    }
+    return result
+
+
+def parseClassificationResponse(content, valid_prefixes=None):
     """
-    Parse the LLM response JSON into a structured dictionary.
+    Decode and validate a structured-output LLM response.
     
     Args:
-        content: Raw LLM response string (should be JSON).
+        content: Raw LLM response string (JSON matching CLASSIFICATION_SCHEMA).
+        valid_prefixes: Headings accepted by validateHsCode. Defaults to the registry headings.
         
     Returns:
         dict: Parsed classification with validated fields.
+
+    Raises:
+        ClassificationParseError: If the response is not valid JSON or breaks the schema.
     """
     try:
-        # Remove markdown code blocks if present
-        json_content = content.strip()
-        if json_content.startswith("```json"):
-            json_content = re.sub(r'^```json\s*', '', json_content)
-            json_content = re.sub(r'\s*```$', '', json_content)
-        elif json_content.startswith("```"):
-            json_content = re.sub(r'^```\s*', '', json_content)
-            json_content = re.sub(r'\s*```$', '', json_content)
-        
-        parsed = json.loads(json_content)
-        
-        # Validate and normalize the HS code
-        hs_code = parsed.get("hs_code", "3004.90.00.00")
-        validation = validateHsCode(hs_code)
-        
-        # Ensure confidence is valid
-        confidence = parsed.get("confidence", 0.5)
-        if not isinstance(confidence, (int, float)) or confidence < 0 or confidence > 1:
-            confidence = 0.5
-            
-        return {
-            "hs_code": validation["normalized"],
-            "confidence": confidence,
-            "confidence_reasoning": parsed.get("confidence_reasoning", "Not provided"),
-            "classification_reasoning": parsed.get("classification_reasoning", {}),
-            "sources": parsed.get("sources", []),
-            "legal_memo": parsed.get("legal_memo", "No legal memo provided."),
-            "validation_warning": validation.get("error"),
-            "raw_response": content
-        }
-        
-    except json.JSONDecodeError as e:
-        print(f"Failed to parse LLM JSON response: {e}")
-        
-        # Fallback: try to extract HS code with regex
-        hs_match = re.search(r'\b(\d{4}\.?\d{2}\.?\d{2}\.?\d{2})\b', content)
-        hs_code = hs_match.group(1) if hs_match else "3004.90.00.00"
-        
-        return {
-            "hs_code": hs_code,
-            "confidence": 0.5,
-            "confidence_reasoning": "LLM did not return valid JSON",
-            "classification_reasoning": {},
-            "sources": [],
-            "legal_memo": content,  # Use raw content as memo
-            "validation_warning": "LLM did not return valid JSON. Classification may be unreliable.",
-            "raw_response": content
-        }
+        parsed = json.loads(content)
+    except (TypeError, json.JSONDecodeError) as e:
+        raise ClassificationParseError(f"invalid JSON: {e}") from e
+
+    if not isinstance(parsed, dict):
+        raise ClassificationParseError("response is not a JSON object")
+    missing = [key for key in CLASSIFICATION_SCHEMA["required"] if key not in parsed]
+    if missing:
+        raise ClassificationParseError(f"missing fields: {', '.join(missing)}")
+
+    confidence = parsed["confidence"]
+    if isinstance(confidence, bool) or not isinstance(confidence, (int, float)) or not 0 <= confidence <= 1:
+        raise ClassificationParseError(f"confidence must be a number between 0 and 1, got {confidence!r}")
+    if not isinstance(parsed["hs_code"], str):
+        raise ClassificationParseError("hs_code must be a string")
+    if not isinstance(parsed["classification_reasoning"], dict):
+        raise ClassificationParseError("classification_reasoning must be an object")
+    if not isinstance(parsed["sources"], list) or not all(isinstance(src, str) for src in parsed["sources"]):
+        raise ClassificationParseError("sources must be a list of strings")
+    if not isinstance(parsed["legal_memo"], str):
+        raise ClassificationParseError("legal_memo must be a string")
+
+    # Validate and normalize the HS code
+    validation = validateHsCode(parsed["hs_code"], valid_prefixes)
+
+    return {
+        "hs_code": validation["normalized"],
+        "confidence": confidence,
+        "confidence_reasoning": parsed["confidence_reasoning"],
+        "classification_reasoning": parsed["classification_reasoning"],
+        "sources": parsed["sources"],
+        "legal_memo": parsed["legal_memo"],
+        "validation_warning": validation.get("error"),
+        "raw_response": content
+    }
+
+
+def fallbackClassification(content, error):
+    """
+    Last-resort result once repair retries are exhausted: best-effort HS code from the
+    raw text, zero confidence, and a validation_warning so the UI asks for review.
+    """
+    content = content or ""
+    hs_match = re.search(r'\b(\d{4}\.?\d{2}\.?\d{2}\.?\d{2})\b', content)
+    hs_code = hs_match.group(1) if hs_match else "3004.90.00.00"
+
+    return {
+        "hs_code": validateHsCode(hs_code)["normalized"],
+        "confidence": 0.0,
+        "confidence_reasoning": "LLM did not return valid structured output",
+        "classification_reasoning": {},
+        "sources": [],
+        "legal_memo": content,  # Use raw content as memo
+        "validation_warning": f"LLM did not return valid JSON ({error}). Classification may be unreliable.",
+        "parse_fallback": True,
+        "raw_response": content
+    }
+
+
+# Degraded answers (deadline passed before the LLM answered) never claim more than this
+DEGRADED_MAX_CONFIDENCE = 0.3
+
+
+def degradedClassification(text, stage):
+    """
+    Fast answer without the LLM, for a request whose deadline passed: the registry code
+    found by keyword_lookup (Chapter 30's residual code when nothing matches), with
+    confidence capped at DEGRADED_MAX_CONFIDENCE and a validation_warning.
+
+    Args:
+        text: Product spec text and product data.
+        stage: Stage the deadline ran out in (for the warning).
+    """
+    code, score = keyword_lookup(text)
+    hs_code = code["code"] if code else "3004.90.00.00"
+    return {
+        "hs_code": hs_code,
+        "confidence": round(DEGRADED_MAX_CONFIDENCE * score, 3),
+        "confidence_reasoning": (f"Keyword match with '{code['description']}' ({score:.0%} of its terms)" if code
+                                 else "No keyword match; Chapter 30 residual code"),
+        "classification_reasoning": {},
+        "sources": [],
+        "legal_memo": "",
+        "validation_warning": (f"Degraded answer: the request deadline passed ({stage}); "
+                               f"{hs_code} comes from a local keyword lookup and must be verified."),
+        "degraded": True,
+    }
+
+
+# Self-consistency voting: cheap model, k parallel samples, stop at a majority on the 6-digit subheading
+CONSENSUS_MODEL = "gemini-2.5-flash-lite"
+CONSENSUS_K = 5
+
+
+async def _consensusVote(prompt, model):
+    raw_response = await callLLMAsync(prompt, response_schema=CLASSIFICATION_SCHEMA, model=model)
+    return parseClassificationResponse(raw_response)
 
 
-# Valid HS code prefixes for pharmaceutical products (Chapter 30)
-VALID_HS_PREFIXES = ["3001", "3002", "3003", "3004", "3005", "3006"]
+async def runConsensusAsync(pdfText, productData, k=CONSENSUS_K, majority=None, taric_pdf_path="EU TARIC PDF.pdf",
+                            systemPrompt=BIO_CLASSIFY_SYSTEM_PROMPT, model=CONSENSUS_MODEL):
+    """
+    Runs k classifications of the same prompt in parallel and votes on the first 6 digits
+    of hs_code. As soon as `majority` votes agree, the remaining in-flight calls are
+    cancelled, so latency stays close to a single call.
+
+    The returned confidence is the measured agreement (agreeing votes / valid votes
+    received), not the model's self-reported confidence.
 
+    Args:
+        pdfText: Long text from the Product Specification Sheet (PDF).
+        productData: Text describing the product.
+        k: Number of parallel samples.
+        majority: Votes needed to stop early. Defaults to a strict majority of k.
+        taric_pdf_path: Path to EU TARIC PDF.
+        systemPrompt: System prompt. Defaults to BIO_CLASSIFY_SYSTEM_PROMPT.
+        model: Gemini model used for every vote.
 
-def validateHsCode(code):
+    Returns:
+        dict: Classification result as from runPrompt, plus a "consensus" block with
+              the vote counts. Falls back to runPrompt if no vote returns a valid result.
     """
-    Validate HS code format and prefix for Chapter 30.
+    majority = majority or k // 2 + 1
+    prompt = await asyncio.to_thread(buildPrompt, pdfText, productData, taric_pdf_path, systemPrompt)
+    tasks = [asyncio.create_task(_consensusVote(prompt, model)) for _ in range(k)]
+
+    votes = {}
+    received = 0
+    winner = None
+    try:
+        for next_vote in asyncio.as_completed(tasks):
+            try:
+                result = await next_vote
+            except Exception as e:
+                print(f"Consensus vote failed: {e}")
+                continue
+            received += 1
+            subheading = result["hs_code"].replace(".", "")[:6]
+            votes.setdefault(subheading, []).append(result)
+            if len(votes[subheading]) >= majority:
+                winner = subheading
+                break
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    if not votes:
+        print("No valid consensus votes; falling back to a single classification")
+        return await asyncio.to_thread(runPrompt, pdfText, productData, taric_pdf_path, systemPrompt)
+
+    if winner is None:
+        winner = max(votes, key=lambda key: len(votes[key]))
+    agreeing = votes[winner]
+
+    # Representative answer: the most common full code among the agreeing votes
+    codes = [vote["hs_code"] for vote in agreeing]
+    best_code = max(set(codes), key=codes.count)
+    result = dict(next(vote for vote in agreeing if vote["hs_code"] == best_code))
+
+    agreement = len(agreeing) / received
+    result["confidence"] = agreement
+    result["confidence_reasoning"] = (
+        f"{len(agreeing)} of {received} independent classifications agree on subheading "
+        f"{winner[:4]}.{winner[4:]} (model-reported: {result['confidence_reasoning']})"
+    )
+    result["consensus"] = {
+        "k": k,
+        "majority": majority,
+        "received": received,
+        "reached": len(agreeing) >= majority,
+        "votes": {key: len(value) for key, value in votes.items()},
+        "model_confidence": sum(vote["confidence"] for vote in agreeing) / len(agreeing),
+    }
+    if len(agreeing) < majority:
+        warning = f"No majority: {len(agreeing)} of {received} votes agree (needed {majority})."
+        result["validation_warning"] = "; ".join(filter(None, [result.get("validation_warning"), warning]))
+    return result
+
+
+def runConsensus(pdfText, productData, **kwargs):
+    """Synchronous wrapper around runConsensusAsync (for scripts; the server awaits the async version)."""
+    return asyncio.run(runConsensusAsync(pdfText, productData, **kwargs))
+
+
+# Two-stage hierarchical classification (opt-in; single-stage runPrompt stays the default):
+# pick the 4-digit heading from a compact list of the keyword pre-pass chapters' headings,
+# then resolve the 10-digit code from that heading's subtree only
+HEADING_SYSTEM_PROMPT = """You are a customs classification expert. Choose the single 4-digit HS heading that best fits the product, applying the General Interpretative Rules (GIR 1: terms of headings and notes; GIR 3b: essential character, usually the active ingredient). Only choose from the headings listed.
+
+YOU MUST RESPOND WITH VALID JSON ONLY:
+{"heading": "XXXX", "confidence": 0.XX, "reasoning": "One or two sentences"}"""
+
+HEADING_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "heading": {"type": "string", "pattern": r"^\d{4}$"},
+        "confidence": {"type": "number", "minimum": 0, "maximum": 1},
+        "reasoning": {"type": "string"},
+    },
+    "required": ["heading", "confidence", "reasoning"],
+}
+
+
+def _productSection(pdfText, productData):
+    return [
+        "--- PRODUCT SPECIFICATION (PDF) ---",
+        pdfText.strip() if pdfText else "(No PDF text provided)",
+        "",
+        "--- PRODUCT DATA ---",
+        productData.strip() if productData else "(No product data provided)",
+        "",
+    ]
+
+
+def buildHeadingPrompt(pdfText, productData, headings):
+    """
+    Stage one: compact prompt listing one line per candidate 4-digit heading.
+
+    Args:
+        pdfText: Product specification text.
+        productData: Product description text.
+        headings: Candidate records from taricData.get_headings() (see headingShortlist).
+
+    Returns:
+        str: Prompt asking for the best heading as JSON (HEADING_SCHEMA).
+    """
+    lines = [f"{h['heading']} (Ch {h['chapter']} {h['chapter_title']}): {h['label']}" for h in headings.values()]
+    parts = [
+        "--- SYSTEM INSTRUCTIONS ---",
+        HEADING_SYSTEM_PROMPT,
+        "",
+        "--- CANDIDATE HEADINGS ---",
+        "\n".join(lines),
+        "",
+        *_productSection(pdfText, productData),
+        "--- TASK ---",
+        "Choose the best 4-digit heading from the candidate list. Respond with valid JSON only.",
+    ]
+    return "\n".join(parts)
+
+
+def headingShortlist(pdfText, productData, headings):
+    """
+    Stage-one candidates: the headings of the chapters chosen by the keyword pre-pass
+    (select_chapters), so stage one does not list the whole nomenclature. Falls back
+    to every heading if none of them is in those chapters.
+    """
+    chapters = select_chapters(f"{pdfText or ''}\n{productData or ''}")
+    shortlist = {code: heading for code, heading in headings.items() if heading["chapter"] in chapters}
+    return shortlist or headings
+
+
+def _chapterNotes(heading):
+    """Chapter notes and GIRs without the heading list / examples (stage two lists the codes itself)."""
+    notes = get_chapter_rules(heading["chapter"])["notes"]
+    girs = EMBEDDED_TARIC_RULES.split("GENERAL INTERPRETIVE RULES (GIRs):")[1].split("COMMON CLASSIFICATIONS:")[0]
+    return notes + "\n\nGENERAL INTERPRETIVE RULES (GIRs):" + girs.rstrip()
+
+
+def buildSubtreePrompt(pdfText, productData, heading, systemPrompt=BIO_CLASSIFY_SYSTEM_PROMPT):
+    """
+    Stage two: full classification prompt restricted to one heading's codes and notes.
+
+    Args:
+        pdfText: Product specification text.
+        productData: Product description text.
+        heading: Record from taricData.get_headings().
+        systemPrompt: System prompt. Defaults to BIO_CLASSIFY_SYSTEM_PROMPT.
+
+    Returns:
+        str: Prompt asking for the 10-digit code as JSON (CLASSIFICATION_SCHEMA).
+    """
+    codes = get_heading_subtree(heading["heading"])
+    notes = _chapterNotes(heading)
+    parts = [
+        "--- SYSTEM INSTRUCTIONS ---",
+        systemPrompt,
+        "",
+        f"--- CHAPTER {heading['chapter']} NOTES ---",
+        notes,
+        "",
+        f"--- HEADING {heading['heading']} CODES ---",
+        "\n".join(f"{code['code']}: {code['description']}" for code in codes),
+        "",
+        *_productSection(pdfText, productData),
+        "--- TASK ---",
+        f"The product has been placed in heading {heading['heading']}. Choose the correct 10-digit code from the codes listed for this heading. Respond with valid JSON only.",
+    ]
+    return "\n".join(parts)
+
+
+def runHierarchical(pdfText, productData, systemPrompt=BIO_CLASSIFY_SYSTEM_PROMPT):
+    """
+    Two-stage classification: heading first (compact prompt over the keyword pre-pass
+    shortlist), then the 10-digit code from that heading's subtree. Stage one is checked
+    with validateHeading against the shortlist, stage two with validateHsCode against the
+    headings in the nomenclature data. Falls back to runPrompt if stage one fails.
+
+    Args:
+        pdfText: Long text from the Product Specification Sheet (PDF).
+        productData: Text describing the product.
+        systemPrompt: System prompt for stage two. Defaults to BIO_CLASSIFY_SYSTEM_PROMPT.
+
+    Returns:
+        dict: Classification result as from runPrompt, plus a "hierarchy" block with the
+              chosen heading, the number of stage-one candidates and each stage's prompt
+              size (characters and estimated tokens).
+    """
+    headings = get_headings()
+    candidates = headingShortlist(pdfText, productData, headings)
+
+    heading_prompt = buildHeadingPrompt(pdfText, productData, candidates)
+    raw_heading = callLLM(heading_prompt, response_schema=HEADING_SCHEMA)
+    try:
+        heading_choice = json.loads(raw_heading)
+        validation = validateHeading(str(heading_choice["heading"]), valid_prefixes=candidates)
+    except (TypeError, KeyError, json.JSONDecodeError) as e:
+        validation = {"valid": False, "error": f"invalid heading response: {e}"}
+    if not validation["valid"]:
+        print(f"Stage one heading rejected ({validation['error']}); using single-stage classification")
+        return runPrompt(pdfText, productData, taric_pdf_path=None, systemPrompt=systemPrompt)
+
+    heading = headings[validation["normalized"]]
+    subtree_prompt = buildSubtreePrompt(pdfText, productData, heading, systemPrompt)
+    result = classifyPrompt(subtree_prompt, valid_prefixes=headings)
+
+    if not result["hs_code"].startswith(heading["heading"]):
+        warning = f"Code {result['hs_code']} is outside the stage-one heading {heading['heading']}."
+        result["validation_warning"] = "; ".join(filter(None, [result.get("validation_warning"), warning]))
+
+    result["hierarchy"] = {
+        "heading": heading["heading"],
+        "heading_confidence": heading_choice.get("confidence"),
+        "heading_reasoning": heading_choice.get("reasoning"),
+        "stage1_headings": len(candidates),
+        "stage1_prompt_chars": len(heading_prompt),
+        "stage2_prompt_chars": len(subtree_prompt),
+        "stage1_prompt_tokens": estimate_tokens(heading_prompt),
+        "stage2_prompt_tokens": estimate_tokens(subtree_prompt),
+    }
+    return result
+
+
+def validateHsCode(code, valid_prefixes=None):
+    """
+    Validate HS code format and prefix against the headings in the rules registry.
+    Accepts a 10-digit TARIC code or an 8-digit CN code (padded with "00"); a bare
+    heading is not a classification (see validateHeading).
     
     Args:
         code: HS code string to validate.
+        valid_prefixes: Allowed 4-digit headings. Defaults to rulesRegistry.valid_headings().
         
     Returns:
         dict: {valid: bool, normalized: str, error?: str}
     """
+    valid_prefixes = valid_headings() if valid_prefixes is None else valid_prefixes
+
     # Remove spaces and normalize dots
     normalized = code.replace(" ", "").replace("..", ".")
     
-    # Check format: should be like 3002.15.00.00 or 3002150000
-    with_dots = re.match(r'^(\d{4})\.(\d{2})\.(\d{2})\.(\d{2})$', normalized)
-    without_dots = re.match(r'^(\d{10})$', normalized)
+    # Check format: should be like 3002.15.00.00 or 3002150000 (or the CN 3002.15.00 / 30021500)
+    with_dots = re.match(r'^(\d{4})\.(\d{2})\.(\d{2})(?:\.(\d{2}))?$', normalized)
+    without_dots = re.match(r'^(\d{8}|\d{10})$', normalized)
     
     if with_dots:
-        prefix = with_dots.group(1)
-        formatted_code = normalized
+        digits = "".join(group or "00" for group in with_dots.groups())
     elif without_dots:
-        digits = without_dots.group(1)
-        prefix = digits[:4]
-        formatted_code = f"{digits[:4]}.{digits[4:6]}.{digits[6:8]}.{digits[8:10]}"
+        digits = without_dots.group(1).ljust(10, "0")
     else:
         return {"valid": False, "normalized": code, "error": "Invalid HS code format"}
+    prefix = digits[:4]
+    formatted_code = f"{digits[:4]}.{digits[4:6]}.{digits[6:8]}.{digits[8:10]}"
     
-    # Check if prefix is valid for Chapter 30
-    if prefix not in VALID_HS_PREFIXES:
+    # Check if prefix is a known heading
+    if prefix not in valid_prefixes:
         return {
             "valid": False,
             "normalized": formatted_code,
-            "error": f"HS code prefix {prefix} is not in Chapter 30 (valid: {', '.join(VALID_HS_PREFIXES)})"
+            "error": f"HS code prefix {prefix} is not a known heading (valid: {', '.join(sorted(valid_prefixes))})"
         }
     
     return {"valid": True, "normalized": formatted_code}
 
 
+def validateHeading(heading, valid_prefixes=None):
+    """
+    Validate a 4-digit heading (stage one of runHierarchical) against the registry.
+
+    Args:
+        heading: Heading string such as "3004".
+        valid_prefixes: Allowed 4-digit headings. Defaults to rulesRegistry.valid_headings().
+
+    Returns:
+        dict: {valid: bool, normalized: str, error?: str}
+    """
+    valid_prefixes = valid_headings() if valid_prefixes is None else valid_prefixes
+    normalized = heading.replace(" ", "").replace(".", "")
+    if not re.match(r'^\d{4}$', normalized):
+        return {"valid": False, "normalized": heading, "error": "Invalid heading format"}
+    if normalized not in valid_prefixes:
+        return {"valid": False, "normalized": normalized, "error": f"Heading {normalized} is not a known heading"}
+    return {"valid": True, "normalized": normalized}
+
+
 if __name__ == "__main__":
     # Example: minimal PDF-like text + product data
     samplePdfText = """
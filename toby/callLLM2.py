@@ -12,6 +12,14 @@ from dotenv import load_dotenv
 load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env"))
 
 from google import genai
+from google.genai import types
+from rateLimiter import create_rate_limiter, estimate_tokens
+from profiler import span
+from deadline import DeadlineExceeded, check, remaining
+import asyncio
+import hashlib
+import json
+import threading
 import time
 
 import warnings
@@ -22,26 +30,236 @@ warnings.filterwarnings(
     module="google.auth"
 )
 
-apiKey = os.environ.get("API_KEY")
-if not apiKey:
-    raise ValueError("GEMINI_API_KEY or API_KEY is not set. Add one to your .env file or export it.")
+# live: call Gemini. record: call Gemini and save every response as a cassette.
+# replay: answer only from cassettes (no API key, network or quota needed).
+LLM_MODE = os.getenv("LLM_MODE", "live").lower()
+CASSETTE_DIR = os.getenv("LLM_CASSETTE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cassettes"))
+# Simulated latency in replay: 0 (full speed), "recorded" (as long as the live call took) or seconds
+REPLAY_LATENCY = os.getenv("LLM_REPLAY_LATENCY", "0")
 
-client = genai.Client(api_key=apiKey)
+CASSETTE_STATS = {"recorded": 0, "replayed": 0, "missed": 0}
+_cassette_lock = threading.Lock()
+
+
+class CassetteMiss(LookupError):
+    """Raised in replay mode when no cassette was recorded for the prompt."""
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """The Gemini client, created on first live call (replay mode never needs a key)."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            apiKey = os.environ.get("API_KEY")
+            if not apiKey:
+                raise ValueError("GEMINI_API_KEY or API_KEY is not set. Add one to your .env file or export it.")
+            _client = genai.Client(api_key=apiKey)
+    return _client
+
+
+# Host-wide Gemini RPM/TPM limiter shared by all workers (None if no quota configured)
+rate_limiter = create_rate_limiter()
 
 # password rules
 import subprocess
 import sys
 
-def callLLM(TheContent):
+def _generation_config(response_schema):
+    """
+    Structured-output config for a JSON Schema (None for free text), with the HTTP
+    timeout capped at the time left before the request's deadline.
+    """
+    left = remaining()
+    http_options = types.HttpOptions(timeout=max(1, int(left * 1000))) if left is not None else None
+    if response_schema is None:
+        return types.GenerateContentConfig(http_options=http_options) if http_options else None
+    return types.GenerateContentConfig(
+        response_mime_type="application/json",
+        response_json_schema=response_schema,
+        http_options=http_options,
+    )
+
+
+def _wait_for_quota(TheContent):
+    """
+    Blocks until the shared limiter admits one request of this prompt's estimated size.
+    Raises DeadlineExceeded if the request's deadline passes first.
+    """
+    check("llm_call")
+    if rate_limiter:
+        with span("rate_limit_wait"):
+            try:
+                rate_limiter.acquire(estimate_tokens(TheContent), timeout=remaining())
+            except TimeoutError:
+                raise DeadlineExceeded("llm_call")
+
+
+def _refund_quota(TheContent):
+    """Gives back the quota _wait_for_quota took for a request that was never sent."""
+    if rate_limiter:
+        rate_limiter.release(estimate_tokens(TheContent))
+
+
+async def _wait_for_quota_async(TheContent):
+    """
+    _wait_for_quota in a worker thread. The blocking acquire cannot be interrupted, so a
+    caller cancelled while waiting (e.g. a consensus vote that is no longer needed)
+    refunds the quota as soon as the abandoned acquire is admitted.
+    """
+    waiting = asyncio.ensure_future(asyncio.to_thread(_wait_for_quota, TheContent))
     try:
-        response = client.models.generate_content(
-            model="gemini-2.5-flash-lite",
-            contents=TheContent
-        )
-        return response.text
+        await asyncio.shield(waiting)
+    except asyncio.CancelledError:
+        def refund(done):
+            if not done.cancelled() and done.exception() is None:
+                _refund_quota(TheContent)
+        waiting.add_done_callback(refund)
+        raise
+
+
+def cassette_key(TheContent, response_schema=None, model=None):
+    """Cassette id: hash of the prompt, the output schema and the requested model."""
+    payload = json.dumps({"model": model, "schema": response_schema, "prompt": TheContent}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _record(key, model, text, latency_s):
+    os.makedirs(CASSETTE_DIR, exist_ok=True)
+    path = os.path.join(CASSETTE_DIR, f"{key}.json")
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"model": model, "latency_s": round(latency_s, 3), "response": text}, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    _count_cassette("recorded")
+
+
+def _count_cassette(outcome):
+    with _cassette_lock:
+        CASSETTE_STATS[outcome] += 1
+
+
+def _replay(TheContent, response_schema, model):
+    """The recorded cassette, the delay to simulate, and whether it overruns the deadline."""
+    key = cassette_key(TheContent, response_schema, model)
+    try:
+        with open(os.path.join(CASSETTE_DIR, f"{key}.json"), encoding="utf-8") as f:
+            cassette = json.load(f)
+    except FileNotFoundError:
+        _count_cassette("missed")
+        raise CassetteMiss(f"No cassette {key[:12]} in {CASSETTE_DIR} for this prompt; record it with LLM_MODE=record")
+    _count_cassette("replayed")
+    delay = cassette.get("latency_s", 0) if REPLAY_LATENCY == "recorded" else float(REPLAY_LATENCY)
+    left = remaining()
+    # A simulated call slower than the deadline waits out the deadline, then fails like a live one
+    return cassette, (min(delay, left) if left is not None else delay), left is not None and delay > left
+
+
+def _callLive(TheContent, response_schema, model):
+    """Live Gemini call; returns (text, model that answered)."""
+    client = get_client()
+    if model:
+        _wait_for_quota(TheContent)
+        with span(f"llm:{model}"):
+            response = client.models.generate_content(
+                model=model,
+                contents=TheContent,
+                config=_generation_config(response_schema)
+            )
+        return response.text, model
+
+    _wait_for_quota(TheContent)
+    try:
+        with span("llm:gemini-2.5-flash-lite"):
+            response = client.models.generate_content(
+                model="gemini-2.5-flash-lite",
+                contents=TheContent,
+                config=_generation_config(response_schema)
+            )
+        return response.text, "gemini-2.5-flash-lite"
     except Exception as e:
-        response = client.models.generate_content(
-                    model="gemini-2.5-flash",
-                    contents=TheContent
-                )
-        return response.text
\ No newline at end of file
+        if isinstance(e, DeadlineExceeded):
+            raise
+        _wait_for_quota(TheContent)  # No fallback once the deadline has passed
+        with span("llm:gemini-2.5-flash"):
+            response = client.models.generate_content(
+                        model="gemini-2.5-flash",
+                        contents=TheContent,
+                        config=_generation_config(response_schema)
+                    )
+        return response.text, "gemini-2.5-flash"
+
+
+def callLLM(TheContent, response_schema=None, model=None):
+    """
+    Sends the prompt to Gemini (flash-lite, falling back to flash on error).
+    LLM_MODE=record also saves the response as a cassette; LLM_MODE=replay answers
+    from the cassettes instead of calling Gemini.
+
+    Args:
+        TheContent: Prompt text.
+        response_schema: Optional JSON Schema dict. When given, the model runs in
+            structured-output mode and is constrained to return JSON matching it.
+        model: Call only this model, with no fallback (used by model routing).
+
+    Returns:
+        str: The response text.
+
+    Raises:
+        CassetteMiss: In replay mode, if this prompt was never recorded.
+        DeadlineExceeded: If the request's deadline passes before Gemini answers.
+    """
+    if LLM_MODE == "replay":
+        with span("llm:replay"):
+            cassette, delay, late = _replay(TheContent, response_schema, model)
+            if delay:
+                time.sleep(delay)
+        if late:
+            raise DeadlineExceeded("llm_call")
+        return cassette["response"]
+
+    started = time.perf_counter()
+    text, answered_by = _callLive(TheContent, response_schema, model)
+    if LLM_MODE == "record":
+        _record(cassette_key(TheContent, response_schema, model), answered_by, text, time.perf_counter() - started)
+    return text
+
+
+async def callLLMAsync(TheContent, response_schema=None, model="gemini-2.5-flash-lite"):
+    """
+    Async single-model call (no fallback), for fan-out where callers run several
+    requests concurrently and may cancel the ones still in flight; a call cancelled
+    before it is sent returns its rate-limiter quota. Records and replays cassettes
+    like callLLM.
+
+    Args:
+        TheContent: Prompt text.
+        response_schema: Optional JSON Schema dict for structured-output mode.
+        model: Gemini model name.
+
+    Returns:
+        str: The response text.
+    """
+    if LLM_MODE == "replay":
+        with span("llm:replay"):
+            cassette, delay, late = _replay(TheContent, response_schema, model)
+            if delay:
+                await asyncio.sleep(delay)
+        if late:
+            raise DeadlineExceeded("llm_call")
+        return cassette["response"]
+
+    started = time.perf_counter()
+    await _wait_for_quota_async(TheContent)  # right before the send, so a cancelled vote leaves its quota
+    with span(f"llm:{model}"):
+        response = await get_client().aio.models.generate_content(
+            model=model,
+            contents=TheContent,
+            config=_generation_config(response_schema)
+        )
+    if LLM_MODE == "record":
+        _record(cassette_key(TheContent, response_schema, model), model, response.text, time.perf_counter() - started)
+    return response.text
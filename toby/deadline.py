@@ -0,0 +1,146 @@
+"""
+Per-request deadlines and load shedding.
+
+A request's deadline (the X-Request-Deadline header in seconds, else
+REQUEST_DEADLINE) is stored in a context variable, so every stage it reaches -
+including worker threads started with asyncio.to_thread - can ask how much time
+is left: PDF extraction shortens its document budget, the rate-limiter wait and the
+Gemini HTTP call are capped at the remainder, and check() stops a stage that would
+start after the deadline.
+
+The LoadShedder rejects a request on arrival when the work already in flight means
+it could not finish before its deadline anyway.
+
+Configure with:
+    REQUEST_DEADLINE=30   REQUEST_DEADLINE_MAX=120
+    SHED_MAX_IN_FLIGHT=64  SHED_WORKERS=<thread-pool size>
+"""
+
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+DEFAULT_DEADLINE = float(os.getenv("REQUEST_DEADLINE", "30"))
+MAX_DEADLINE = float(os.getenv("REQUEST_DEADLINE_MAX", "120"))
+
+_deadline = contextvars.ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised by a stage that cannot start (or finish) before the request's deadline."""
+
+    def __init__(self, stage):
+        super().__init__(f"Request deadline exceeded before {stage}")
+        self.stage = stage
+
+
+class Overloaded(DeadlineExceeded):
+    """Raised by LoadShedder.admit for a request that would miss its deadline in the queue."""
+
+    def __init__(self):
+        super().__init__("admission")
+
+
+def parse_deadline(header_value):
+    """Seconds allowed for a request: the header value clamped to (0, MAX_DEADLINE], else the default."""
+    try:
+        seconds = float(header_value)
+    except (TypeError, ValueError):
+        return DEFAULT_DEADLINE
+    return min(seconds, MAX_DEADLINE) if seconds > 0 else DEFAULT_DEADLINE
+
+
+@contextmanager
+def deadline_scope(seconds):
+    """Sets the deadline for the enclosed block (and threads/tasks started inside it)."""
+    token = _deadline.set(time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def detached_context():
+    """Copy of the current context without a deadline, for work shared by several requests."""
+    context = contextvars.copy_context()
+    context.run(_deadline.set, None)
+    return context
+
+
+def remaining():
+    """Seconds left before the current deadline (never negative), or None without one."""
+    deadline = _deadline.get()
+    return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+
+def budget(limit):
+    """A stage's own time limit shortened to the time left (limit 0/None = unlimited)."""
+    left = remaining()
+    if left is None:
+        return limit
+    return min(limit, left) if limit else left
+
+
+def check(stage):
+    """Raises DeadlineExceeded if the deadline has already passed."""
+    if remaining() == 0.0:
+        raise DeadlineExceeded(stage)
+
+
+class LoadShedder:
+    """
+    Admission control for classification requests.
+
+    Keeps the number of requests in flight and an exponentially weighted mean of how
+    long one takes. A new request is rejected when the cap is reached, or when it
+    would have to queue (all SHED_WORKERS busy) and the requests ahead of it mean its
+    estimated finish time is already past its deadline. While workers are free every
+    request is admitted, so the estimate keeps being refreshed.
+    """
+
+    def __init__(self, max_in_flight=None, workers=None, alpha=0.2):
+        self.max_in_flight = max_in_flight or int(os.getenv("SHED_MAX_IN_FLIGHT", "64"))
+        # asyncio.to_thread's default pool size
+        self.workers = workers or int(os.getenv("SHED_WORKERS", str(min(32, (os.cpu_count() or 1) + 4))))
+        self.alpha = alpha
+        self.mean_seconds = None
+        self.in_flight = 0
+        self.stats = {"admitted": 0, "shed": 0}
+        self._lock = threading.Lock()
+
+    def estimated_seconds(self, in_flight=None):
+        """Expected time for a request arriving now: queue wait plus one service time."""
+        if self.mean_seconds is None:
+            return 0.0
+        in_flight = self.in_flight if in_flight is None else in_flight
+        waves = in_flight // self.workers + 1
+        return waves * self.mean_seconds
+
+    @contextmanager
+    def admit(self, seconds):
+        """
+        Runs the enclosed request, or raises Overloaded at once if it cannot meet a
+        deadline of `seconds`.
+        """
+        with self._lock:
+            queued = self.in_flight >= self.workers
+            if self.in_flight >= self.max_in_flight or (queued and self.estimated_seconds() > seconds):
+                self.stats["shed"] += 1
+                raise Overloaded()
+            self.in_flight += 1
+            self.stats["admitted"] += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            with self._lock:
+                self.in_flight -= 1
+                self.mean_seconds = elapsed if self.mean_seconds is None else (
+                    self.alpha * elapsed + (1 - self.alpha) * self.mean_seconds)
+
+    def snapshot(self):
+        return {**self.stats, "in_flight": self.in_flight, "mean_seconds": self.mean_seconds}
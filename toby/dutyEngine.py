@@ -0,0 +1,255 @@
+"""
+Vectorized customs duty calculation over the taric_codes.duty_rate data.
+
+Rate tables (erga omnes and preferential, per origin) are parsed once into NumPy
+arrays indexed by the numeric 10-digit code, so duties for a whole invoice are a
+searchsorted lookup plus a few array operations instead of a loop per line.
+
+duty_rate JSON (see supabase/migrations/001_taric_database.sql):
+    {"erga_omnes": "6.5%", "preferential": {"CH": "0%", "GSP": "2.3% + 1.2 EUR/100 kg"}}
+
+Rate strings are sums of ad valorem ("6.5%") and specific ("2.3 EUR/100 kg",
+"1.2 EUR/kg", "2.7 EUR/1000 p/st") components; "Free" means 0. A "MIN ..." or
+"MAX ..." clause is a floor or cap on the duty, itself priced from its own
+components ("8.3 % MIN 2.5 EUR/100 kg", "12.8 % + 17.6 EUR/100 kg MAX 22 %").
+
+Configure with:
+    DUTY_RATES_FILE=duty_rates.json   (JSON list of {"code", "duty_rate"}; otherwise
+                                       loaded from Supabase taric_codes)
+"""
+
+import json
+import os
+import re
+from functools import lru_cache
+
+import numpy as np
+import requests
+
+
+# Specific-duty units: column and how many of the column's unit one unit holds.
+# An optional count before the unit divides the amount ("EUR/100 kg", "EUR/1000 p/st").
+_UNITS = {
+    "kg": ("kg", 1.0),
+    "tonne": ("kg", 1000.0),
+    "t": ("kg", 1000.0),
+    "p/st": ("item", 1.0),
+    "item": ("item", 1.0),
+    "items": ("item", 1.0),
+    "piece": ("item", 1.0),
+    "pieces": ("item", 1.0),
+}
+_COLUMNS = {"percent": 0, "kg": 1, "item": 2}
+
+_COMPONENT = re.compile(
+    r"(?P<amount>\d+(?:[.,]\d+)?)\s*"
+    r"(?:(?P<percent>%)|EUR\s*/\s*(?:(?P<count>\d+)\s*)?(?P<unit>"
+    + "|".join(re.escape(unit) for unit in sorted(_UNITS, key=len, reverse=True)) + r")(?!\w))",
+    re.IGNORECASE,
+)
+_BOUND = re.compile(r"\b(MIN|MAX)\b", re.IGNORECASE)
+
+_NO_BOUND = (float("nan"),) * 3
+
+
+def _parse_components(text):
+    """
+    Sums the components of one clause into [ad valorem %, EUR per kg, EUR per item], or
+    None if it has no component or any text besides components, "+" and whitespace
+    ("3.2 % + EA" is not priced as 3.2 %).
+    """
+    if _COMPONENT.sub("", text).replace("+", "").strip():
+        return None
+    columns = [0.0, 0.0, 0.0]
+    matched = False
+    for match in _COMPONENT.finditer(text):
+        matched = True
+        amount = float(match.group("amount").replace(",", "."))
+        if match.group("percent"):
+            columns[_COLUMNS["percent"]] += amount
+            continue
+        column, size = _UNITS[match.group("unit").lower()]
+        columns[_COLUMNS[column]] += amount / (size * float(match.group("count") or 1))
+    return columns if matched else None
+
+
+def parse_rate(rate):
+    """
+    Parses one rate string into nine columns: the duty's (ad valorem %, EUR per kg,
+    EUR per item), then the same three for its MIN floor and for its MAX cap (NaN
+    where the rate has no such clause).
+
+    Returns:
+        tuple or None: None if the rate is missing or not understood.
+    """
+    if rate is None:
+        return None
+    if isinstance(rate, (int, float)):
+        return (float(rate), 0.0, 0.0) + _NO_BOUND + _NO_BOUND
+    text = str(rate).strip()
+    if text.lower() in ("free", "exempt", "0"):
+        return (0.0, 0.0, 0.0) + _NO_BOUND + _NO_BOUND
+
+    # "main MIN floor MAX cap" -> ["main", "MIN", "floor", "MAX", "cap"]
+    parts = _BOUND.split(text)
+    main = _parse_components(parts[0])
+    if main is None:
+        return None
+    bounds = {"min": _NO_BOUND, "max": _NO_BOUND}
+    for keyword, clause in zip(parts[1::2], parts[2::2]):
+        columns = _parse_components(clause)
+        if columns is None:
+            return None
+        bounds[keyword.lower()] = tuple(columns)
+    return tuple(main) + bounds["min"] + bounds["max"]
+
+
+def rate_duty(rates, value, mass, count):
+    """
+    Duty for parsed rates (parse_rate's nine columns along the first axis) on scalars
+    or arrays of customs value, net mass and item count, with MIN / MAX applied.
+    """
+    rates = np.asarray(rates, dtype=np.float64)
+    duty = rates[0] / 100 * value + rates[1] * mass + rates[2] * count
+    floor = rates[3] / 100 * value + rates[4] * mass + rates[5] * count
+    cap = rates[6] / 100 * value + rates[7] * mass + rates[8] * count
+    # Absent bounds are NaN: fmax/fmin (NaN-ignoring np.maximum/np.minimum) leave the duty as is
+    return np.where(np.isnan(duty), np.nan, np.fmin(np.fmax(duty, floor), cap))
+
+
+def code_keys(codes):
+    """Numeric int64 keys for codes given as 'XXXX.XX.XX.XX' / '3004900000' strings or ints."""
+    array = np.asarray(codes)
+    if array.dtype.kind in "iu":
+        return array.astype(np.int64)
+    # View the (UCS-4) strings as a code-point matrix and keep the digits: each code has exactly 10
+    raw = np.ascontiguousarray(array.astype(str))
+    width = raw.dtype.itemsize // 4
+    matrix = raw.view(np.uint32).reshape(len(raw), width) if width else np.zeros((len(raw), 0), np.uint32)
+    digits = (matrix >= ord("0")) & (matrix <= ord("9"))
+    if not np.all(digits.sum(axis=1) == 10):
+        raise ValueError("Every TARIC code must have exactly 10 digits")
+    return (matrix[digits].reshape(-1, 10).astype(np.int64) - ord("0")) @ (10 ** np.arange(9, -1, -1, dtype=np.int64))
+
+
+class DutyRateTable:
+    """
+    Preloaded rate arrays: erga omnes rates are shape (9, n_codes) (parse_rate's
+    columns: ad valorem %, EUR/kg, EUR/item, then the MIN and MAX clauses);
+    preferential rates are shape (9, n_origins, n_codes) with NaN where an origin has
+    no preference for a code.
+    """
+
+    def __init__(self, rows):
+        parsed = []
+        origins = {}
+        for row in rows:
+            duty_rate = row.get("duty_rate") or {}
+            if isinstance(duty_rate, str):
+                duty_rate = json.loads(duty_rate)
+            preferential = {
+                origin.upper(): rate
+                for origin, rate in (duty_rate.get("preferential") or {}).items()
+                if parse_rate(rate) is not None
+            }
+            for origin in preferential:
+                origins.setdefault(origin, len(origins))
+            parsed.append((int(str(row["code"]).replace(".", "")), parse_rate(duty_rate.get("erga_omnes")), preferential))
+
+        parsed.sort(key=lambda item: item[0])
+        self.origins = origins
+        self.keys = np.array([key for key, _, _ in parsed], dtype=np.int64)
+        self.erga_omnes = np.full((9, len(parsed)), np.nan)
+        self.preferential = np.full((9, len(origins), len(parsed)), np.nan)
+        for i, (_, erga, preferential) in enumerate(parsed):
+            if erga is not None:
+                self.erga_omnes[:, i] = erga
+            for origin, rate in preferential.items():
+                self.preferential[:, origins[origin], i] = parse_rate(rate)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _lookup(self, keys):
+        index = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return index, self.keys[index] == keys
+
+    def compute(self, codes, customs_value, net_mass_kg=None, quantity=None, origins=None):
+        """
+        Duties for every invoice line at once.
+
+        Args:
+            codes: TARIC codes (strings or int keys), one per line.
+            customs_value: Customs value in EUR per line.
+            net_mass_kg: Net mass per line (needed for EUR/kg components).
+            quantity: Item count per line (needed for EUR/p/st components).
+            origins: Origin country / arrangement per line (e.g. "CH", "GSP"); the
+                preferential rate is used where it exists and is lower than erga omnes.
+
+        Returns:
+            dict of arrays: duty (EUR, NaN for unknown codes or missing rates),
+            ad_valorem_rate (%), preferential (bool), found (bool).
+        """
+        keys = code_keys(codes)
+        n = len(keys)
+        value = np.asarray(customs_value, dtype=np.float64)
+        mass = np.zeros(n) if net_mass_kg is None else np.asarray(net_mass_kg, dtype=np.float64)
+        count = np.zeros(n) if quantity is None else np.asarray(quantity, dtype=np.float64)
+
+        if not len(self.keys):
+            missing = np.full(n, np.nan)
+            return {"duty": missing, "ad_valorem_rate": missing.copy(), "preferential": np.zeros(n, dtype=bool), "found": np.zeros(n, dtype=bool)}
+
+        index, found = self._lookup(keys)
+        rates = self.erga_omnes[:, index]
+        duty = rate_duty(rates, value, mass, count)
+        applied = rates[0]
+        preferential = np.zeros(n, dtype=bool)
+
+        if origins is not None and self.origins:
+            unique, inverse = np.unique(np.asarray(origins, dtype=str), return_inverse=True)
+            origin_index = np.array([self.origins.get(o.upper(), -1) for o in unique], dtype=np.int64)[inverse]
+            known = origin_index >= 0
+            pref = np.full((9, n), np.nan)
+            pref[:, known] = self.preferential[:, origin_index[known], index[known]]
+            pref_duty = rate_duty(pref, value, mass, count)
+            preferential = ~np.isnan(pref_duty) & ~(pref_duty >= duty)  # Lower, or erga omnes missing
+            duty = np.where(preferential, pref_duty, duty)
+            applied = np.where(preferential, pref[0], applied)
+
+        duty = np.where(found, duty, np.nan)
+        return {"duty": duty, "ad_valorem_rate": np.where(found, applied, np.nan), "preferential": preferential & found, "found": found}
+
+
+def fetch_duty_rows(url, service_key, page_size=1000, timeout=30):
+    """All {"code", "duty_rate"} rows from Supabase taric_codes (REST, paged)."""
+    endpoint = f"{url.rstrip('/')}/rest/v1/taric_codes"
+    headers = {"apikey": service_key, "Authorization": f"Bearer {service_key}"}
+    rows = []
+    with requests.Session() as session:
+        while True:
+            response = session.get(
+                endpoint,
+                headers={**headers, "Range": f"{len(rows)}-{len(rows) + page_size - 1}"},
+                params={"select": "code,duty_rate", "order": "code"},
+                timeout=timeout,
+            )
+            response.raise_for_status()
+            page = response.json()
+            rows.extend(page)
+            if len(page) < page_size:
+                return rows
+
+
+@lru_cache(maxsize=1)
+def get_duty_table():
+    """Process-wide DutyRateTable from DUTY_RATES_FILE or Supabase (loaded once)."""
+    path = os.getenv("DUTY_RATES_FILE")
+    if path:
+        with open(path, encoding="utf-8") as f:
+            return DutyRateTable(json.load(f))
+    url = os.getenv("SUPABASE_URL") or os.getenv("VITE_SUPABASE_URL")
+    key = os.getenv("SUPABASE_SERVICE_KEY")
+    if not url or not key:
+        raise ValueError("Set DUTY_RATES_FILE, or SUPABASE_URL and SUPABASE_SERVICE_KEY, to load duty rates")
+    return DutyRateTable(fetch_duty_rows(url, key))
@@ -0,0 +1,254 @@
+"""
+Write-behind persistence of classification results to the classification_history table.
+
+Requests only enqueue a record (no network round-trip); a background thread flushes
+batches by size or interval to Supabase (REST) or a local SQLite file, retries failed
+batches with backoff, and drains the queue on shutdown. classified_code references
+taric_codes(code): a row whose code is not in taric_codes is written with a NULL
+classified_code and the raw code kept in extracted_data, instead of being dropped.
+
+Configure with:
+    HISTORY_BACKEND=supabase|sqlite|none   (default: supabase if SUPABASE_URL and
+                                            SUPABASE_SERVICE_KEY are set, else sqlite)
+    HISTORY_SQLITE_PATH=$DATA_DIR/classification_history.db   (DATA_DIR default: toby/data;
+                                            the file is created on the first write)
+    HISTORY_BATCH_SIZE=50  HISTORY_FLUSH_INTERVAL=2.0
+"""
+
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+import requests
+
+
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+DEFAULT_SQLITE_PATH = os.path.join(DATA_DIR, "classification_history.db")
+
+class PermanentWriteError(Exception):
+    """A batch was rejected for reasons a retry will not fix (e.g. a constraint violation)."""
+
+
+class UnknownCodeError(PermanentWriteError):
+    """A row's classified_code is not in taric_codes (foreign-key violation)."""
+
+
+class SupabaseHistoryBackend:
+    """Bulk-inserts rows through the Supabase REST API (one POST per batch)."""
+
+    def __init__(self, url, service_key, table="classification_history", timeout=10):
+        self.endpoint = f"{url.rstrip('/')}/rest/v1/{table}"
+        self.headers = {
+            "apikey": service_key,
+            "Authorization": f"Bearer {service_key}",
+            "Content-Type": "application/json",
+            "Prefer": "return=minimal",
+        }
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def write_batch(self, rows):
+        response = self.session.post(self.endpoint, headers=self.headers, json=rows, timeout=self.timeout)
+        if response.status_code == 409 and "23503" in response.text:  # PostgREST: foreign_key_violation
+            raise UnknownCodeError(f"{response.status_code}: {response.text[:200]}")
+        if 400 <= response.status_code < 500 and response.status_code not in (408, 429):
+            raise PermanentWriteError(f"{response.status_code}: {response.text[:200]}")
+        response.raise_for_status()
+
+    def close(self):
+        self.session.close()
+
+
+class SQLiteHistoryBackend:
+    """Local fallback store with the same columns as classification_history (JSON as text)."""
+
+    def __init__(self, path=DEFAULT_SQLITE_PATH):
+        self.path = path
+        self.conn = None  # opened by the writer thread on the first batch
+
+    def _connect(self):
+        if self.conn is not None:
+            return self.conn
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS classification_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                product_description TEXT NOT NULL,
+                extracted_data TEXT,
+                classified_code TEXT,
+                confidence REAL,
+                reasoning TEXT,
+                legal_memo TEXT,
+                sources TEXT,
+                conversation_history TEXT DEFAULT '[]',
+                session_id TEXT,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        self.conn.commit()
+        return self.conn
+
+    def write_batch(self, rows):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT INTO classification_history (product_description, extracted_data, classified_code, "
+                    "confidence, reasoning, legal_memo, sources) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(
+                        row["product_description"],
+                        json.dumps(row.get("extracted_data")),
+                        row.get("classified_code"),
+                        row.get("confidence"),
+                        row.get("reasoning"),
+                        row.get("legal_memo"),
+                        json.dumps(row.get("sources", [])),
+                    ) for row in rows],
+                )
+        except sqlite3.IntegrityError as e:
+            raise PermanentWriteError(str(e)) from e
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+
+
+class HistoryWriter:
+    """
+    In-process write-behind buffer.
+
+    submit() never blocks the request: records go onto a bounded queue and a daemon
+    thread writes them in batches of up to batch_size, or whatever has arrived after
+    flush_interval seconds. Failed batches are retried with exponential backoff; a batch
+    rejected permanently is retried row by row so one bad row does not lose the rest,
+    and a row rejected for an unknown classified_code is retried without it.
+    """
+
+    def __init__(self, backend, batch_size=50, flush_interval=2.0, max_retries=5, max_queue=10000):
+        self.backend = backend
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {"submitted": 0, "written": 0, "failed": 0, "dropped": 0, "batches": 0, "unknown_codes": 0}
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+            self._thread.start()
+
+    def submit(self, row):
+        """Queues one row. Drops it (and counts the drop) if the buffer is full."""
+        try:
+            self._queue.put_nowait(row)
+            self.stats["submitted"] += 1
+        except queue.Full:
+            self.stats["dropped"] += 1
+
+    def stop(self, timeout=30):
+        """Stops accepting work and drains everything still queued."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.backend.close()
+
+    def _next_batch(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if self._stop.is_set():
+                remaining = 0
+            try:
+                batch.append(self._queue.get(timeout=max(remaining, 0)) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch:
+                self._write(batch)
+            elif self._stop.is_set():
+                return
+
+    def _write(self, batch):
+        delay = 0.5
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.backend.write_batch(batch)
+                self.stats["written"] += len(batch)
+                self.stats["batches"] += 1
+                return
+            except PermanentWriteError as e:
+                if len(batch) == 1 and isinstance(e, UnknownCodeError) and batch[0].get("classified_code"):
+                    self.stats["unknown_codes"] += 1
+                    self._write([without_code(batch[0])])
+                    return
+                if len(batch) == 1:
+                    print(f"History row rejected: {e}")
+                    self.stats["failed"] += 1
+                    return
+                for row in batch:
+                    self._write([row])
+                return
+            except Exception as e:
+                if attempt == self.max_retries:
+                    print(f"History batch of {len(batch)} lost after {attempt + 1} attempts: {e}")
+                    self.stats["failed"] += len(batch)
+                    return
+                time.sleep(delay)
+                delay = min(delay * 2, 30)
+
+
+def history_row(product_description, result, extracted_data=None):
+    """Builds a classification_history row from a runPrompt-style result."""
+    reasoning = result.get("classification_reasoning") or {}
+    return {
+        "product_description": product_description or "(none)",
+        "extracted_data": extracted_data,
+        "classified_code": result.get("hs_code"),
+        "confidence": round(float(result.get("confidence", 0.0)), 2),
+        "reasoning": json.dumps(reasoning) if reasoning else result.get("confidence_reasoning"),
+        "legal_memo": result.get("legal_memo"),
+        "sources": result.get("sources", []),
+    }
+
+
+def without_code(row):
+    """The row with classified_code moved into extracted_data (for codes not in taric_codes)."""
+    extracted_data = dict(row.get("extracted_data") or {})
+    extracted_data["classified_code"] = row["classified_code"]
+    return {**row, "classified_code": None, "extracted_data": extracted_data}
+
+
+def create_history_writer():
+    """Builds a HistoryWriter from the environment, or None if HISTORY_BACKEND=none."""
+    supabase_url = os.getenv("SUPABASE_URL") or os.getenv("VITE_SUPABASE_URL")
+    supabase_key = os.getenv("SUPABASE_SERVICE_KEY")
+    backend_name = os.getenv("HISTORY_BACKEND") or ("supabase" if supabase_url and supabase_key else "sqlite")
+
+    if backend_name == "none":
+        return None
+    if backend_name == "supabase":
+        if not supabase_url or not supabase_key:
+            raise ValueError("HISTORY_BACKEND=supabase needs SUPABASE_URL and SUPABASE_SERVICE_KEY")
+        backend = SupabaseHistoryBackend(supabase_url, supabase_key)
+    elif backend_name == "sqlite":
+        backend = SQLiteHistoryBackend(os.getenv("HISTORY_SQLITE_PATH", DEFAULT_SQLITE_PATH))
+    else:
+        raise ValueError(f"Unknown HISTORY_BACKEND: {backend_name}")
+
+    return HistoryWriter(
+        backend,
+        batch_size=int(os.getenv("HISTORY_BATCH_SIZE", "50")),
+        flush_interval=float(os.getenv("HISTORY_FLUSH_INTERVAL", "2.0")),
+    )
@@ -0,0 +1,203 @@
+"""
+Streaming classification of commercial-invoice CSVs.
+
+Lines are read lazily and processed in windows: each line is normalised into a
+ClassificationRequest / build_product_data() string, identical products are
+deduplicated, only products not seen recently are classified (concurrently, through
+runPrompt), and every line is written back out, in order, with the code joined on.
+Memory is bounded by the window size and the result cache, not by the file size.
+
+Recognised columns (case-insensitive; list columns split on ";" or "|"):
+    description / product_description, cas_numbers, active_ingredients,
+    chemical_composition, safety_warnings, formulation, packaging,
+    therapeutic_use, manufacturer, storage
+
+Usage:
+    python invoicePipeline.py invoice.csv -o classified.csv --concurrency 8
+"""
+
+import argparse
+import asyncio
+import csv
+import hashlib
+import io
+import re
+import sys
+import time
+from collections import OrderedDict
+
+from buildPrompt import runPrompt
+from models import ClassificationRequest, build_product_data
+
+
+WINDOW_SIZE = 500  # Lines buffered per window
+CACHE_SIZE = 10000  # Classified products remembered across windows
+CONCURRENCY = 8  # Simultaneous runPrompt calls
+
+OUTPUT_COLUMNS = ["hs_code", "confidence", "validation_warning", "classification_error", "duplicate"]
+
+_DESCRIPTION_COLUMNS = ("product_description", "description", "product", "item_description")
+_LIST_FIELDS = ("cas_numbers", "active_ingredients", "chemical_composition", "safety_warnings",
+                "formulation", "packaging", "therapeutic_use")
+_TEXT_FIELDS = ("manufacturer", "storage")
+_LIST_SEPARATOR = re.compile(r"\s*[;|]\s*")
+
+
+def _clean(value):
+    return " ".join((value or "").split())
+
+
+def line_request(row):
+    """Normalises one CSV row into a ClassificationRequest (no extracted text)."""
+    fields = {(key or "").strip().lower().replace(" ", "_"): value for key, value in row.items()}
+    description = next((_clean(fields[c]) for c in _DESCRIPTION_COLUMNS if _clean(fields.get(c))), "")
+    request = {"extracted_text": "", "product_description": description}
+    for name in _LIST_FIELDS:
+        items = [_clean(item) for item in _LIST_SEPARATOR.split(fields.get(name) or "")]
+        request[name] = sorted({item for item in items if item}, key=str.lower)
+    for name in _TEXT_FIELDS:
+        request[name] = _clean(fields.get(name)) or None
+    return ClassificationRequest(**request)
+
+
+def product_key(product_data):
+    """Dedup key: case- and whitespace-insensitive hash of the product data."""
+    return hashlib.sha1(" ".join(product_data.lower().split()).encode()).hexdigest()
+
+
+class InvoiceClassifier:
+    """
+    Classifies invoice rows window by window with a bounded LRU of product results.
+
+    Stats: lines, unique products classified, duplicate lines answered from earlier
+    results, and failed classifications.
+    """
+
+    def __init__(self, concurrency=CONCURRENCY, window_size=WINDOW_SIZE, cache_size=CACHE_SIZE, classify=None):
+        self.window_size = window_size
+        self.cache_size = cache_size
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._classify = classify or (lambda product_data: runPrompt("", product_data))
+        self._cache = OrderedDict()
+        self.stats = {"lines": 0, "classified": 0, "duplicates": 0, "failed": 0}
+
+    def _remember(self, key, result):
+        self._cache[key] = result
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _classify_one(self, product_data):
+        async with self._semaphore:
+            try:
+                result = await asyncio.to_thread(self._classify, product_data)
+                return {
+                    "hs_code": result.get("hs_code", ""),
+                    "confidence": result.get("confidence", ""),
+                    "validation_warning": result.get("validation_warning") or "",
+                    "classification_error": "",
+                }
+            except Exception as e:
+                self.stats["failed"] += 1
+                return {"hs_code": "", "confidence": "", "validation_warning": "", "classification_error": str(e)}
+
+    async def _process_window(self, window):
+        keyed = []
+        resolved = {}
+        pending = {}
+        for row in window:
+            product_data = build_product_data(line_request(row))
+            key = product_key(product_data)
+            keyed.append((row, key))
+            if key in resolved or key in pending:
+                continue
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                resolved[key] = self._cache[key]
+            else:
+                pending[key] = product_data
+
+        results = await asyncio.gather(*(self._classify_one(data) for data in pending.values()))
+        self.stats["classified"] += len(pending)
+        for key, result in zip(pending, results):
+            resolved[key] = result
+            self._remember(key, result)
+
+        out = []
+        for row, key in keyed:
+            first_use = pending.pop(key, None) is not None
+            self.stats["duplicates"] += not first_use
+            out.append({**row, **resolved[key], "duplicate": "" if first_use else "yes"})
+        return out
+
+    async def classify_rows(self, rows):
+        """Async generator: yields every input row (in order) with the output columns added."""
+        window = []
+        for row in rows:
+            self.stats["lines"] += 1
+            window.append(row)
+            if len(window) >= self.window_size:
+                for out in await self._process_window(window):
+                    yield out
+                window = []
+        if window:
+            for out in await self._process_window(window):
+                yield out
+
+
+async def stream_invoice_csv(text_stream, classifier=None):
+    """
+    Async generator of CSV text chunks: the input columns plus OUTPUT_COLUMNS.
+
+    Args:
+        text_stream: Text file object (or any iterable of lines) holding the invoice CSV.
+        classifier: InvoiceClassifier to use (its stats stay readable afterwards).
+    """
+    classifier = classifier or InvoiceClassifier()
+    reader = csv.DictReader(text_stream)
+    fieldnames = list(reader.fieldnames or []) + [c for c in OUTPUT_COLUMNS if c not in (reader.fieldnames or [])]
+
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fieldnames, extrasaction="ignore")
+    writer.writeheader()
+    rows_in_chunk = 0
+    async for row in classifier.classify_rows(reader):
+        writer.writerow(row)
+        rows_in_chunk += 1
+        if rows_in_chunk >= classifier.window_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            rows_in_chunk = 0
+    yield buffer.getvalue()
+
+
+async def _run_cli(args):
+    classifier = InvoiceClassifier(concurrency=args.concurrency, window_size=args.window, cache_size=args.cache)
+    started = time.time()
+    with open(args.invoice, encoding="utf-8-sig", newline="") as source:
+        output = open(args.output, "w", encoding="utf-8", newline="") if args.output else sys.stdout
+        try:
+            async for chunk in stream_invoice_csv(source, classifier):
+                output.write(chunk)
+        finally:
+            if output is not sys.stdout:
+                output.close()
+    stats = classifier.stats
+    print(f"{stats['lines']} lines, {stats['classified']} unique products classified, "
+          f"{stats['duplicates']} duplicate lines, {stats['failed']} failed in {time.time() - started:.1f}s",
+          file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Classify every line of a commercial-invoice CSV")
+    parser.add_argument("invoice", help="Invoice CSV (needs a description / product_description column)")
+    parser.add_argument("-o", "--output", help="Output CSV (default: stdout)")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--window", type=int, default=WINDOW_SIZE, help="Lines buffered per window")
+    parser.add_argument("--cache", type=int, default=CACHE_SIZE, help="Products remembered across windows")
+    asyncio.run(_run_cli(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Request/response models and product-data formatting shared by the API server and
+the batch invoice pipeline.
+"""
+
+import os
+from typing import Optional, List
+
+from pydantic import BaseModel, Field
+
+# Upper bound on consensus_k: every vote is a separate Gemini call
+CONSENSUS_MAX = int(os.getenv("CONSENSUS_MAX", "9"))
+
+
+class ClassificationRequest(BaseModel):
+    extracted_text: str
+    product_description: str
+    cas_numbers: Optional[List[str]] = []
+    active_ingredients: Optional[List[str]] = []
+    safety_warnings: Optional[List[str]] = []
+    chemical_composition: Optional[List[str]] = []
+    formulation: Optional[List[str]] = []
+    packaging: Optional[List[str]] = []
+    therapeutic_use: Optional[List[str]] = []
+    manufacturer: Optional[str] = None
+    storage: Optional[str] = None
+    # Self-consistency voting: run this many parallel classifications and return the
+    # measured agreement as confidence. None/1 = single call.
+    consensus_k: Optional[int] = Field(None, ge=1, le=CONSENSUS_MAX)
+    # Two-stage classification: pick the heading first, then the code within it
+    hierarchical: Optional[bool] = False
+    # Return a prior result for a near-duplicate sheet instead of calling the LLM
+    reuse: Optional[bool] = True
+    # When a prior result is reused, re-run the classification in the background and store it
+    revalidate: Optional[bool] = False
+
+
+class ClassificationResponse(BaseModel):
+    hs_code: str
+    confidence: float
+    confidence_reasoning: str
+    memo: str
+    partial_accuracy: str
+    six_digit_match: str
+    sources: List[str] = []
+    validation_warning: Optional[str] = None
+    reused: bool = False
+    reused_similarity: Optional[float] = None
+    # Deadline passed before the LLM answered; code from the local index / keyword lookup
+    degraded: bool = False
+
+
+def build_product_data(req: ClassificationRequest) -> str:
+    """Build product data string from request fields."""
+    parts = [f"Product Description: {req.product_description}"]
+    
+    if req.cas_numbers:
+        parts.append(f"CAS Numbers: {', '.join(req.cas_numbers)}")
+    if req.active_ingredients:
+        parts.append(f"Active Ingredients: {', '.join(req.active_ingredients)}")
+    if req.chemical_composition:
+        parts.append(f"Chemical Composition: {', '.join(req.chemical_composition)}")
+    if req.safety_warnings:
+        parts.append(f"Safety Warnings: {', '.join(req.safety_warnings)}")
+    if req.formulation:
+        parts.append(f"Formulation: {', '.join(req.formulation)}")
+    if req.packaging:
+        parts.append(f"Packaging: {', '.join(req.packaging)}")
+    if req.therapeutic_use:
+        parts.append(f"Therapeutic Use: {', '.join(req.therapeutic_use)}")
+    if req.manufacturer:
+        parts.append(f"Manufacturer: {req.manufacturer}")
+    if req.storage:
+        parts.append(f"Storage: {req.storage}")
+    
+    return "\n".join(parts)
@@ -0,0 +1,189 @@
+"""
+Near-duplicate detection for spec sheets, so prior classifications can be reused.
+
+Supplier sheets for the same product differ in dates, lot numbers and layout, so an
+exact hash misses them. Text is normalised, split into word shingles and summarised as
+a MinHash signature; an LSH index (banded buckets in SQLite) finds candidate sheets
+without scanning, and the signature agreement estimates Jaccard similarity.
+
+Configure with:
+    NEAR_DUP_DB=$DATA_DIR/near_duplicates.db   (DATA_DIR default: toby/data; the file is
+                                                created when the first sheet is added)
+    NEAR_DUP_THRESHOLD=0.9   NEAR_DUP=off (to disable)
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+
+import numpy as np
+
+
+NUM_PERM = 128
+BANDS = 16  # 16 bands x 8 rows: candidate threshold ~0.71 Jaccard
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 3
+DEFAULT_THRESHOLD = 0.9
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+DEFAULT_PATH = os.path.join(DATA_DIR, "near_duplicates.db")
+
+_PRIME = np.uint64(4294967311)  # Smallest prime above 2**32; keeps a*x+b inside uint64
+_rng = np.random.RandomState(20240601)  # Fixed seed: signatures must be stable across processes
+_PERM_A = _rng.randint(1, 2**32 - 1, size=NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.randint(0, 2**32 - 1, size=NUM_PERM, dtype=np.uint64)
+
+# Volatile tokens that differ between otherwise identical sheets
+_DATE = re.compile(
+    r"\b\d{1,4}[./-]\d{1,2}[./-]\d{1,4}\b"
+    r"|\b\d{1,2}\s+(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?\s+\d{2,4}\b"
+    r"|\b(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?\s+\d{1,2},?\s+\d{2,4}\b",
+    re.IGNORECASE,
+)
+# Keyword as a whole word, a separator, then an identifier with at least one digit
+# (so "lotion", "Reference", "Batch size" or "Document control" are left alone)
+_LOT = re.compile(
+    r"\b(?:lot|batch|charge|serial|ref|revision|rev|version|ver|doc(?:ument)?)\b"
+    r"(?:\s*(?:no\b\.?|number\b))?[\s:#.]+(?=[\w./-]*\d)[\w./-]+",
+    re.IGNORECASE,
+)
+_PAGE = re.compile(r"\bpage\s+\d+\s*(?:of|/)\s*\d+\b", re.IGNORECASE)
+_NON_WORD = re.compile(r"[^\w%.-]+")
+
+
+def normalize_text(text):
+    """Lowercases, strips dates / lot numbers / page footers and collapses punctuation and whitespace."""
+    text = _DATE.sub(" ", text or "")
+    text = _LOT.sub(" ", text)
+    text = _PAGE.sub(" ", text)
+    return " ".join(_NON_WORD.sub(" ", text.lower()).split())
+
+
+def shingle_hashes(text):
+    """32-bit hashes of the word shingles of normalised text."""
+    words = normalize_text(text).split()
+    if len(words) < SHINGLE_SIZE:
+        words = words + [""] * (SHINGLE_SIZE - len(words))
+    shingles = {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+    return np.fromiter(
+        (int.from_bytes(hashlib.blake2b(s.encode(), digest_size=4).digest(), "little") for s in shingles),
+        dtype=np.uint64, count=len(shingles),
+    )
+
+
+def minhash_signature(text):
+    """MinHash signature (NUM_PERM uint32 values) of the text's shingle set."""
+    hashes = shingle_hashes(text)
+    permuted = (np.outer(_PERM_A, hashes) + _PERM_B[:, None]) % _PRIME
+    return (permuted.min(axis=1) & np.uint64(0xFFFFFFFF)).astype(np.uint32)
+
+
+def _band_keys(signature):
+    """One 63-bit bucket key per LSH band."""
+    keys = []
+    for band in range(BANDS):
+        chunk = signature[band * ROWS:(band + 1) * ROWS].tobytes()
+        keys.append(int.from_bytes(hashlib.blake2b(chunk, digest_size=8).digest(), "little") >> 1)
+    return keys
+
+
+class NearDuplicateIndex:
+    """
+    Disk-backed MinHash/LSH index of classified sheets.
+
+    Lookups touch only the rows sharing an LSH bucket with the query, so cost stays flat
+    as the store grows to hundreds of thousands of sheets.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, threshold=DEFAULT_THRESHOLD):
+        self.path = path
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self.conn = None  # opened on first use; an index nothing was added to stays off disk
+
+    def _connect(self, create):
+        """The connection (call under self._lock), or None if the file does not exist and create is False."""
+        if self.conn is not None:
+            return self.conn
+        if not create and not os.path.exists(self.path):
+            return None
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS sheets (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                signature BLOB NOT NULL,
+                result TEXT NOT NULL,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP
+            );
+            CREATE TABLE IF NOT EXISTS buckets (
+                band INTEGER NOT NULL,
+                bucket INTEGER NOT NULL,
+                sheet_id INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_buckets ON buckets(band, bucket);
+        """)
+        return self.conn
+
+    def add(self, text, result):
+        """Stores a classification result under the text's signature."""
+        signature = minhash_signature(text)
+        stored = {key: value for key, value in result.items() if key != "raw_response"}
+        with self._lock:
+            conn = self._connect(create=True)
+            with conn:
+                cursor = conn.execute(
+                    "INSERT INTO sheets (signature, result) VALUES (?, ?)",
+                    (signature.tobytes(), json.dumps(stored)),
+                )
+                conn.executemany(
+                    "INSERT INTO buckets (band, bucket, sheet_id) VALUES (?, ?, ?)",
+                    [(band, key, cursor.lastrowid) for band, key in enumerate(_band_keys(signature))],
+                )
+
+    def query(self, text, threshold=None):
+        """
+        Finds the most similar stored sheet.
+
+        Returns:
+            tuple: (result dict, estimated Jaccard similarity) for the best match at or
+                   above the threshold, or None.
+        """
+        threshold = self.threshold if threshold is None else threshold
+        signature = minhash_signature(text)
+        clauses = " OR ".join(["(band = ? AND bucket = ?)"] * BANDS)
+        params = [value for band, key in enumerate(_band_keys(signature)) for value in (band, key)]
+
+        with self._lock:
+            conn = self._connect(create=False)
+            if conn is None:
+                return None
+            rows = conn.execute(
+                f"SELECT id, signature, result FROM sheets WHERE id IN "
+                f"(SELECT sheet_id FROM buckets WHERE {clauses}) ORDER BY id DESC",
+                params,
+            ).fetchall()
+
+        best = None
+        for _, blob, result in rows:
+            similarity = float(np.mean(np.frombuffer(blob, dtype=np.uint32) == signature))
+            if similarity >= threshold and (best is None or similarity > best[1]):
+                best = (json.loads(result), similarity)
+        return best
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+
+
+def create_near_duplicate_index():
+    """Builds the index from the environment, or None if NEAR_DUP=off."""
+    if os.getenv("NEAR_DUP", "on").lower() in ("off", "0", "false"):
+        return None
+    return NearDuplicateIndex(
+        os.getenv("NEAR_DUP_DB", DEFAULT_PATH),
+        threshold=float(os.getenv("NEAR_DUP_THRESHOLD", str(DEFAULT_THRESHOLD))),
+    )
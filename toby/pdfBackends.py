@@ -0,0 +1,255 @@
+"""
+Pluggable per-page PDF text extractors.
+
+    pdfplumber  reference output; slowest (builds every character object and runs
+                its own layout pass on each page)
+    pdfium      pypdfium2 text pages (PDFium, C++); an order of magnitude faster
+    pdfminer    pdfminer.six TextConverter, without pdfplumber's object model
+    auto        pdfium for plain-text pages; pages that look like they hold a ruled
+                table go to pdfplumber, whose reading order keeps table rows together
+
+Table detection for auto uses PDFium's page objects: a page with at least two
+vertical and two horizontal ruling lines is treated as a table page (the same
+edges pdfplumber's lattice table finder needs).
+
+Select with PDF_BACKEND (default auto). Backends whose library is not installed
+fall back to pdfplumber. verify_backend() compares a backend's text against
+pdfplumber page by page; benchmark_pdf.py reports throughput and agreement.
+"""
+
+import difflib
+import io
+import os
+import threading
+from collections import Counter
+
+import pdfplumber
+
+try:
+    import pypdfium2 as pdfium
+    import pypdfium2.raw as pdfium_c
+except ImportError:  # optional fast path
+    pdfium = None
+
+
+PDF_BACKEND = os.getenv("PDF_BACKEND", "auto")
+RULING_MAX_WIDTH = 3  # Points; thinner path objects count as ruling lines
+RULING_MIN_LENGTH = 5
+
+# PDFium is not thread-safe; the server extracts from worker threads
+_pdfium_lock = threading.Lock()
+
+
+def release_page(page):
+    """Drops pdfplumber's cached layout objects for a page once it has been processed."""
+    close = getattr(page, "close", None)
+    if close:
+        close()
+    else:
+        page.flush_cache()
+
+
+class Extractor:
+    """Interface: page_count, page_text(index), page_backend(index), close(); a context manager."""
+
+    name = None
+    page_count = 0
+
+    def page_text(self, index):
+        raise NotImplementedError
+
+    def page_backend(self, index):
+        """Backend that serves this page (differs from name only for auto)."""
+        return self.name
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class PdfplumberExtractor(Extractor):
+    name = "pdfplumber"
+
+    def __init__(self, pdf_path):
+        self._pdf = pdfplumber.open(pdf_path)
+        self.page_count = len(self._pdf.pages)
+
+    def page_text(self, index):
+        page = self._pdf.pages[index]
+        try:
+            return page.extract_text() or ""
+        finally:
+            release_page(page)
+
+    def close(self):
+        self._pdf.close()
+
+
+class PdfiumExtractor(Extractor):
+    name = "pdfium"
+
+    def __init__(self, pdf_path):
+        with _pdfium_lock:
+            self._doc = pdfium.PdfDocument(pdf_path)
+            self.page_count = len(self._doc)
+
+    def page_text(self, index):
+        with _pdfium_lock:
+            page = self._doc[index]
+            try:
+                text_page = page.get_textpage()
+                try:
+                    text = text_page.get_text_range()
+                finally:
+                    text_page.close()
+            finally:
+                page.close()
+        return text.replace("\r\n", "\n").replace("\r", "\n")
+
+    def has_table(self, index):
+        """True if the page has the ruling lines of a lattice table."""
+        horizontal = vertical = 0
+        with _pdfium_lock:
+            page = self._doc[index]
+            try:
+                for obj in page.get_objects(filter=[pdfium_c.FPDF_PAGEOBJ_PATH], max_depth=3):
+                    left, bottom, right, top = obj.get_bounds()
+                    width, height = right - left, top - bottom
+                    if height <= RULING_MAX_WIDTH and width >= RULING_MIN_LENGTH:
+                        horizontal += 1
+                    elif width <= RULING_MAX_WIDTH and height >= RULING_MIN_LENGTH:
+                        vertical += 1
+                    if horizontal >= 2 and vertical >= 2:
+                        return True
+            finally:
+                page.close()
+        return False
+
+    def close(self):
+        with _pdfium_lock:
+            self._doc.close()
+
+
+class PdfminerExtractor(Extractor):
+    name = "pdfminer"
+
+    def __init__(self, pdf_path):
+        from pdfminer.pdfdocument import PDFDocument
+        from pdfminer.pdfinterp import PDFResourceManager
+        from pdfminer.pdfpage import PDFPage
+        from pdfminer.pdfparser import PDFParser
+
+        self._file = open(pdf_path, "rb")
+        self._pages = list(PDFPage.create_pages(PDFDocument(PDFParser(self._file))))
+        self._resources = PDFResourceManager(caching=True)
+        self.page_count = len(self._pages)
+
+    def page_text(self, index):
+        from pdfminer.converter import TextConverter
+        from pdfminer.layout import LAParams
+        from pdfminer.pdfinterp import PDFPageInterpreter
+
+        out = io.StringIO()
+        device = TextConverter(self._resources, out, laparams=LAParams())
+        try:
+            PDFPageInterpreter(self._resources, device).process_page(self._pages[index])
+        finally:
+            device.close()
+        return out.getvalue().replace("\x0c", "").strip()
+
+    def close(self):
+        self._file.close()
+
+
+class AutoExtractor(PdfiumExtractor):
+    """PDFium for plain-text pages, pdfplumber (opened on first use) for table pages."""
+
+    name = "auto"
+
+    def __init__(self, pdf_path):
+        super().__init__(pdf_path)
+        self._path = pdf_path
+        self._plumber = None
+        self._table_pages = {}
+
+    def page_backend(self, index):
+        if index not in self._table_pages:
+            self._table_pages[index] = self.has_table(index)
+        return "pdfplumber" if self._table_pages[index] else "pdfium"
+
+    def page_text(self, index):
+        if self.page_backend(index) == "pdfium":
+            return super().page_text(index)
+        if self._plumber is None:
+            self._plumber = PdfplumberExtractor(self._path)
+        return self._plumber.page_text(index)
+
+    def close(self):
+        if self._plumber is not None:
+            self._plumber.close()
+        super().close()
+
+
+BACKENDS = {
+    "pdfplumber": PdfplumberExtractor,
+    "pdfium": PdfiumExtractor,
+    "pdfminer": PdfminerExtractor,
+    "auto": AutoExtractor,
+}
+
+
+def open_extractor(pdf_path, backend=None):
+    """
+    Opens pdf_path with the named backend (default PDF_BACKEND). PDFium-based
+    backends fall back to pdfplumber when pypdfium2 is not installed.
+    """
+    backend = backend or PDF_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown PDF backend {backend!r}; choose from {', '.join(BACKENDS)}")
+    if backend in ("pdfium", "auto") and pdfium is None:
+        backend = "pdfplumber"
+    return BACKENDS[backend](pdf_path)
+
+
+def text_similarity(text, reference):
+    """
+    Agreement of two extractions, ignoring whitespace and line breaks.
+
+    Returns:
+        dict: "words" - share of words the two have in common (multiset F1), i.e.
+              same content regardless of order; "order" - word-sequence similarity,
+              which also drops when a header or column is emitted in another place.
+    """
+    words, reference_words = text.split(), reference.split()
+    if not words and not reference_words:
+        return {"words": 1.0, "order": 1.0}
+    common = sum((Counter(words) & Counter(reference_words)).values())
+    return {
+        "words": round(2 * common / (len(words) + len(reference_words)), 4),
+        "order": round(difflib.SequenceMatcher(None, words, reference_words, autojunk=False).ratio(), 4),
+    }
+
+
+def verify_backend(pdf_path, backend):
+    """
+    Per-page agreement of a backend with pdfplumber.
+
+    Returns:
+        list: {"page", "backend" (the one that served the page), "words", "order"} per
+              page, as in text_similarity().
+    """
+    pages = []
+    with open_extractor(pdf_path, backend) as extractor, PdfplumberExtractor(pdf_path) as reference:
+        for index in range(extractor.page_count):
+            pages.append({
+                "page": index + 1,
+                "backend": extractor.page_backend(index),
+                **text_similarity(extractor.page_text(index), reference.page_text(index)),
+            })
+    return pages
@@ -0,0 +1,178 @@
+"""
+Bounded PDF text extraction for the server.
+
+pdfplumber keeps every page's layout objects cached while the document is open, so a
+huge or malformed upload can grow memory without bound or hang a worker. This module
+releases each page's cache after use and enforces per-page / per-document time budgets
+and a memory ceiling, returning partial text with warnings instead of blocking.
+time_limit, PageTimeout and current_rss_mb are shared with andrei/read_pdf.py.
+
+The page budget relies on SIGALRM, which only fires in a main thread, so the server
+calls extract_pdf_text_isolated: extraction runs in the main thread of a child
+process (this module as a script) that is killed if it outlives the document budget.
+
+Pages are read through a pdfBackends extractor (PDF_BACKEND, default auto: PDFium
+for plain-text pages, pdfplumber for pages with tables).
+"""
+
+from contextlib import contextmanager
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+from pdfBackends import open_extractor
+
+
+# Budgets (0 disables a limit). Override through the environment.
+PAGE_TIMEOUT = float(os.getenv("PDF_PAGE_TIMEOUT", "10"))
+DOC_TIMEOUT = float(os.getenv("PDF_DOC_TIMEOUT", "60"))
+MAX_RSS_MB = float(os.getenv("PDF_MAX_RSS_MB", "1024"))
+KILL_GRACE = float(os.getenv("PDF_KILL_GRACE", "5"))  # extra seconds before an isolated extraction is killed
+
+
+class PageTimeout(Exception):
+    """Raised inside a page's extraction when its time budget runs out."""
+
+
+@contextmanager
+def time_limit(seconds):
+    """
+    Interrupts the enclosed block with PageTimeout after `seconds`.
+
+    Uses SIGALRM, so it only preempts on POSIX in the main thread (batch extraction,
+    read_pdf workers, the extract_pdf_text_isolated child); elsewhere the block runs to
+    completion and the document budget still applies between pages.
+    """
+    if not seconds or not hasattr(signal, "SIGALRM") or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def _raise(signum, frame):
+        raise PageTimeout()
+
+    previous = signal.signal(signal.SIGALRM, _raise)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def current_rss_mb():
+    """Resident set size of this process in MB (current on Linux, peak elsewhere)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        import resource  # POSIX only; Linux takes the /proc path above
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def extract_pdf_text_bounded(pdf_path, page_timeout=PAGE_TIMEOUT, doc_timeout=DOC_TIMEOUT, max_rss_mb=MAX_RSS_MB,
+                             backend=None):
+    """
+    Extracts text from a PDF within time and memory budgets.
+
+    Args:
+        pdf_path: Path to the PDF file.
+        page_timeout: Seconds allowed per page; slower pages are skipped.
+        doc_timeout: Seconds allowed for the whole document; extraction stops after it.
+        max_rss_mb: Resident memory ceiling in MB; extraction stops above it.
+        backend: pdfBackends backend name (default PDF_BACKEND). The page budget can
+            only interrupt between Python calls, so a single PDFium call runs to its end.
+
+    Returns:
+        dict: {
+            "text": extracted text (partial if truncated),
+            "pages": pages extracted,
+            "total_pages": pages in the document,
+            "truncated": True if any page was skipped or extraction stopped early,
+            "warnings": list of human-readable warnings,
+            "backends": pages served by each backend
+        }
+    """
+    started = time.monotonic()
+    parts = []
+    warnings = []
+    extracted = 0
+    backends = {}
+
+    with open_extractor(pdf_path, backend) as extractor:
+        total_pages = extractor.page_count
+
+        for page_number in range(1, total_pages + 1):
+            if doc_timeout and time.monotonic() - started > doc_timeout:
+                warnings.append(f"Stopped at page {page_number} of {total_pages}: document time budget of {doc_timeout}s exceeded")
+                break
+            if max_rss_mb and current_rss_mb() > max_rss_mb:
+                warnings.append(f"Stopped at page {page_number} of {total_pages}: memory ceiling of {max_rss_mb} MB exceeded")
+                break
+
+            try:
+                with time_limit(page_timeout):
+                    text = extractor.page_text(page_number - 1)
+            except PageTimeout:
+                warnings.append(f"Page {page_number} skipped: page time budget of {page_timeout}s exceeded")
+                continue
+
+            parts.append(text)
+            extracted += 1
+            served_by = extractor.page_backend(page_number - 1)
+            backends[served_by] = backends.get(served_by, 0) + 1
+
+    return {
+        "text": "\n\n".join(parts).strip(),
+        "pages": extracted,
+        "total_pages": total_pages,
+        "truncated": bool(warnings),
+        "warnings": warnings,
+        "backends": backends,
+    }
+
+
+
+def extract_pdf_text_isolated(pdf_path, doc_timeout=DOC_TIMEOUT, kill_grace=KILL_GRACE, **kwargs):
+    """
+    Runs extract_pdf_text_bounded in a child process with a hard kill timeout.
+
+    The child (this module run as a script) enforces the per-page budget in its main
+    thread, and the memory ceiling applies to the child alone. If it has not finished
+    within doc_timeout + kill_grace seconds (a page stuck inside native code), it is
+    killed and an empty, truncated result is returned, so the calling thread is always
+    released.
+
+    Args:
+        pdf_path: Path to the PDF file.
+        doc_timeout: Seconds allowed for the whole document (0 disables the hard limit too).
+        kill_grace: Extra seconds before the child is killed.
+        **kwargs: Passed to extract_pdf_text_bounded (page_timeout, max_rss_mb, backend).
+
+    Returns:
+        dict: as extract_pdf_text_bounded.
+
+    Raises:
+        RuntimeError: If extraction failed in the child (e.g. an unreadable PDF).
+    """
+    hard_limit = doc_timeout + kill_grace if doc_timeout else None
+    command = [sys.executable, os.path.abspath(__file__), pdf_path, json.dumps(dict(kwargs, doc_timeout=doc_timeout))]
+    try:
+        child = subprocess.run(command, capture_output=True, timeout=hard_limit)
+    except subprocess.TimeoutExpired:
+        warning = f"Extraction killed: exceeded the hard limit of {hard_limit:g}s"
+        return {"text": "", "pages": 0, "total_pages": 0, "truncated": True, "warnings": [warning], "backends": {}}
+    if child.returncode != 0:
+        lines = child.stderr.decode("utf-8", errors="replace").strip().splitlines()
+        raise RuntimeError(lines[-1] if lines else f"PDF extraction exited with code {child.returncode}")
+    return json.loads(child.stdout)
+
+
+if __name__ == "__main__":
+    # Child side of extract_pdf_text_isolated: argv = pdf path, JSON keyword arguments
+    result = extract_pdf_text_bounded(sys.argv[1], **json.loads(sys.argv[2]))
+    sys.stdout.write(json.dumps(result))
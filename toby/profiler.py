@@ -0,0 +1,164 @@
+"""
+Opt-in, sampled request profiling for the API server.
+
+A request is profiled when it wins the PROFILE_SAMPLE_RATE draw, or when it carries
+the header `X-Profile: <PROFILE_TOKEN>`. While it runs, a sampler thread snapshots
+every thread's Python stack (statistical CPU/wall profile), and span() blocks in the
+code record a wall-clock timeline. Each profile is written to PROFILE_DIR as
+
+    <id>.folded   folded stacks ("process-wide;thread;file:func;file:func count"),
+                  ready for flamegraph.pl or speedscope
+    <id>.json     request metadata and the span timeline
+
+The stacks are process-wide: Python cannot tell which request a thread or the event
+loop is serving at a given instant, so requests running concurrently and background
+threads appear in them too. Only the span timeline belongs to this request alone;
+the .json says so ("stacks_scope") and counts the threads sampled.
+
+and only the newest PROFILE_MAX_FILES profiles are kept. With profiling off, span()
+is one context-variable lookup and the middleware one random draw.
+
+Configure with:
+    PROFILE_SAMPLE_RATE=0.01   PROFILE_TOKEN=secret   PROFILE_DIR=/tmp/toby_profiles
+    PROFILE_MAX_FILES=50       PROFILE_INTERVAL=0.005
+"""
+
+import contextvars
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import nullcontext
+
+
+SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "toby_profiles"))
+MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "50"))
+INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+MAX_DEPTH = 128
+
+_active = contextvars.ContextVar("active_profile", default=None)
+_NULL_SPAN = nullcontext()
+
+
+def should_profile(header_value=None):
+    """True if this request should be profiled (privileged header or sampling draw)."""
+    if PROFILE_TOKEN and header_value == PROFILE_TOKEN:
+        return True
+    return SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE
+
+
+class _Span:
+    __slots__ = ("profile", "name", "started")
+
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        ended = time.perf_counter()
+        self.profile.spans.append({
+            "name": self.name,
+            "thread": threading.current_thread().name,
+            "start_ms": round((self.started - self.profile.started) * 1000, 3),
+            "duration_ms": round((ended - self.started) * 1000, 3),
+        })
+        return False
+
+
+def span(name):
+    """Times a block into the active request's timeline; a no-op when not profiling."""
+    profile = _active.get()
+    return _NULL_SPAN if profile is None else _Span(profile, name)
+
+
+class RequestProfile:
+    """Sampler thread plus span timeline for one request."""
+
+    def __init__(self, label, interval=INTERVAL):
+        # Sortable by start time, so the ring can drop the oldest by name
+        self.id = f"{time.strftime('%Y%m%d-%H%M%S')}-{int(time.time() * 1000) % 1000:03d}-{uuid.uuid4().hex[:8]}"
+        self.label = label
+        self.interval = interval
+        self.stacks = Counter()
+        self.spans = []
+        self.samples = 0
+        self.threads_sampled = set()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name="profiler", daemon=True)
+        self._token = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        self._token = _active.set(self)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        _active.reset(self._token)
+        self.duration_ms = (time.perf_counter() - self.started) * 1000
+        return False
+
+    def _sample(self):
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_DEPTH:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                stack.append("process-wide")
+                self.threads_sampled.add(ident)
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def save(self, directory=PROFILE_DIR, max_files=MAX_FILES):
+        """Writes the .folded and .json files and trims the ring to max_files profiles."""
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, self.id)
+        folded = "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+        meta = {
+            "id": self.id,
+            "label": self.label,
+            "duration_ms": round(self.duration_ms, 3),
+            "samples": self.samples,
+            "interval_s": self.interval,
+            "stacks_scope": "process-wide: every thread's stack, including other requests in flight",
+            "threads_sampled": len(self.threads_sampled),
+            "spans": sorted(self.spans, key=lambda s: s["start_ms"]),
+        }
+        for path, content in ((base + ".folded", folded), (base + ".json", json.dumps(meta, indent=2))):
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                f.write(content)
+            os.replace(path + ".tmp", path)
+        _trim_ring(directory, max_files)
+        return base
+
+
+def _trim_ring(directory, max_files):
+    profiles = sorted(name[:-5] for name in os.listdir(directory) if name.endswith(".json"))
+    for stale in profiles[:max(len(profiles) - max_files, 0)]:
+        for suffix in (".json", ".folded"):
+            try:
+                os.remove(os.path.join(directory, stale + suffix))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,177 @@
+"""
+Cross-process token-bucket rate limiter for Gemini calls.
+
+Every uvicorn worker opens the same SQLite file, so requests-per-minute and
+tokens-per-minute quotas are shared by the whole host instead of being exceeded
+N times over. Callers queue in FIFO order (a ticket table) rather than failing,
+so throughput stays pinned at the quota without 429 storms. Waiters refresh their
+ticket every heartbeat; a ticket left by a dead process expires after ticket_ttl
+seconds (a few heartbeats), so it cannot hold up the queue for long.
+
+Configure with:
+    GEMINI_RPM=...  GEMINI_TPM=...        (0 or unset disables that bucket)
+    GEMINI_RATE_LIMIT_DB=/tmp/gemini_rate_limit.db
+"""
+
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+
+# Rough prompt-size estimate used for the tokens bucket (~4 characters per token)
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text):
+    """Approximate token count of a prompt."""
+    return max(1, len(text or "") // CHARS_PER_TOKEN)
+
+
+class TokenBucketLimiter:
+    """
+    Two token buckets (requests and tokens) stored in a SQLite file shared by all processes.
+
+    Each bucket holds up to one minute of quota and refills continuously at quota/60 per
+    second. acquire() blocks until the caller is first in line and both buckets can cover
+    the request, then deducts it atomically (BEGIN IMMEDIATE serialises processes).
+    """
+
+    def __init__(self, path, requests_per_minute=0, tokens_per_minute=0, poll_interval=0.05, heartbeat=1.0,
+                 ticket_ttl=5.0):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.heartbeat = heartbeat  # Longest sleep between ticket refreshes
+        self.ticket_ttl = ticket_ttl  # Tickets not refreshed for this long belong to dead processes
+        self.quotas = {"requests": requests_per_minute, "tokens": tokens_per_minute}
+        self._local = threading.local()
+        self.stats = {"acquired": 0, "waited_seconds": 0.0, "timed_out": 0, "released": 0}
+
+        conn = self._conn()
+        with conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, level REAL, updated REAL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS tickets (id INTEGER PRIMARY KEY AUTOINCREMENT, seen REAL)")
+            now = time.time()
+            for name, quota in self.quotas.items():
+                conn.execute("INSERT OR IGNORE INTO buckets (name, level, updated) VALUES (?, ?, ?)", (name, quota, now))
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _refill(self, conn, now):
+        levels = {}
+        for name, level, updated in conn.execute("SELECT name, level, updated FROM buckets"):
+            quota = self.quotas.get(name, 0)
+            if quota:
+                levels[name] = min(quota, level + (now - updated) * quota / 60.0)
+        return levels
+
+    def _cost(self, tokens):
+        return {"requests": 1, "tokens": min(tokens, self.quotas["tokens"]) if self.quotas["tokens"] else 0}
+
+    def acquire(self, tokens=1, timeout=None):
+        """
+        Blocks until one request of `tokens` estimated tokens fits the quotas.
+
+        A request larger than the whole tokens-per-minute quota is clipped to it, so it
+        waits for a full bucket instead of waiting forever.
+
+        Args:
+            tokens: Estimated prompt tokens.
+            timeout: Give up (and leave the queue) after this many seconds.
+
+        Returns:
+            float: Seconds spent waiting.
+
+        Raises:
+            TimeoutError: If timeout elapses before the quota admits the request.
+        """
+        if not any(self.quotas.values()):
+            return 0.0
+
+        started = time.time()
+        need = self._cost(tokens)
+        conn = self._conn()
+        ticket = conn.execute("INSERT INTO tickets (seen) VALUES (?)", (started,)).lastrowid
+
+        try:
+            while True:
+                wait = self.poll_interval
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    now = time.time()
+                    if not conn.execute("UPDATE tickets SET seen = ? WHERE id = ?", (now, ticket)).rowcount:
+                        # Expired while this process was stalled: take the same place in line again
+                        conn.execute("INSERT INTO tickets (id, seen) VALUES (?, ?)", (ticket, now))
+                    conn.execute("DELETE FROM tickets WHERE seen < ?", (now - self.ticket_ttl,))
+                    head = conn.execute("SELECT MIN(id) FROM tickets").fetchone()[0]
+                    if head == ticket:
+                        levels = self._refill(conn, now)
+                        deficits = [
+                            (need[name] - level) * 60.0 / self.quotas[name]
+                            for name, level in levels.items() if level < need[name]
+                        ]
+                        if not deficits:
+                            for name, level in levels.items():
+                                conn.execute("UPDATE buckets SET level = ?, updated = ? WHERE name = ?",
+                                             (level - need[name], now, name))
+                            conn.execute("DELETE FROM tickets WHERE id = ?", (ticket,))
+                            conn.execute("COMMIT")
+                            ticket = None
+                            waited = time.time() - started
+                            self.stats["acquired"] += 1
+                            self.stats["waited_seconds"] += waited
+                            return waited
+                        wait = max(max(deficits), self.poll_interval)
+                    conn.execute("COMMIT")
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+                if timeout is not None:
+                    left = started + timeout - time.time()
+                    if left <= 0:
+                        self.stats["timed_out"] += 1
+                        raise TimeoutError(f"Gemini quota wait exceeded {timeout:.1f}s")
+                    wait = min(wait, left)
+                # Sleep in heartbeat slices so the ticket stays fresh during long waits
+                time.sleep(min(wait, self.heartbeat))
+        finally:
+            if ticket is not None:
+                conn.execute("DELETE FROM tickets WHERE id = ?", (ticket,))
+
+    def release(self, tokens=1):
+        """
+        Returns the quota taken by acquire(tokens) for a request that was never sent
+        (e.g. cancelled while waiting), up to a full bucket.
+        """
+        if not any(self.quotas.values()):
+            return
+        give = self._cost(tokens)
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            for name, level in self._refill(conn, now).items():
+                conn.execute("UPDATE buckets SET level = ?, updated = ? WHERE name = ?",
+                             (min(self.quotas[name], level + give[name]), now, name))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self.stats["released"] += 1
+
+
+def create_rate_limiter():
+    """Builds the shared limiter from the environment, or None if no quota is configured."""
+    rpm = int(os.getenv("GEMINI_RPM", "0"))
+    tpm = int(os.getenv("GEMINI_TPM", "0"))
+    if not rpm and not tpm:
+        return None
+    path = os.getenv("GEMINI_RATE_LIMIT_DB", os.path.join(tempfile.gettempdir(), "gemini_rate_limit.db"))
+    return TokenBucketLimiter(path, requests_per_minute=rpm, tokens_per_minute=tpm)
@@ -0,0 +1,253 @@
+"""
+Rules registry keyed by HS chapter: chapter notes and code lists loaded on demand and
+cached, plus a cheap keyword pre-pass that picks the chapters a product is likely to
+fall in, so broader coverage does not make every prompt bigger.
+"""
+
+from functools import lru_cache
+import math
+import re
+
+from taricData import code_chapters, code_headings, get_chapters, get_prefix_codes, prefix_texts
+
+
+# Embedded EU TARIC Chapter 30 rules (used when PDF not available)
+EMBEDDED_TARIC_RULES = """
+=== EU TARIC CHAPTER 30: PHARMACEUTICAL PRODUCTS ===
+
+CHAPTER NOTES:
+1. This chapter does NOT cover:
+   (a) Foods or beverages (Chapter 21, 22), food supplements (heading 2106)
+   (b) Plasters specially calcined for dentistry (heading 2520)
+   (c) Aqueous distillates of essential oils (heading 3301)
+   (d) Preparations of headings 3303 to 3307
+   (e) Soap containing medicaments (heading 3401)
+   (f) Preparations with basis of plaster for dentistry (heading 3407)
+   (g) Blood albumin not for therapeutic/prophylactic use (heading 3502)
+
+2. For heading 3002:
+   - Includes immunological products (vaccines, toxins, cultures of micro-organisms)
+   - Monoclonal antibodies are classified here
+   - Blood fractions and modified immunological products
+
+3. For headings 3003 and 3004:
+   - 3003: Medicaments not put up in measured doses or retail packing
+   - 3004: Medicaments put up in measured doses or retail packing
+
+HEADING STRUCTURE:
+- 3001: Glands and organs; extracts thereof
+- 3002: Human/animal blood; antisera; vaccines; toxins; cultures
+  - 3002.12: Antisera and blood fractions
+  - 3002.13: Immunological products, unmixed
+  - 3002.14: Immunological products, mixed
+  - 3002.15: Immunological products, put up in measured doses or retail
+  - 3002.41: Vaccines for human medicine
+  - 3002.42: Vaccines for veterinary medicine
+  - 3002.49: Toxins, cultures
+  - 3002.90: Other
+- 3003: Medicaments (not retail)
+- 3004: Medicaments (retail)
+  - 3004.10: Containing penicillins/streptomycins
+  - 3004.20: Containing other antibiotics
+  - 3004.31-39: Containing hormones
+  - 3004.41-49: Containing alkaloids
+  - 3004.50: Containing vitamins
+  - 3004.60: Containing antimalarial active principles
+  - 3004.90: Other
+- 3005: Wadding, bandages, dressings
+- 3006: Pharmaceutical goods (sutures, blood-grouping reagents, etc.)
+
+GENERAL INTERPRETIVE RULES (GIRs):
+GIR 1: Classification determined by terms of headings and Section/Chapter Notes
+GIR 2(a): Incomplete/unfinished articles classified with complete articles
+GIR 2(b): Mixtures classified as if consisting of single material
+GIR 3(a): Most specific description preferred
+GIR 3(b): Mixtures/composite goods - essential character determines classification
+GIR 3(c): Last in numerical order if (a) and (b) fail
+GIR 5: Packing materials classified with contents (packaging doesn't change classification)
+GIR 6: Subheading classification follows same rules
+
+COMMON CLASSIFICATIONS:
+- Monoclonal antibodies (pembrolizumab, nivolumab, etc.): 3002.15.00.00
+- Vaccines for human medicine: 3002.41.00.00
+- Insulin preparations: 3004.31.00.00
+- Antibiotics (retail): 3004.20.00.00
+- General pharmaceuticals (retail, NES): 3004.90.00.00
+"""
+
+
+# Chapter notes for the other chapters seeded by setup_taric_db.py (summaries of the
+# official notes, focused on the boundaries with Chapter 30)
+CHAPTER_NOTES = {
+    "21": """CHAPTER NOTES:
+1. Heading 2106 covers food preparations not elsewhere specified or included, including
+   food supplements based on vitamins, minerals, proteins or plant extracts.
+2. This chapter does NOT cover medicaments of heading 3003 or 3004: preparations with a
+   therapeutic or prophylactic purpose, dosage and indication belong in Chapter 30.""",
+    "29": """CHAPTER NOTES:
+1. Chapter 29 covers separate chemically defined organic compounds, whether or not
+   containing impurities, and their salts, esters and derivatives.
+2. Vitamins and provitamins (2936), hormones (2937), alkaloids (2939) and antibiotics (2941)
+   are classified here only as bulk substances.
+3. This chapter does NOT cover goods mixed with other substances or put up in measured
+   doses or for retail sale as medicaments (headings 3003 / 3004).""",
+    "38": """CHAPTER NOTES:
+1. Heading 3821 covers prepared culture media for micro-organisms or cells.
+2. Heading 3822 covers diagnostic or laboratory reagents on a backing, prepared diagnostic
+   or laboratory reagents and certified reference materials, other than those of heading
+   3002 (immunological products) or 3006 (blood-grouping reagents, reagents for patient administration).""",
+    "90": """CHAPTER NOTES:
+1. Chapter 90 covers medical, surgical, dental and veterinary instruments and apparatus
+   (9018), therapy and respiration apparatus (9019-9020), orthopaedic appliances and
+   implants (9021) and X-ray / radiation apparatus (9022).
+2. This chapter does NOT cover articles of heading 3005 or 3006 (dressings, sutures,
+   ostomy appliances, first-aid kits) or the pharmaceutical products used with the apparatus.""",
+}
+
+# Extra pre-pass vocabulary that code descriptions do not spell out
+CHAPTER_KEYWORDS = {
+    "21": "supplement dietary nutritional food protein powder capsule gummy",
+    "29": "api bulk substance compound chemically defined salt ester intermediate",
+    "30": "medicament medicine drug tablet capsule injection infusion vial dose retail "
+          "antibody monoclonal vaccine insulin antibiotic pharmaceutical therapeutic prophylactic",
+    "38": "reagent diagnostic laboratory assay kit culture medium test strip",
+    "90": "device instrument apparatus syringe needle catheter implant scanner prosthesis",
+}
+
+# Chapters always included: the classifier is built around Chapter 30 and its exclusion notes
+ANCHOR_CHAPTERS = ["30"]
+
+_WORD = re.compile(r"[a-z][a-z0-9-]{2,}")
+_STOPWORDS = {"and", "the", "for", "with", "other", "not", "its", "whether", "than", "used", "from", "put", "containing"}
+
+
+def _tokens(text):
+    return {word for word in _WORD.findall((text or "").lower()) if word not in _STOPWORDS}
+
+
+@lru_cache(maxsize=None)
+def get_chapter_rules(chapter):
+    """
+    Rules for one chapter, loaded on first use and cached.
+
+    Args:
+        chapter: 2-digit chapter string, e.g. "30".
+
+    Returns:
+        dict: {"chapter", "title", "notes", "codes", "headings", "rules_text"}, or None
+              if the registry has no codes for the chapter.
+    """
+    codes = get_prefix_codes(chapter)
+    if not codes:
+        return None
+    title = get_chapters().get(chapter, {}).get("title", "")
+
+    if chapter == "30":
+        notes = EMBEDDED_TARIC_RULES.split("HEADING STRUCTURE:")[0].strip()
+        rules_text = EMBEDDED_TARIC_RULES
+    else:
+        notes = CHAPTER_NOTES.get(chapter, "")
+        code_lines = "\n".join(f"- {code['code']}: {code['description']}" for code in codes)
+        rules_text = f"\n=== EU TARIC CHAPTER {chapter}: {title.upper()} ===\n\n{notes}\n\nCODES:\n{code_lines}\n"
+
+    return {
+        "chapter": chapter,
+        "title": title,
+        "notes": notes,
+        "codes": codes,
+        "headings": sorted({code["heading"] for code in codes}),
+        "rules_text": rules_text,
+    }
+
+
+@lru_cache(maxsize=1)
+def registry_chapters():
+    """Chapters that have codes in the registry."""
+    return code_chapters()
+
+
+@lru_cache(maxsize=1)
+def valid_headings():
+    """Every 4-digit heading in the registry (used by validateHsCode)."""
+    return frozenset(code_headings())
+
+
+@lru_cache(maxsize=1)
+def _keyword_index():
+    """token -> {chapter: weight}, IDF-weighted so words shared by every chapter count little."""
+    chapter_tokens = {}
+    for chapter in code_chapters():
+        words = chapter_tokens.setdefault(chapter, set())
+        for text in prefix_texts(chapter):
+            words.update(_tokens(text))
+    for chapter, words in CHAPTER_KEYWORDS.items():
+        chapter_tokens.setdefault(chapter, set()).update(_tokens(words))
+
+    index = {}
+    total = len(chapter_tokens)
+    for chapter, words in chapter_tokens.items():
+        for word in words:
+            index.setdefault(word, {})[chapter] = 0.0
+    for word, chapters in index.items():
+        weight = math.log(1 + total / len(chapters))
+        for chapter in chapters:
+            chapters[chapter] = weight
+    return index
+
+
+def select_chapters(text, max_extra=1, min_share=0.25):
+    """
+    Keyword pre-pass: the chapters most likely to be relevant to a product.
+
+    Args:
+        text: Product spec text and/or product data.
+        max_extra: Chapters to add on top of ANCHOR_CHAPTERS.
+        min_share: Ignore chapters scoring below this fraction of the best score.
+
+    Returns:
+        list: ANCHOR_CHAPTERS followed by the best-scoring other chapters.
+    """
+    index = _keyword_index()
+    scores = {}
+    for word in _tokens(text):
+        for chapter, weight in index.get(word, {}).items():
+            scores[chapter] = scores.get(chapter, 0.0) + weight
+    if not scores:
+        return list(ANCHOR_CHAPTERS)
+    best = max(scores.values())
+    ranked = sorted(scores, key=lambda chapter: (-scores[chapter], chapter))
+    extra = [chapter for chapter in ranked if chapter not in ANCHOR_CHAPTERS and scores[chapter] >= best * min_share]
+    return list(ANCHOR_CHAPTERS) + extra[:max_extra]
+
+
+def render_rules(chapters):
+    """Prompt block with the rules of the given chapters."""
+    return "\n".join(get_chapter_rules(chapter)["rules_text"] for chapter in chapters if get_chapter_rules(chapter))
+
+
+def keyword_lookup(text, chapters=None):
+    """
+    Best registry code for a product by keyword overlap alone (no LLM): the code in
+    the pre-pass chapters whose description words are most covered by the text,
+    IDF-weighted like select_chapters.
+
+    Returns:
+        tuple: (code dict, score in [0, 1]), or (None, 0.0) if no description word matches.
+    """
+    words = _tokens(text)
+    index = _keyword_index()
+
+    def weight(word):
+        return max(index.get(word, {}).values(), default=1.0)
+
+    best, best_score = None, 0.0
+    for chapter in chapters or select_chapters(text):
+        rules = get_chapter_rules(chapter)
+        for code in rules["codes"] if rules else []:
+            code_words = _tokens(code["description"] + " " + code.get("description_short", ""))
+            if not code_words & words:
+                continue
+            score = sum(weight(w) for w in code_words & words) / sum(weight(w) for w in code_words)
+            if score > best_score:
+                best, best_score = code, score
+    return best, best_score
@@ -0,0 +1,216 @@
+"""
+Parses Safety Data Sheet (SDS) text into its 16 standard sections and pulls out
+the fields the classifier cares about: CAS numbers, composition and hazard statements.
+Only the sections relevant to classification (1, 2, 3, 9 and 14) are passed on to the LLM.
+"""
+
+import re
+
+
+# Standard (EU REACH Annex II / GHS) SDS section titles, used to recognise headings
+SDS_SECTION_TITLES = {
+    1: "Identification",
+    2: "Hazards identification",
+    3: "Composition / information on ingredients",
+    4: "First-aid measures",
+    5: "Fire-fighting measures",
+    6: "Accidental release measures",
+    7: "Handling and storage",
+    8: "Exposure controls / personal protection",
+    9: "Physical and chemical properties",
+    10: "Stability and reactivity",
+    11: "Toxicological information",
+    12: "Ecological information",
+    13: "Disposal considerations",
+    14: "Transport information",
+    15: "Regulatory information",
+    16: "Other information",
+}
+
+# Sections forwarded to the LLM: identity, hazards, composition, physical form, transport
+RELEVANT_SECTIONS = [1, 2, 3, 9, 14]
+
+# Fewer recognised headings than this and the text is treated as a plain spec sheet, not an SDS
+MIN_SDS_SECTIONS = 3
+
+# First keyword of each standard title, so "3. COMPOSITION" is accepted without the word "Section"
+_TITLE_KEYWORDS = r"identification|hazard|composition|first|fire|accidental|handling|exposure|physical|stability|toxicolog|ecolog|disposal|transport|regulatory|other"
+
+_SECTION_HEADING = re.compile(
+    r"^\s*(?:section|abschnitt|rubrique)\s*(\d{1,2})\b"
+    r"|^\s*(\d{1,2})\s*[.:)]?\s+(?=(?:" + _TITLE_KEYWORDS + r"))",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+_CAS_NUMBER = re.compile(r"\b(\d{2,7})-(\d{2})-(\d)\b")
+
+# The phrase stays on the code's line and stops at the next code, so "H302 H315" on
+# one line (or a bare code list) yields two statements, not one with the other as text
+_HAZARD_STATEMENT = re.compile(
+    r"\b((?:EUH|H)\d{3}(?:[ \t]*\+[ \t]*H\d{3})*)\b[ \t]*[:\-–]?[ \t]*((?:(?!\b(?:EUH|H)\d{3}\b)[^\n|])*)")
+
+_CONCENTRATION = re.compile(r"(?:[<>≤≥]=?\s*)?\d+(?:[.,]\d+)?\s*(?:[-–]\s*[<>≤≥]?\s*\d+(?:[.,]\d+)?\s*)?%")
+
+
+def is_valid_cas(cas):
+    """
+    Checks a CAS registry number against its check digit.
+
+    Args:
+        cas: CAS number string such as "7732-18-5".
+
+    Returns:
+        bool: True if the format and checksum are valid.
+    """
+    match = _CAS_NUMBER.fullmatch(cas.strip())
+    if not match:
+        return False
+    digits = match.group(1) + match.group(2)
+    total = sum(int(d) * i for i, d in enumerate(reversed(digits), start=1))
+    return total % 10 == int(match.group(3))
+
+
+def text_from_page_records(records):
+    """
+    Flattens read_pdf page records ({"tables": [...], "text": ...}) into SDS text.
+    Table rows are joined with " | " so composition rows keep name, CAS and concentration together.
+    """
+    parts = []
+    for record in records:
+        if record.get("text"):
+            parts.append(record["text"])
+        for table in record.get("tables", []):
+            for row in table:
+                parts.append(" | ".join(cell.replace("\n", " ") for cell in row))
+    return "\n".join(parts)
+
+
+def split_sections(text):
+    """
+    Splits SDS text into its numbered sections.
+
+    Headings must appear in increasing order, which filters out numbered lists
+    inside a section (e.g. "1. Wash with water" under First-aid measures).
+
+    Args:
+        text: Raw SDS text.
+
+    Returns:
+        dict: {section number: section body}. Empty if no headings were found.
+    """
+    sections = {}
+    current = None
+    start = 0
+    for match in _SECTION_HEADING.finditer(text):
+        number = int(match.group(1) or match.group(2))
+        if not 1 <= number <= 16 or (current is not None and number <= current):
+            continue
+        if current is not None:
+            sections[current] = text[start:match.start()].strip(" \t\r\n:.-–")
+        current = number
+        start = match.end()
+    if current is not None:
+        sections[current] = text[start:].strip(" \t\r\n:.-–")
+    return sections
+
+
+def extract_cas_numbers(text):
+    """Returns the checksum-valid CAS numbers in the text, in order of first appearance."""
+    seen = []
+    for match in _CAS_NUMBER.finditer(text):
+        cas = match.group(0)
+        if cas not in seen and is_valid_cas(cas):
+            seen.append(cas)
+    return seen
+
+
+def extract_composition(text):
+    """
+    Extracts composition entries from SDS section 3 text.
+
+    Each line (or table row) that carries a valid CAS number becomes one entry,
+    e.g. "Ethanol (CAS 64-17-5) 10-20 %".
+
+    Returns:
+        list: Composition strings.
+    """
+    entries = []
+    for line in text.splitlines():
+        cas_match = next((m for m in _CAS_NUMBER.finditer(line) if is_valid_cas(m.group(0))), None)
+        if not cas_match:
+            continue
+        name = line[:cas_match.start()].replace("|", " ")
+        name = re.sub(r"\b(?:CAS(?:\s*(?:No\.?|number|-Nr\.?))?|EC(?:\s*No\.?)?)\s*[:.]?\s*$", "", name.strip(), flags=re.IGNORECASE)
+        name = re.sub(r"\s+", " ", name).strip(" :;,-")
+        concentration = _CONCENTRATION.search(line[cas_match.end():]) or _CONCENTRATION.search(line)
+        entry = f"{name} (CAS {cas_match.group(0)})" if name else f"CAS {cas_match.group(0)}"
+        if concentration:
+            entry += f" {concentration.group(0).strip()}"
+        if entry not in entries:
+            entries.append(entry)
+    return entries
+
+
+def extract_hazard_statements(text):
+    """
+    Returns GHS/CLP hazard statements ("H302: Harmful if swallowed.") found in the text,
+    each once, in order of appearance. A combined statement ("H300+H310+H330: ...")
+    replaces the separate statements of its codes, so no code is listed twice.
+    """
+    found = []
+    for match in _HAZARD_STATEMENT.finditer(text):
+        code = re.sub(r"\s+", "", match.group(1))
+        phrase = match.group(2).strip()
+        found.append((frozenset(code.split("+")), f"{code}: {phrase}" if phrase else code))
+
+    statements = []
+    for index, (codes, statement) in enumerate(found):
+        covered = any(codes < other or (codes == other and earlier < index)
+                      for earlier, (other, _) in enumerate(found))
+        if not covered:
+            statements.append(statement)
+    return statements
+
+
+def relevant_sections_text(sections, numbers=RELEVANT_SECTIONS):
+    """Joins the requested sections back into prompt text, each under a "SECTION n:" heading."""
+    parts = []
+    for number in numbers:
+        body = sections.get(number)
+        if body:
+            parts.append(f"SECTION {number}: {body}")
+    return "\n\n".join(parts)
+
+
+def parse_sds(text):
+    """
+    Parses SDS text into sections and classification fields.
+
+    Args:
+        text: Extracted SDS text (see text_from_page_records for table input).
+
+    Returns:
+        dict: {
+            "sections": {number: body},
+            "cas_numbers": [...],
+            "chemical_composition": [...],
+            "safety_warnings": [...],
+            "relevant_text": text of sections 1, 2, 3, 9 and 14, or the original
+                             text when the document is not a recognisable SDS
+        }
+    """
+    text = text or ""
+    sections = split_sections(text)
+    if len(sections) < MIN_SDS_SECTIONS:
+        sections = {}
+
+    composition_text = sections.get(3, text)
+    hazards_text = sections.get(2, text)
+
+    return {
+        "sections": sections,
+        "cas_numbers": extract_cas_numbers(composition_text) or extract_cas_numbers(text),
+        "chemical_composition": extract_composition(composition_text),
+        "safety_warnings": extract_hazard_statements(hazards_text),
+        "relevant_text": relevant_sections_text(sections) or text,
+    }
@@ -3,19 +3,57 @@ FastAPI server that exposes the buildPrompt classification logic.
 Run with: uvicorn server:app --reload --port 8000
 """
 
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, BackgroundTasks, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Optional, List
+from fastapi.responses import StreamingResponse
+from contextlib import asynccontextmanager
+from typing import Optional
+import math
 import tempfile
+import asyncio
+import codecs
 import os
 
-from buildPrompt import runPrompt, extract_pdf_text, BIO_CLASSIFY_SYSTEM_PROMPT
+from buildPrompt import (runPromptAsync, runConsensusAsync, runHierarchical, getParseStats, getRoutingStats, getCoalescingStats,
+                         degradedClassification, DEGRADED_MAX_CONFIDENCE, BIO_CLASSIFY_SYSTEM_PROMPT)
+from callLLM2 import CASSETTE_STATS, LLM_MODE
+from deadline import DeadlineExceeded, LoadShedder, Overloaded, budget, deadline_scope, parse_deadline, remaining
+from models import ClassificationRequest, ClassificationResponse, build_product_data
+from invoicePipeline import InvoiceClassifier, stream_invoice_csv
+from historyWriter import create_history_writer, history_row
+from nearDuplicate import create_near_duplicate_index
+from pdfExtract import DOC_TIMEOUT, extract_pdf_text_isolated
+from profiler import RequestProfile, should_profile, span
+from sdsParser import parse_sds
+
+# Write-behind audit trail (classification_history); None when HISTORY_BACKEND=none
+history_writer = create_history_writer()
+
+# MinHash/LSH index of past classifications for reusing near-duplicate sheets; None when NEAR_DUP=off
+near_duplicates = create_near_duplicate_index()
+
+# Admission control: rejects requests that would miss their deadline waiting in the queue
+load_shedder = LoadShedder()
+
+# Lowest near-duplicate similarity accepted for a degraded answer (the normal reuse threshold is stricter)
+DEGRADED_SIMILARITY = float(os.getenv("DEGRADED_SIMILARITY", "0.5"))
+degraded_stats = {"near_duplicate": 0, "keyword_lookup": 0}
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if history_writer:
+        history_writer.start()
+    yield
+    if history_writer:
+        history_writer.stop()  # Drain queued rows before exit
+
 
 app = FastAPI(
     title="Easy Ship AI Backend",
     description="AI-powered pharmaceutical HS/TARIC classification",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Allow CORS for frontend
@@ -28,59 +66,47 @@ app.add_middleware(
 )
 
 
-class ClassificationRequest(BaseModel):
-    extracted_text: str
-    product_description: str
-    cas_numbers: Optional[List[str]] = []
-    active_ingredients: Optional[List[str]] = []
-    safety_warnings: Optional[List[str]] = []
-    chemical_composition: Optional[List[str]] = []
-    formulation: Optional[List[str]] = []
-    packaging: Optional[List[str]] = []
-    therapeutic_use: Optional[List[str]] = []
-    manufacturer: Optional[str] = None
-    storage: Optional[str] = None
-
-
-class ClassificationResponse(BaseModel):
-    hs_code: str
-    confidence: float
-    confidence_reasoning: str
-    memo: str
-    partial_accuracy: str
-    six_digit_match: str
-    sources: List[str] = []
-    validation_warning: Optional[str] = None
+@app.middleware("http")
+async def profile_requests(request: Request, call_next):
+    """
+    Sampled profiling (PROFILE_SAMPLE_RATE, or `X-Profile: <PROFILE_TOKEN>`): stack
+    samples and the span timeline are written to the on-disk profile ring.
+    """
+    if not should_profile(request.headers.get("x-profile")):
+        return await call_next(request)
+    with RequestProfile(f"{request.method} {request.url.path}") as profile:
+        response = await call_next(request)
+    await asyncio.to_thread(profile.save)
+    response.headers["X-Profile-Id"] = profile.id
+    return response
 
 
 # Path to EU TARIC PDF (adjust as needed)
 TARIC_PDF_PATH = os.path.join(os.path.dirname(__file__), "EU TARIC PDF.pdf")
 
 
-def build_product_data(req: ClassificationRequest) -> str:
-    """Build product data string from request fields."""
-    parts = [f"Product Description: {req.product_description}"]
-    
-    if req.cas_numbers:
-        parts.append(f"CAS Numbers: {', '.join(req.cas_numbers)}")
-    if req.active_ingredients:
-        parts.append(f"Active Ingredients: {', '.join(req.active_ingredients)}")
-    if req.chemical_composition:
-        parts.append(f"Chemical Composition: {', '.join(req.chemical_composition)}")
-    if req.safety_warnings:
-        parts.append(f"Safety Warnings: {', '.join(req.safety_warnings)}")
-    if req.formulation:
-        parts.append(f"Formulation: {', '.join(req.formulation)}")
-    if req.packaging:
-        parts.append(f"Packaging: {', '.join(req.packaging)}")
-    if req.therapeutic_use:
-        parts.append(f"Therapeutic Use: {', '.join(req.therapeutic_use)}")
-    if req.manufacturer:
-        parts.append(f"Manufacturer: {req.manufacturer}")
-    if req.storage:
-        parts.append(f"Storage: {req.storage}")
-    
-    return "\n".join(parts)
+def apply_sds_fields(req: ClassificationRequest) -> str:
+    """
+    Parses the extracted text as a Safety Data Sheet, fills empty CAS / composition /
+    safety fields on the request from it, and returns the text to send to the LLM
+    (only the classification-relevant SDS sections when the text is an SDS).
+    """
+    with span("sds_parse"):
+        sds = parse_sds(req.extracted_text or "")
+    if not req.cas_numbers:
+        req.cas_numbers = sds["cas_numbers"]
+    if not req.chemical_composition:
+        req.chemical_composition = sds["chemical_composition"]
+    if not req.safety_warnings:
+        req.safety_warnings = sds["safety_warnings"]
+    return sds["relevant_text"]
+
+
+def record_history(req: ClassificationRequest, result: dict):
+    """Queues the result for classification_history (off the request path)."""
+    if history_writer:
+        extracted_data = req.model_dump(exclude={"extracted_text", "consensus_k", "hierarchical", "reuse", "revalidate"})
+        history_writer.submit(history_row(req.product_description, result, extracted_data))
 
 
 @app.get("/health")
@@ -89,42 +115,138 @@ async def health_check():
     return {"status": "ok", "taric_pdf_available": os.path.exists(TARIC_PDF_PATH)}
 
 
+@app.get("/metrics")
+async def metrics():
+    """Process-local counters: LLM response parse outcomes (decoded / repaired / fallback), model routing, request coalescing, load shedding and degraded answers."""
+    return {
+        "parse": getParseStats(),
+        "routing": getRoutingStats(),
+        "coalescing": getCoalescingStats(),
+        "llm": {"mode": LLM_MODE, "cassettes": CASSETTE_STATS},
+        "load": load_shedder.snapshot(),
+        "degraded": degraded_stats,
+        "history": history_writer.stats if history_writer else None,
+    }
+
+
+async def run_classification(request: ClassificationRequest, pdf_text: str, product_data: str) -> dict:
+    """Runs the requested classification mode and stores the result in the near-duplicate index."""
+    # Check if TARIC PDF exists (otherwise the embedded rules are used in the prompt)
+    taric_pdf_path = TARIC_PDF_PATH if os.path.exists(TARIC_PDF_PATH) else None
+    if request.consensus_k and request.consensus_k > 1:
+        result = await runConsensusAsync(pdf_text, product_data, k=request.consensus_k, taric_pdf_path=taric_pdf_path)
+    elif request.hierarchical:
+        result = await asyncio.to_thread(runHierarchical, pdf_text, product_data)
+    else:
+        result = await runPromptAsync(pdf_text, product_data, taric_pdf_path=taric_pdf_path)
+
+    if near_duplicates and not result.get("parse_fallback"):
+        # MinHash + SQLite insert off the event loop
+        await asyncio.to_thread(near_duplicates.add, pdf_text + "\n" + product_data, result)
+    return result
+
+
+def degraded_result(text: str, stage: str) -> dict:
+    """
+    Fast answer once the deadline has passed: the most similar previous sheet in the
+    near-duplicate index (at the looser DEGRADED_SIMILARITY), else a registry keyword
+    lookup. Confidence is capped and validation_warning set either way.
+    """
+    match = near_duplicates.query(text, threshold=DEGRADED_SIMILARITY) if near_duplicates else None
+    if not match:
+        degraded_stats["keyword_lookup"] += 1
+        return degradedClassification(text, stage)
+    previous, similarity = match
+    degraded_stats["near_duplicate"] += 1
+    return {
+        **previous,
+        "confidence": round(min(previous.get("confidence", 0.0) * similarity, DEGRADED_MAX_CONFIDENCE), 3),
+        "validation_warning": (f"Degraded answer: the request deadline passed ({stage}); {previous.get('hs_code')} "
+                               f"is the code of a previous sheet {similarity:.0%} similar to this one and must be verified."),
+        "degraded": True,
+    }
+
+
+async def answer_within_deadline(classification, text: str) -> dict:
+    """Awaits a classification coroutine until the request's deadline; past it, a degraded_result."""
+    try:
+        return await asyncio.wait_for(classification, timeout=remaining())
+    except (asyncio.TimeoutError, DeadlineExceeded) as e:
+        return await asyncio.to_thread(degraded_result, text, getattr(e, "stage", "llm_call"))
+
+
+def overloaded_error(e: Overloaded) -> HTTPException:
+    """503 for a shed request; Retry-After is one mean request time."""
+    retry_after = math.ceil(load_shedder.mean_seconds or 1)
+    return HTTPException(status_code=503, detail=f"Server overloaded: {e}", headers={"Retry-After": str(retry_after)})
+
+
+async def revalidate_reused(request: ClassificationRequest, pdf_text: str, product_data: str, reused_code: str):
+    """Background task: fresh classification for a sheet that was answered from the index."""
+    result = await run_classification(request, pdf_text, product_data)
+    record_history(request, result)
+    if result.get("hs_code") != reused_code:
+        print(f"Revalidation changed {reused_code} -> {result.get('hs_code')} for: {request.product_description[:80]}")
+
+
 @app.post("/classify", response_model=ClassificationResponse)
-async def classify_product(request: ClassificationRequest):
+async def classify_product(request: ClassificationRequest, background_tasks: BackgroundTasks,
+                           x_request_deadline: Optional[str] = Header(None)):
     """
     Classify a pharmaceutical product and return HS/TARIC code.
     Uses EU TARIC PDF for reference if available.
+    A near-duplicate of a previously classified sheet is answered from the index
+    (flagged as reused), optionally revalidated in the background.
+    The request must finish within X-Request-Deadline seconds (default REQUEST_DEADLINE):
+    past it a degraded answer is returned, and when the queue already makes that
+    impossible the request is rejected with 503.
     """
+    seconds = parse_deadline(x_request_deadline)
     try:
-        pdf_text = request.extracted_text or ""
-        product_data = build_product_data(request)
+        with load_shedder.admit(seconds), deadline_scope(seconds):
+            pdf_text = apply_sds_fields(request)
+            product_data = build_product_data(request)
         
-        # Check if TARIC PDF exists
-        if os.path.exists(TARIC_PDF_PATH):
-            result = runPrompt(pdf_text, product_data, taric_pdf_path=TARIC_PDF_PATH)
-        else:
-            # Run without TARIC PDF (will use embedded rules in prompt)
-            result = runPrompt(pdf_text, product_data, taric_pdf_path=None)
+            match = None
+            if near_duplicates and request.reuse:
+                with span("near_duplicate_lookup"):
+                    match = await asyncio.to_thread(near_duplicates.query, pdf_text + "\n" + product_data)
         
-        # Build response
-        confidence = result.get("confidence", 0.5)
-        six_digit_match = (
-            "High confidence" if confidence >= 0.85 
-            else "Medium confidence" if confidence >= 0.65 
-            else "Low confidence - verify"
-        )
+            if match:
+                result, similarity = match
+                if request.revalidate:
+                    background_tasks.add_task(revalidate_reused, request, pdf_text, product_data, result.get("hs_code"))
+            else:
+                similarity = None
+                result = await answer_within_deadline(run_classification(request, pdf_text, product_data),
+                                                      pdf_text + "\n" + product_data)
+                if not result.get("degraded"):
+                    record_history(request, result)
+        
+            # Build response
+            confidence = result.get("confidence", 0.5)
+            six_digit_match = (
+                "High confidence" if confidence >= 0.85 
+                else "Medium confidence" if confidence >= 0.65 
+                else "Low confidence - verify"
+            )
         
-        return ClassificationResponse(
-            hs_code=result.get("hs_code", "3004.90.00.00"),
-            confidence=confidence,
-            confidence_reasoning=result.get("confidence_reasoning", ""),
-            memo=result.get("legal_memo", ""),
-            partial_accuracy=f"6-digit match: {confidence * 100:.1f}%",
-            six_digit_match=six_digit_match,
-            sources=result.get("sources", []),
-            validation_warning=result.get("validation_warning"),
-        )
+            return ClassificationResponse(
+                hs_code=result.get("hs_code", "3004.90.00.00"),
+                confidence=confidence,
+                confidence_reasoning=result.get("confidence_reasoning", ""),
+                memo=result.get("legal_memo", ""),
+                partial_accuracy=f"6-digit match: {confidence * 100:.1f}%",
+                six_digit_match=six_digit_match,
+                sources=result.get("sources", []),
+                validation_warning=result.get("validation_warning"),
+                reused=match is not None,
+                reused_similarity=similarity,
+                degraded=bool(result.get("degraded")),
+            )
         
+    except Overloaded as e:
+        raise overloaded_error(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -133,49 +255,88 @@ async def classify_product(request: ClassificationRequest):
 async def classify_with_pdf(
     product_pdf: UploadFile = File(...),
     product_description: str = Form(""),
+    x_request_deadline: Optional[str] = Header(None),
 ):
     """
     Upload a product specification PDF and classify it.
-    Extracts text from the PDF and runs classification.
+    Extracts text from the PDF and runs classification, within the request deadline
+    (X-Request-Deadline, as for /classify).
     """
+    seconds = parse_deadline(x_request_deadline)
     try:
-        # Save uploaded file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-            content = await product_pdf.read()
-            tmp.write(content)
-            tmp_path = tmp.name
+        with load_shedder.admit(seconds), deadline_scope(seconds):
+            # Save uploaded file temporarily
+            with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
+                content = await product_pdf.read()
+                tmp.write(content)
+                tmp_path = tmp.name
         
-        # Extract text from uploaded PDF
-        pdf_text = extract_pdf_text(tmp_path)
-        os.unlink(tmp_path)  # Clean up temp file
+            # Extract text from uploaded PDF in a child process (bounded: partial text + warnings on
+            # pathological files; the child is killed if it outlives the document budget, which
+            # never outlasts the deadline)
+            try:
+                with span("pdf_extract"):
+                    extraction = await asyncio.to_thread(extract_pdf_text_isolated, tmp_path, doc_timeout=budget(DOC_TIMEOUT))
+            finally:
+                os.unlink(tmp_path)  # Clean up temp file
+            pdf_text = extraction["text"]
         
-        # Run classification
-        if os.path.exists(TARIC_PDF_PATH):
-            result = runPrompt(pdf_text, product_description, taric_pdf_path=TARIC_PDF_PATH)
-        else:
-            result = runPrompt(pdf_text, product_description, taric_pdf_path=None)
+            # Pull SDS fields into the product data and keep only the relevant sections
+            sds_request = ClassificationRequest(extracted_text=pdf_text, product_description=product_description)
+            prompt_text = apply_sds_fields(sds_request)
+            product_data = build_product_data(sds_request)
         
-        confidence = result.get("confidence", 0.5)
+            # Run classification (identical uploads in flight share one LLM call)
+            taric_pdf_path = TARIC_PDF_PATH if os.path.exists(TARIC_PDF_PATH) else None
+            result = await answer_within_deadline(runPromptAsync(prompt_text, product_data, taric_pdf_path=taric_pdf_path),
+                                                  prompt_text + "\n" + product_data)
+            if not result.get("degraded"):
+                record_history(sds_request, result)
         
-        return {
-            "hs_code": result.get("hs_code", "3004.90.00.00"),
-            "confidence": confidence,
-            "confidence_reasoning": result.get("confidence_reasoning", ""),
-            "memo": result.get("legal_memo", ""),
-            "partial_accuracy": f"6-digit match: {confidence * 100:.1f}%",
-            "six_digit_match": (
-                "High confidence" if confidence >= 0.85 
-                else "Medium confidence" if confidence >= 0.65 
-                else "Low confidence - verify"
-            ),
-            "sources": result.get("sources", []),
-            "extracted_text": pdf_text[:2000] + "..." if len(pdf_text) > 2000 else pdf_text,
-        }
+            confidence = result.get("confidence", 0.5)
+        
+            return {
+                "hs_code": result.get("hs_code", "3004.90.00.00"),
+                "confidence": confidence,
+                "confidence_reasoning": result.get("confidence_reasoning", ""),
+                "memo": result.get("legal_memo", ""),
+                "partial_accuracy": f"6-digit match: {confidence * 100:.1f}%",
+                "six_digit_match": (
+                    "High confidence" if confidence >= 0.85 
+                    else "Medium confidence" if confidence >= 0.65 
+                    else "Low confidence - verify"
+                ),
+                "sources": result.get("sources", []),
+                "validation_warning": "; ".join(filter(None, [result.get("validation_warning"), *extraction["warnings"]])) or None,
+                "extracted_text": pdf_text[:2000] + "..." if len(pdf_text) > 2000 else pdf_text,
+                "degraded": bool(result.get("degraded")),
+            }
         
+    except Overloaded as e:
+        raise overloaded_error(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/classify-invoice")
+async def classify_invoice(
+    invoice_csv: UploadFile = File(...),
+    concurrency: int = Form(8),
+):
+    """
+    Upload a commercial-invoice CSV and stream it back with hs_code / confidence columns.
+    Identical product lines are classified once; the response is written as windows
+    of lines complete, so memory stays bounded for large files.
+    """
+    text_stream = codecs.getreader("utf-8-sig")(invoice_csv.file)
+    classifier = InvoiceClassifier(concurrency=max(1, min(concurrency, 32)))
+    return StreamingResponse(
+        stream_invoice_csv(text_stream, classifier),
+        media_type="text/csv",
+        headers={"Content-Disposition": 'attachment; filename="classified_invoice.csv"'},
+    )
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
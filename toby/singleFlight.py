@@ -0,0 +1,70 @@
+"""
+Single-flight coalescing of identical in-flight work (asyncio).
+
+Concurrent callers with the same key share one execution: the first caller starts
+it, later callers await the same task, and everyone gets its result (or its
+exception). Nothing is cached: the key is released as soon as the call finishes,
+so the next request after it runs fresh, and a failed call is retried by whoever
+asks next.
+
+A caller that is cancelled (e.g. the client disconnected, or its own deadline
+passed) stops waiting without cancelling the shared call for the others; the call
+itself is cancelled only when every waiter has gone. Pass a `context` (such as
+deadline.detached_context()) so the shared call does not inherit per-caller state
+from whichever caller happened to start it.
+"""
+
+import asyncio
+import hashlib
+
+
+def prompt_key(prompt):
+    """Coalescing key for an assembled prompt."""
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """
+    Stats: calls started, calls saved (callers that joined one already in flight),
+    failed calls, calls cancelled because all their waiters left, and in_flight.
+    """
+
+    def __init__(self):
+        self._flights = {}  # key -> [task, waiter count]
+        self.stats = {"started": 0, "saved": 0, "failed": 0, "abandoned": 0}
+
+    async def run(self, key, factory, context=None):
+        """
+        Awaits the in-flight call for key, starting factory() (a coroutine function)
+        if there is none; the task runs in `context` when given.
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            # A task copies the context current at creation, so create it inside `context`
+            task = context.run(lambda: asyncio.ensure_future(factory())) if context else asyncio.ensure_future(factory())
+            flight = self._flights[key] = [task, 0]
+            task.add_done_callback(lambda done: self._finish(key, done))
+            self.stats["started"] += 1
+        else:
+            self.stats["saved"] += 1
+
+        flight[1] += 1
+        try:
+            # shield: one waiter's cancellation must not cancel the shared call
+            return await asyncio.shield(flight[0])
+        except asyncio.CancelledError:
+            if not flight[0].done() and flight[1] == 1:
+                flight[0].cancel()
+                self.stats["abandoned"] += 1
+            raise
+        finally:
+            flight[1] -= 1
+
+    def _finish(self, key, task):
+        if self._flights.get(key, [None])[0] is task:
+            del self._flights[key]
+        if not task.cancelled() and task.exception() is not None:
+            self.stats["failed"] += 1
+
+    def snapshot(self):
+        return {**self.stats, "in_flight": len(self._flights)}
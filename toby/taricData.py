@@ -0,0 +1,148 @@
+"""
+TARIC nomenclature data for prompt building: chapters, 4-digit headings and the
+10-digit codes under each heading, cached. Codes come from the memory-mapped
+snapshot (taricSnapshot.py) when one has been built, else from
+scripts/setup_taric_db.py.
+
+With a snapshot, chapters, headings and description text are read from its columns
+and record dicts are built only for the prefix a caller asks for (get_prefix_codes),
+so no worker holds a dict per code.
+"""
+
+from functools import lru_cache
+import importlib.util
+import os
+
+import numpy as np
+
+from taricSnapshot import NO_STRING, STRING_COLUMNS, open_snapshot
+
+
+SETUP_SCRIPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts", "setup_taric_db.py")
+
+# Code descriptions shown per heading in the compact heading list
+HEADING_SUMMARY_ITEMS = 4
+
+
+@lru_cache(maxsize=1)
+def _setup_module():
+    """Loads scripts/setup_taric_db.py by path (it is a script, not a package)."""
+    spec = importlib.util.spec_from_file_location("setup_taric_db", SETUP_SCRIPT_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_setup_codes():
+    """Code records hard-coded in scripts/setup_taric_db.py (the snapshot's default source)."""
+    return _setup_module().get_taric_codes()
+
+
+@lru_cache(maxsize=1)
+def get_snapshot():
+    """The shared read-only TaricSnapshot (TARIC_SNAPSHOT path), or None if not built."""
+    return open_snapshot()
+
+
+@lru_cache(maxsize=1)
+def get_codes():
+    """
+    All TARIC code records (dicts with code, chapter, heading, description, ...).
+    With a snapshot this copies every row; prefer get_prefix_codes / code_chapters /
+    code_headings / prefix_texts.
+    """
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        return tuple(snapshot.records())
+    return tuple(load_setup_codes())
+
+
+def _code_prefixes(digits):
+    """Distinct 2- or 4-digit code prefixes, in code order."""
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        return tuple(f"{prefix:0{digits}d}" for prefix in np.unique(snapshot.codes // 10 ** (10 - digits)).tolist())
+    return tuple(sorted({code["code"].replace(".", "")[:digits] for code in get_codes()}))
+
+
+@lru_cache(maxsize=1)
+def code_chapters():
+    """2-digit chapters that have codes."""
+    return _code_prefixes(2)
+
+
+@lru_cache(maxsize=1)
+def code_headings():
+    """4-digit headings that have codes."""
+    return _code_prefixes(4)
+
+
+def get_prefix_codes(prefix):
+    """Code records whose code starts with a 2/4/6/8-digit prefix (e.g. a chapter or heading)."""
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        return snapshot.records(*snapshot.prefix_range(prefix))
+    digits = str(prefix).replace(".", "")
+    return [code for code in get_codes() if code["code"].replace(".", "").startswith(digits)]
+
+
+def prefix_texts(prefix, columns=("description", "description_short")):
+    """Distinct non-empty values of the given text columns among the codes under a prefix."""
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        start, stop = snapshot.prefix_range(prefix)
+        ids = snapshot.string_ids[[STRING_COLUMNS.index(column) for column in columns], start:stop]
+        return [snapshot.string(string_id) for string_id in np.unique(ids).tolist() if string_id != NO_STRING]
+    return list({code[column] for code in get_prefix_codes(prefix) for column in columns if code.get(column)})
+
+
+def _heading_shorts(heading, limit):
+    """The first `limit` distinct short descriptions (else descriptions) under a heading, in code order."""
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        start, stop = snapshot.prefix_range(heading)
+        description, short = (snapshot.string_ids[STRING_COLUMNS.index(column), start:stop]
+                              for column in ("description", "description_short"))
+        ids = dict.fromkeys(np.where(short != NO_STRING, short, description).tolist())
+        return [snapshot.string(string_id) for string_id in list(ids)[:limit]]
+    shorts = []
+    for code in get_prefix_codes(heading):
+        short = code.get("description_short") or code["description"]
+        if short not in shorts:
+            shorts.append(short)
+    return shorts[:limit]
+
+
+@lru_cache(maxsize=1)
+def get_chapters():
+    """Chapter metadata keyed by 2-digit chapter: {"30": {"title": ..., "section": ...}}."""
+    return {chapter["chapter"]: chapter for chapter in _setup_module().get_chapters_data()}
+
+
+@lru_cache(maxsize=1)
+def get_headings():
+    """
+    4-digit headings that have codes, with a compact label for stage-one prompts.
+
+    Returns:
+        dict: {heading: {"heading", "chapter", "chapter_title", "label"}}, in code order.
+    """
+    chapters = get_chapters()
+    headings = {}
+    for heading in code_headings():
+        chapter = heading[:2]
+        chapter_title = chapters.get(chapter, {}).get("title", "")
+        shorts = _heading_shorts(heading, HEADING_SUMMARY_ITEMS + 1)
+        label = "; ".join(shorts[:HEADING_SUMMARY_ITEMS]) + ("; ..." if len(shorts) > HEADING_SUMMARY_ITEMS else "")
+        headings[heading] = {
+            "heading": heading,
+            "chapter": chapter,
+            "chapter_title": chapter_title,
+            "label": label,
+        }
+    return headings
+
+
+def get_heading_subtree(heading):
+    """All 10-digit code records under a 4-digit heading."""
+    return get_prefix_codes(heading)
@@ -0,0 +1,187 @@
+"""
+Memory-mapped, columnar snapshot of the TARIC nomenclature.
+
+The snapshot is written once and opened read-only with mmap by every worker, so
+opening is constant-time and the pages are shared by all processes through the OS
+page cache instead of each worker building its own list of dicts.
+
+Layout (little-endian, every section 8-byte aligned):
+
+    header    magic "TARICSNP", version, row count, string count, section offsets
+    codes     int64[n]      numeric 10-digit codes, sorted; chapter / heading /
+                            subheading are derived from the digits
+    strings   uint32[3, n]  description, description_short, source_url as ids into
+                            the string table (NO_STRING when empty)
+    offsets   uint64[s + 1] start of each interned string in the blob
+    blob      UTF-8 bytes of every distinct string, stored once
+
+Usage:
+    python taricSnapshot.py build                   # from scripts/setup_taric_db.py
+    python taricSnapshot.py info [--path FILE]
+"""
+
+import argparse
+import mmap
+import os
+import struct
+import time
+
+import numpy as np
+
+
+MAGIC = b"TARICSNP"
+VERSION = 1
+NO_STRING = 0xFFFFFFFF
+STRING_COLUMNS = ("description", "description_short", "source_url")
+DEFAULT_PATH = os.getenv("TARIC_SNAPSHOT", os.path.join(os.path.dirname(os.path.abspath(__file__)), "taric_snapshot.bin"))
+
+# magic, version, rows, strings, then byte offsets of codes / string ids / offsets / blob and the blob length
+_HEADER = struct.Struct("<8sIIIQQQQQ")
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def write_snapshot(records, path=DEFAULT_PATH):
+    """
+    Writes records (dicts with "code" and the STRING_COLUMNS) as a snapshot file.
+    The file is replaced atomically, so running workers keep their old mapping.
+
+    Returns:
+        int: Number of rows written.
+    """
+    by_code = {}
+    for record in records:
+        by_code[int(str(record["code"]).replace(".", ""))] = record
+    codes = np.array(sorted(by_code), dtype=np.int64)
+
+    interned = {}
+    ids = np.full((len(STRING_COLUMNS), len(codes)), NO_STRING, dtype=np.uint32)
+    for i, code in enumerate(codes.tolist()):
+        record = by_code[code]
+        for column, name in enumerate(STRING_COLUMNS):
+            value = record.get(name)
+            if value:
+                ids[column, i] = interned.setdefault(value, len(interned))
+
+    encoded = [value.encode("utf-8") for value in interned]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+    offsets[1:] = np.cumsum([len(value) for value in encoded], dtype=np.uint64)
+    blob = b"".join(encoded)
+
+    codes_at = _align(_HEADER.size)
+    ids_at = _align(codes_at + codes.nbytes)
+    offsets_at = _align(ids_at + ids.nbytes)
+    blob_at = _align(offsets_at + offsets.nbytes)
+    header = _HEADER.pack(MAGIC, VERSION, len(codes), len(encoded), codes_at, ids_at, offsets_at, blob_at, len(blob))
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        for at, data in ((0, header), (codes_at, codes.tobytes()), (ids_at, ids.tobytes()),
+                         (offsets_at, offsets.tobytes()), (blob_at, blob)):
+            f.write(b"\0" * (at - f.tell()))
+            f.write(data)
+    os.replace(tmp_path, path)
+    return len(codes)
+
+
+class TaricSnapshot:
+    """Read-only view of a snapshot file; all columns are zero-copy NumPy views of the mapping."""
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, rows, strings, codes_at, ids_at, offsets_at, blob_at, blob_len = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} TARIC snapshot")
+
+        self.codes = np.frombuffer(self._mmap, dtype=np.int64, count=rows, offset=codes_at)
+        self.string_ids = np.frombuffer(self._mmap, dtype=np.uint32, count=len(STRING_COLUMNS) * rows,
+                                        offset=ids_at).reshape(len(STRING_COLUMNS), rows)
+        self._offsets = np.frombuffer(self._mmap, dtype=np.uint64, count=strings + 1, offset=offsets_at)
+        self._blob_at = blob_at
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def chapters(self):
+        return self.codes // 10**8
+
+    @property
+    def headings(self):
+        return self.codes // 10**6
+
+    def string(self, string_id):
+        """Interned string by id ("" for NO_STRING)."""
+        if string_id == NO_STRING:
+            return ""
+        start = self._blob_at + int(self._offsets[string_id])
+        end = self._blob_at + int(self._offsets[string_id + 1])
+        return self._mmap[start:end].decode("utf-8")
+
+    def find(self, code):
+        """Row index of a code ('3004.90.00.00', '3004900000' or int), or -1."""
+        key = int(str(code).replace(".", "").replace(" ", ""))
+        index = int(np.searchsorted(self.codes, key))
+        return index if index < len(self.codes) and self.codes[index] == key else -1
+
+    def prefix_range(self, prefix):
+        """(start, stop) rows whose code starts with a 2/4/6/8-digit prefix."""
+        digits = str(prefix).replace(".", "")
+        scale = 10 ** (10 - len(digits))
+        low = int(digits) * scale
+        return int(np.searchsorted(self.codes, low)), int(np.searchsorted(self.codes, low + scale))
+
+    def record(self, index):
+        """Row as a dict in the setup_taric_db.get_taric_codes() shape."""
+        numeric = f"{int(self.codes[index]):010d}"
+        record = {
+            "code": f"{numeric[:4]}.{numeric[4:6]}.{numeric[6:8]}.{numeric[8:]}",
+            "code_numeric": numeric,
+            "chapter": numeric[:2],
+            "heading": numeric[:4],
+            "subheading": numeric[:6],
+        }
+        for column, name in enumerate(STRING_COLUMNS):
+            record[name] = self.string(self.string_ids[column, index])
+        return record
+
+    def records(self, start=0, stop=None):
+        stop = len(self) if stop is None else stop
+        return [self.record(i) for i in range(start, stop)]
+
+    def close(self):
+        self.codes = self.string_ids = self._offsets = None
+        self._mmap.close()
+
+
+def open_snapshot(path=DEFAULT_PATH):
+    """The snapshot at path, or None if it has not been built."""
+    return TaricSnapshot(path) if os.path.exists(path) else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or inspect the TARIC nomenclature snapshot")
+    parser.add_argument("command", choices=["build", "info"])
+    parser.add_argument("--path", default=DEFAULT_PATH)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        from taricData import load_setup_codes
+        count = write_snapshot(load_setup_codes(), args.path)
+        print(f"Wrote {count} codes to {args.path} ({os.path.getsize(args.path) / 1024:.1f} KB)")
+    else:
+        started = time.perf_counter()
+        snapshot = TaricSnapshot(args.path)
+        opened = (time.perf_counter() - started) * 1000
+        headings = np.unique(snapshot.headings)
+        print(f"{args.path}: {len(snapshot)} codes, {len(np.unique(snapshot.chapters))} chapters, "
+              f"{len(headings)} headings, {len(snapshot._offsets) - 1} distinct strings, "
+              f"{os.path.getsize(args.path) / 1024:.1f} KB; opened in {opened:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
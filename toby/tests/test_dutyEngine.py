@@ -0,0 +1,63 @@
+import math
+
+import numpy as np
+import pytest
+
+from dutyEngine import DutyRateTable, code_keys, parse_rate
+
+NAN = float("nan")
+
+
+@pytest.mark.parametrize("rate, columns", [
+    ("3.2 %", (3.2, 0, 0, NAN, NAN, NAN, NAN, NAN, NAN)),
+    ("12.8 % + 17.6 EUR/100 kg MAX 22 %", (12.8, 0.176, 0, NAN, NAN, NAN, 22.0, 0, 0)),
+    ("8.3 % MIN 2.5 EUR/100 kg", (8.3, 0, 0, 0, 0.025, 0, NAN, NAN, NAN)),
+    ("2.7 EUR/1000 p/st", (0, 0, 0.0027, NAN, NAN, NAN, NAN, NAN, NAN)),
+    ("4,5 EUR / tonne", (0, 0.0045, 0, NAN, NAN, NAN, NAN, NAN, NAN)),
+    ("Free", (0, 0, 0, NAN, NAN, NAN, NAN, NAN, NAN)),
+    (6.5, (6.5, 0, 0, NAN, NAN, NAN, NAN, NAN, NAN)),
+])
+def test_parse_rate(rate, columns):
+    assert np.allclose(parse_rate(rate), columns, equal_nan=True)
+
+
+@pytest.mark.parametrize("rate", [None, "", "3.2 % + EA", "5 % + 2 EUR/hl", "MAX 5 %", "3 % MIN", "see note 4"])
+def test_parse_rate_rejects_unknown_text(rate):
+    assert parse_rate(rate) is None
+
+
+def test_code_keys_accepts_dotted_and_plain_codes():
+    assert code_keys(["0101.21.00.00", "3004900000"]).tolist() == [101210000, 3004900000]
+
+
+@pytest.fixture
+def table():
+    return DutyRateTable([
+        {"code": "3004.90.00.00", "duty_rate": {"erga_omnes": "6.5 %", "preferential": {"ch": "Free"}}},
+        {"code": "0101.21.00.00", "duty_rate": {"erga_omnes": "12.8 % + 17.6 EUR/100 kg MAX 22 %"}},
+        {"code": "2106.90.92.00", "duty_rate": {"erga_omnes": "3.2 % + EA", "preferential": {"CH": "2 %"}}},
+        {"code": "3822.00.00.00", "duty_rate": '{"erga_omnes": "8.3 % MIN 2.5 EUR/100 kg"}'},
+    ])
+
+
+def test_compute_applies_components_and_bounds(table):
+    result = table.compute(["3004.90.00.00", "0101.21.00.00", "0101.21.00.00", "3822.00.00.00"],
+                           [1000, 1000, 100, 10], net_mass_kg=[5, 100, 100, 100])
+    assert np.allclose(result["duty"], [65.0, 145.6, 22.0, 2.5])
+    assert result["found"].all()
+
+
+def test_compute_prefers_lower_preferential_rate(table):
+    result = table.compute(["3004.90.00.00", "3004.90.00.00"], [1000, 1000], origins=["CH", "US"])
+    assert result["duty"].tolist() == [0.0, 65.0]
+    assert result["preferential"].tolist() == [True, False]
+    assert result["ad_valorem_rate"].tolist() == [0.0, 6.5]
+
+
+def test_compute_unknown_code_and_unparsed_rate(table):
+    result = table.compute(["9999.99.99.99", "2106.90.92.00", "2106.90.92.00"], [100, 100, 100],
+                           origins=["US", "US", "CH"])
+    assert math.isnan(result["duty"][0]) and not result["found"][0]
+    # "3.2 % + EA" is not understood: unknown, not priced as 3.2 %; the preference still applies
+    assert math.isnan(result["duty"][1])
+    assert result["duty"][2] == pytest.approx(2.0)
@@ -0,0 +1,66 @@
+import os
+
+import numpy as np
+import pytest
+
+from nearDuplicate import NUM_PERM, NearDuplicateIndex, minhash_signature, normalize_text
+
+SHEET = """Product Specification Sheet
+Product name: Paracetamol 500 mg film-coated tablets
+Composition: each tablet contains paracetamol 500 mg, maize starch, povidone, magnesium stearate
+Pharmaceutical form: tablets for oral use, packed in PVC/aluminium blisters of 20 tablets for retail sale
+Storage: store below 25 C in the original package, protect from light and moisture
+Shelf life: 36 months from the date of manufacture
+Issued: 2024-03-01   Lot No. AB12345   Page 1 of 2"""
+
+REISSUED = SHEET.replace("2024-03-01", "12/09/2025").replace("AB12345", "ZX-998877").replace("Page 1 of 2", "Page 2 of 3")
+
+OTHER = """Safety Data Sheet
+Product name: Ethanol 96 % denatured, technical grade
+Hazards: highly flammable liquid and vapour, causes serious eye irritation
+Composition: ethanol 64-17-5 90-96 %, methyl ethyl ketone 1 %
+Transport: UN 1170, class 3, packing group II"""
+
+
+def similarity(a, b):
+    return float(np.mean(minhash_signature(a) == minhash_signature(b)))
+
+
+def test_normalize_text_drops_dates_lots_and_pages():
+    assert normalize_text(SHEET) == normalize_text(REISSUED)
+
+
+def test_signature_is_deterministic():
+    signature = minhash_signature(SHEET)
+    assert signature.shape == (NUM_PERM,) and signature.dtype == np.uint32
+    assert np.array_equal(signature, minhash_signature(SHEET))
+
+
+def test_similarity_separates_reissues_from_other_sheets():
+    assert similarity(SHEET, REISSUED) == 1.0
+    assert similarity(SHEET, SHEET.replace("36 months", "24 months")) > 0.7
+    assert similarity(SHEET, OTHER) < 0.2
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = NearDuplicateIndex(str(tmp_path / "data" / "near.db"), threshold=0.9)
+    yield index
+    index.close()
+
+
+def test_index_file_is_created_on_first_add(index):
+    assert index.query(SHEET) is None
+    assert not os.path.exists(index.path)
+    index.add(SHEET, {"hs_code": "3004.90.00.00", "raw_response": "dropped"})
+    assert os.path.exists(index.path)
+
+
+def test_query_returns_the_near_duplicate(index):
+    index.add(OTHER, {"hs_code": "2207.20.00.00"})
+    index.add(SHEET, {"hs_code": "3004.90.00.00", "raw_response": "dropped"})
+    result, score = index.query(REISSUED)
+    assert result == {"hs_code": "3004.90.00.00"}
+    assert score == 1.0
+    assert index.query(SHEET.replace("Paracetamol", "Ibuprofen").replace("paracetamol", "ibuprofen")) is None
+    assert index.query("Completely unrelated text about invoice totals and shipping terms") is None
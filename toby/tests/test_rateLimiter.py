@@ -0,0 +1,60 @@
+import sqlite3
+import time
+
+import pytest
+
+from rateLimiter import TokenBucketLimiter, estimate_tokens
+
+
+def limiter(tmp_path, **kwargs):
+    return TokenBucketLimiter(str(tmp_path / "limit.db"), **kwargs)
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("x" * 400) == 100
+    assert estimate_tokens("") == 1
+
+
+def test_no_quota_never_waits(tmp_path):
+    assert limiter(tmp_path).acquire(10_000) == 0.0
+
+
+def test_full_bucket_admits_a_minute_of_quota_then_times_out(tmp_path):
+    bucket = limiter(tmp_path, requests_per_minute=3)
+    for _ in range(3):
+        assert bucket.acquire(timeout=0.1) < 0.1
+    with pytest.raises(TimeoutError):
+        bucket.acquire(timeout=0.1)
+    assert bucket.stats["acquired"] == 3
+    assert bucket.stats["timed_out"] == 1
+
+
+def test_oversized_request_is_clipped_to_the_token_quota(tmp_path):
+    bucket = limiter(tmp_path, tokens_per_minute=100)
+    assert bucket.acquire(tokens=1000, timeout=0.1) < 0.1
+
+
+def test_release_returns_the_quota(tmp_path):
+    bucket = limiter(tmp_path, requests_per_minute=1, tokens_per_minute=100)
+    bucket.acquire(tokens=100)
+    bucket.release(tokens=100)
+    assert bucket.acquire(tokens=100, timeout=0.1) < 0.1
+    assert bucket.stats["released"] == 1
+
+
+def test_quota_is_shared_through_the_file(tmp_path):
+    first = limiter(tmp_path, requests_per_minute=2)
+    second = limiter(tmp_path, requests_per_minute=2)
+    first.acquire()
+    second.acquire()
+    with pytest.raises(TimeoutError):
+        first.acquire(timeout=0.1)
+
+
+def test_ticket_of_a_dead_process_expires(tmp_path):
+    bucket = limiter(tmp_path, requests_per_minute=60, heartbeat=0.05, ticket_ttl=0.3)
+    # A ticket at the head of the queue that nobody refreshes any more
+    with sqlite3.connect(str(tmp_path / "limit.db")) as conn:
+        conn.execute("INSERT INTO tickets (seen) VALUES (?)", (time.time(),))
+    waited = bucket.acquire(timeout=5)
+    assert 0.2 < waited < 1.0
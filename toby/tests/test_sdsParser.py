@@ -0,0 +1,84 @@
+import pytest
+
+from sdsParser import (extract_cas_numbers, extract_composition, extract_hazard_statements, is_valid_cas, parse_sds,
+                       split_sections, text_from_page_records)
+
+SDS = """SAFETY DATA SHEET
+SECTION 1: Identification of the substance/mixture
+Product name: Methanol solution
+SECTION 2: Hazards identification
+H225 Highly flammable liquid and vapour.
+H301+H311+H331: Toxic if swallowed, in contact with skin or if inhaled.
+H301 Toxic if swallowed.
+H370 Causes damage to organs.
+SECTION 3: Composition/information on ingredients
+Methanol CAS No. 67-56-1 60-80 %
+Water 7732-18-5 20-40 %
+Lot 12-34-5
+SECTION 4: First aid measures
+1. Move to fresh air.
+2. Rinse skin with water.
+SECTION 9: Physical and chemical properties
+Appearance: clear liquid
+SECTION 14: Transport information
+UN 1230
+"""
+
+
+@pytest.mark.parametrize("cas, valid", [("7732-18-5", True), ("67-56-1", True), ("64-17-5", True),
+                                        ("7732-18-4", False), ("12-34-5", False), ("7732185", False)])
+def test_is_valid_cas(cas, valid):
+    assert is_valid_cas(cas) is valid
+
+
+def test_split_sections_ignores_numbered_lists():
+    sections = split_sections(SDS)
+    assert sorted(sections) == [1, 2, 3, 4, 9, 14]
+    assert "Move to fresh air" in sections[4]
+
+
+def test_cas_numbers_and_composition():
+    assert extract_cas_numbers(SDS) == ["67-56-1", "7732-18-5"]
+    assert extract_composition(split_sections(SDS)[3]) == ["Methanol (CAS 67-56-1) 60-80 %", "Water (CAS 7732-18-5) 20-40 %"]
+
+
+def test_hazard_statements_are_listed_once():
+    assert extract_hazard_statements(split_sections(SDS)[2]) == [
+        "H225: Highly flammable liquid and vapour.",
+        "H301+H311+H331: Toxic if swallowed, in contact with skin or if inhaled.",
+        "H370: Causes damage to organs",  # section bodies are trimmed of trailing punctuation
+    ]
+
+
+@pytest.mark.parametrize("text, statements", [
+    ("H302 H315", ["H302", "H315"]),
+    ("H300 Fatal if swallowed\nH300 + H330: Fatal if swallowed or if inhaled", ["H300+H330: Fatal if swallowed or if inhaled"]),
+    ("H302: Harmful if swallowed | EUH066: Repeated exposure may cause skin dryness",
+     ["H302: Harmful if swallowed", "EUH066: Repeated exposure may cause skin dryness"]),
+    ("H302 Harmful\nH302 Harmful if swallowed", ["H302: Harmful"]),
+])
+def test_hazard_statement_forms(text, statements):
+    assert extract_hazard_statements(text) == statements
+
+
+def test_parse_sds_keeps_relevant_sections():
+    parsed = parse_sds(SDS)
+    assert parsed["cas_numbers"] == ["67-56-1", "7732-18-5"]
+    assert len(parsed["safety_warnings"]) == 3
+    assert "SECTION 14" in parsed["relevant_text"]
+    assert "fresh air" not in parsed["relevant_text"]
+
+
+def test_parse_sds_falls_back_for_plain_spec_sheets():
+    text = "Paracetamol 500 mg tablets\nH302 Harmful if swallowed"
+    parsed = parse_sds(text)
+    assert parsed["sections"] == {}
+    assert parsed["relevant_text"] == text
+    assert parsed["safety_warnings"] == ["H302: Harmful if swallowed"]
+
+
+def test_text_from_page_records_joins_table_rows():
+    records = [{"text": "SECTION 3: Composition", "tables": [[["Ethanol", "64-17-5", "10-20 %"]]]}]
+    text = text_from_page_records(records)
+    assert text == "SECTION 3: Composition\nEthanol | 64-17-5 | 10-20 %"
+    assert extract_composition(text) == ["Ethanol (CAS 64-17-5) 10-20 %"]
@@ -0,0 +1,41 @@
+import pytest
+
+from buildPrompt import validateHeading, validateHsCode
+
+HEADINGS = {"3002", "3004", "2106"}
+
+
+@pytest.mark.parametrize("code, normalized", [
+    ("3004.90.00.00", "3004.90.00.00"),
+    ("3004900000", "3004.90.00.00"),
+    ("3004 90 00 00", "3004.90.00.00"),
+    ("3002.15.00", "3002.15.00.00"),
+    ("30021500", "3002.15.00.00"),
+])
+def test_accepts_taric_and_cn_codes(code, normalized):
+    assert validateHsCode(code, valid_prefixes=HEADINGS) == {"valid": True, "normalized": normalized}
+
+
+@pytest.mark.parametrize("code", ["3004", "3004.90", "300490", "3004.90.00.00.00", "30049000001", "abcd.90.00.00", ""])
+def test_rejects_other_formats(code):
+    result = validateHsCode(code, valid_prefixes=HEADINGS)
+    assert not result["valid"]
+    assert result["error"] == "Invalid HS code format"
+
+
+def test_rejects_unknown_heading():
+    result = validateHsCode("9018.31.10.00", valid_prefixes=HEADINGS)
+    assert not result["valid"]
+    assert result["normalized"] == "9018.31.10.00"
+    assert "9018" in result["error"]
+
+
+def test_defaults_to_the_rules_registry_headings():
+    assert validateHsCode("3004.90.00.00")["valid"]
+
+
+def test_heading_validation_is_separate():
+    assert validateHeading("3004", valid_prefixes=HEADINGS) == {"valid": True, "normalized": "3004"}
+    assert validateHeading("30.04", valid_prefixes=HEADINGS)["normalized"] == "3004"
+    assert not validateHeading("9018", valid_prefixes=HEADINGS)["valid"]
+    assert not validateHeading("3004.90.00.00", valid_prefixes=HEADINGS)["valid"]